@@ -13,11 +13,12 @@ Units used in this file:
 import pandas as pd
 import numpy as np
 from collections import deque
-from typing import Tuple
+from typing import Optional, Tuple
 
 INTERVAL_DURATION = 5  # Duration of each dispatch interval in minutes
 PRICE_KEY = 'price'
 TIMESTAMP_KEY = 'timestamp'
+ORDER_SCAN_WINDOW = 32  # Initial number of intervals scanned at once when resolving a ConditionalOrder
 
 class Battery:
     """
@@ -53,8 +54,7 @@ class Battery:
         :param duration: Duration in minutes for which the battery is charged.
         :return: Energy added to the battery in kWh.
         """
-        kW = min(kW, self.max_charge_rate_kW)
-        energy_add_order = kW * (INTERVAL_DURATION / 60) * self.efficiency  # Convert power (kW) to energy (kWh)
+        energy_add_order = self.charge_order_kWh(kW)
         energy_added = min(energy_add_order, self.capacity_kWh - self._state_of_charge_kWh)
         self._state_of_charge_kWh = min(self._state_of_charge_kWh + energy_add_order, self.capacity_kWh)
         return energy_added
@@ -67,17 +67,70 @@ class Battery:
         :param duration: Duration in minutes for which the battery is discharged.
         :return: Energy removed from the battery in kWh.
         """
-        kW = min(kW, self.max_discharge_rate_kW)
-        energy_remove_order = kW * (INTERVAL_DURATION / 60) / self.efficiency  # Convert power (kW) to energy (kWh)
+        energy_remove_order = self.discharge_order_kWh(kW)
         energy_removed = min(energy_remove_order, self._state_of_charge_kWh)
         self._state_of_charge_kWh = max(self._state_of_charge_kWh - energy_remove_order, 0)
         return energy_removed
 
+    def charge_order_kWh(self, kW: float) -> float:
+        """
+        Energy that charging at the given power for one interval would add, before the capacity limit.
+
+        :param kW: Power in kW to charge the battery.
+        :return: Energy in kWh.
+        """
+        kW = min(kW, self.max_charge_rate_kW)
+        return kW * (INTERVAL_DURATION / 60) * self.efficiency  # Convert power (kW) to energy (kWh)
+
+    def discharge_order_kWh(self, kW: float) -> float:
+        """
+        Energy that discharging at the given power for one interval would remove, before the empty limit.
+
+        :param kW: Power in kW to discharge the battery.
+        :return: Energy in kWh.
+        """
+        kW = min(kW, self.max_discharge_rate_kW)
+        return kW * (INTERVAL_DURATION / 60) / self.efficiency  # Convert power (kW) to energy (kWh)
+
     @property
     def state_of_charge_kWh(self) -> float:
         return self._state_of_charge_kWh
 
 
+class ConditionalOrder:
+    """
+    An action that holds a fixed charge/discharge rate over several intervals.
+
+    The order is applied to the interval it is issued in, and then to each following interval
+    until one of its conditions fires. Control returns to the policy on the interval where the
+    condition fired, so the policy is not consulted for the intervals in between.
+    """
+    def __init__(self, quantity: float, price_above: Optional[float] = None, price_below: Optional[float] = None,
+                 max_steps: Optional[int] = None, until_soc_limit: bool = True):
+        """
+        Initialize the order with the given parameters.
+
+        :param quantity: Power in kW to charge (positive) or discharge (negative) at each interval.
+        :param price_above: Return control once the market price is greater than this value (default: None).
+        :param price_below: Return control once the market price is less than this value (default: None).
+        :param max_steps: Maximum number of intervals the order is held for (default: None, no limit).
+        :param until_soc_limit: Return control once the battery is full when charging, or empty when
+            discharging (default: True).
+        """
+        if max_steps is not None and max_steps < 1:
+            raise ValueError(f"max_steps must be at least 1, got {max_steps}")
+        self.quantity = quantity
+        self.price_above = price_above
+        self.price_below = price_below
+        self.max_steps = max_steps
+        self.until_soc_limit = until_soc_limit
+
+    def __repr__(self) -> str:
+        return (f"ConditionalOrder(quantity={self.quantity}, price_above={self.price_above}, "
+                f"price_below={self.price_below}, max_steps={self.max_steps}, "
+                f"until_soc_limit={self.until_soc_limit})")
+
+
 class BatteryEnv:
     """
     Environment for simulating battery operation in the National Electricity Market (NEM) context.
@@ -98,6 +151,7 @@ class BatteryEnv:
         self.total_profit = 0
         self.current_step = 0
         self.episode_length = len(self.market_data)
+        self._prices = None
 
     def initial_state(self):
         assert self.current_step == 0
@@ -119,6 +173,114 @@ class BatteryEnv:
         market_data = self.market_data.iloc[self.current_step]
         return market_data, self.get_info(profit_delta)
     
+    def step_order(self, order: ConditionalOrder) -> Tuple[pd.Series, dict, dict]:
+        """
+        Hold a conditional order until one of its conditions fires, or the episode ends.
+
+        The stopping interval is found with a vectorized scan over the market prices and the battery's
+        state of charge, and the accounting is identical to calling `step` with `order.quantity` once per interval.
+
+        :param order: The conditional order to resolve.
+        :return: A tuple containing the next market data and information dictionary, or (None, None) if the episode
+            is done, and a dictionary of lists ('profits', 'socs', 'market_prices', 'timestamps', 'actions') describing
+            the intervals after the first one that were covered by the order without consulting the policy.
+        """
+        skipped = {'profits': [], 'socs': [], 'market_prices': [], 'timestamps': [], 'actions': []}
+        start = self.current_step
+        last = len(self.market_data) - 1
+        if start >= last:
+            return None, None, skipped
+
+        if self._prices is None:
+            self._prices = self.market_data[PRICE_KEY].to_numpy()
+        horizon = last if order.max_steps is None else min(last, start + order.max_steps)
+
+        # Scan in doubling windows so that short orders do not pay for the rest of the episode
+        soc_chunks, energy_chunks = [np.array([self.battery.state_of_charge_kWh])], []
+        position, window, end = start, ORDER_SCAN_WINDOW, None
+        while position < horizon:
+            num_steps = min(window, horizon - position)
+            socs, energies = self._order_trajectory(order.quantity, soc_chunks[-1][-1], num_steps)
+            next_prices = self._prices[position + 1:position + num_steps + 1]
+            stop = np.zeros(num_steps, dtype=bool)
+            if order.price_above is not None:
+                stop |= next_prices > order.price_above
+            if order.price_below is not None:
+                stop |= next_prices < order.price_below
+            if order.until_soc_limit:
+                if order.quantity > 0:
+                    stop |= socs[1:] >= self.battery.capacity_kWh
+                elif order.quantity < 0:
+                    stop |= socs[1:] <= 0
+            if position + num_steps == start + (order.max_steps or 0):
+                stop[-1] = True
+            if stop.any():
+                num_steps = int(np.argmax(stop)) + 1
+                end = position + num_steps  # control returns to the policy here
+            soc_chunks.append(socs[1:num_steps + 1])
+            energy_chunks.append(energies[:num_steps])
+            position += num_steps
+            window *= 2
+            if end is not None:
+                break
+        if end is None:
+            end = last + 1  # the order covers the last row, which is never processed
+
+        socs = np.concatenate(soc_chunks)
+        energies = np.concatenate(energy_chunks)
+        prices = self._prices[start:position]
+        if order.quantity > 0:
+            profit_deltas = -np.round(energies * prices / 1000, 2)
+        elif order.quantity < 0:
+            profit_deltas = np.round(energies * prices / 1000, 2)
+        else:
+            profit_deltas = np.zeros(len(prices))
+        total_profits = np.cumsum(np.concatenate(([self.total_profit], profit_deltas)))
+
+        skipped['profits'] = total_profits[1:end - start].tolist()
+        skipped['socs'] = socs[1:end - start].tolist()
+        skipped['market_prices'] = self._prices[start + 1:end].tolist()
+        skipped['timestamps'] = self.market_data[TIMESTAMP_KEY].iloc[start + 1:end].tolist()
+        skipped['actions'] = [order.quantity] * (end - start - 1)
+
+        self.battery._state_of_charge_kWh = float(socs[-1])
+        self.current_step = position
+        if end > last:
+            self.total_profit = float(total_profits[-1])
+            return None, None, skipped
+
+        self.total_profit = float(total_profits[-2])
+        market_data = self.market_data.iloc[self.current_step]
+        return market_data, self.get_info(float(profit_deltas[-1])), skipped
+
+    def _order_trajectory(self, quantity: float, soc: float, num_steps: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Battery state of charge and energy moved when holding a quantity for a number of intervals.
+
+        Cumulative sums accumulate left to right, so the results match repeated calls to
+        `Battery.charge_kW` or `Battery.discharge_kW` exactly.
+
+        :param quantity: Power in kW to charge (positive) or discharge (negative).
+        :param soc: State of charge in kWh before the first interval.
+        :param num_steps: Number of intervals.
+        :return: The state of charge before each interval and after the last one (num_steps + 1 values),
+            and the energy added or removed at each interval (num_steps values).
+        """
+        if quantity > 0:
+            energy_order = self.battery.charge_order_kWh(quantity)
+            socs = np.cumsum(np.concatenate(([soc], np.full(num_steps, energy_order))))
+            socs = np.minimum(socs, self.battery.capacity_kWh)
+            energies = np.minimum(energy_order, self.battery.capacity_kWh - socs[:-1])
+        elif quantity < 0:
+            energy_order = self.battery.discharge_order_kWh(-quantity)
+            socs = np.cumsum(np.concatenate(([soc], np.full(num_steps, -energy_order))))
+            socs = np.maximum(socs, 0)
+            energies = np.minimum(energy_order, socs[:-1])
+        else:
+            socs = np.full(num_steps + 1, soc, dtype=float)
+            energies = np.zeros(num_steps)
+        return socs, energies
+
     def get_profit(self, energy_removed: float, spot_price_mWh: float) -> float:
         return round(energy_removed * spot_price_mWh / 1000, 2) # Convert energy (kWh) to revenue ($)
 
@@ -154,4 +316,140 @@ class BatteryEnv:
             'max_charge_rate': self.battery.max_charge_rate_kW,
             'max_discharge_rate': self.battery.max_discharge_rate_kW,
             'remaining_steps': remaining_steps
-        }
\ No newline at end of file
+        }
+
+class BatteryPortfolio:
+    """
+    A fleet of batteries with charging and discharging capabilities, held as arrays with one entry per battery.
+    Each battery behaves exactly like a `Battery` with the same parameters.
+    """
+    def __init__(self, capacity, charge_rate, discharge_rate, initial_charge, efficiency=0.9):
+        """
+        Initialize the batteries with the given parameters. Each parameter is either an array with one entry
+        per battery, or a scalar shared by all the batteries.
+
+        :param capacity: Maximum energy capacity of each battery in kWh.
+        :param charge_rate: Maximum charging rate of each battery in kW.
+        :param discharge_rate: Maximum discharging rate of each battery in kW.
+        :param initial_charge: Initial state of charge of each battery in kWh.
+        :param efficiency: Charging and discharging efficiency of each battery (default: 0.9).
+        """
+        (self.capacity_kWh, self.max_charge_rate_kW, self.max_discharge_rate_kW,
+         self.initial_charge_kWh, self.efficiency) = np.broadcast_arrays(
+            *[np.asarray(value, dtype=float) for value in
+              (capacity, charge_rate, discharge_rate, initial_charge, efficiency)])
+        if self.capacity_kWh.ndim != 1:
+            raise ValueError(f"Battery parameters must be scalars or 1-D arrays, got shape {self.capacity_kWh.shape}")
+        self._state_of_charge_kWh = np.minimum(self.initial_charge_kWh, self.capacity_kWh)
+
+    def __len__(self) -> int:
+        return len(self.capacity_kWh)
+
+    def reset(self):
+        """Reset the batteries to their initial state of charge."""
+        self._state_of_charge_kWh = np.minimum(self.initial_charge_kWh, self.capacity_kWh)
+
+    def apply_kW(self, kW: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Charge (positive) or discharge (negative) each battery with the specified power for one interval.
+
+        :param kW: Array of power in kW, one per battery.
+        :return: A tuple containing the energy added to, and the energy removed from, each battery in kWh.
+        """
+        kW = np.broadcast_to(np.asarray(kW, dtype=float), self.capacity_kWh.shape)
+        soc = self._state_of_charge_kWh
+        charging = kW > 0
+        discharging = kW < 0
+
+        # Convert power (kW) to energy (kWh)
+        energy_add_order = np.minimum(kW, self.max_charge_rate_kW) * (INTERVAL_DURATION / 60) * self.efficiency
+        energy_remove_order = np.minimum(-kW, self.max_discharge_rate_kW) * (INTERVAL_DURATION / 60) / self.efficiency
+
+        energy_added = np.where(charging, np.minimum(energy_add_order, self.capacity_kWh - soc), 0.0)
+        energy_removed = np.where(discharging, np.minimum(energy_remove_order, soc), 0.0)
+        soc = np.where(charging, np.minimum(soc + energy_add_order, self.capacity_kWh), soc)
+        self._state_of_charge_kWh = np.where(discharging, np.maximum(soc - energy_remove_order, 0), soc)
+        return energy_added, energy_removed
+
+    @property
+    def state_of_charge_kWh(self) -> np.ndarray:
+        return self._state_of_charge_kWh
+
+
+class PortfolioEnv:
+    """
+    Environment for simulating a portfolio of heterogeneous batteries trading against the same market prices.
+    """
+    def __init__(self, data, capacity_kWh=13, charge_rate_kW=5, discharge_rate_kW=5, initial_charge=7.5,
+                 efficiency=0.9):
+        """
+        Initialize the portfolio environment with the given parameters. Each battery parameter is either an
+        array with one entry per battery, or a scalar shared by all the batteries.
+
+        :param data: Market data, one row per dispatch interval.
+        :param capacity_kWh: Maximum energy capacity of each battery in kWh (default: 13).
+        :param charge_rate_kW: Maximum charging rate of each battery in kW (default: 5).
+        :param discharge_rate_kW: Maximum discharging rate of each battery in kW (default: 5).
+        :param initial_charge: Initial state of charge of each battery in kWh (default: 7.5).
+        :param efficiency: Charging and discharging efficiency of each battery (default: 0.9).
+        """
+        self.batteries = BatteryPortfolio(capacity_kWh, charge_rate_kW, discharge_rate_kW, initial_charge,
+                                          efficiency=efficiency)
+        self.market_data = data
+        self.total_profit = np.zeros(len(self.batteries))
+        self.current_step = 0
+        self.episode_length = len(self.market_data)
+
+    def initial_state(self):
+        assert self.current_step == 0
+
+        return self.market_data.iloc[self.current_step], self.get_info(np.zeros(len(self.batteries)))
+
+    def step(self, quantities: np.ndarray) -> Tuple[pd.Series, dict]:
+        """
+        Perform a single step in the environment based on the given actions.
+
+        :param quantities: Array of quantities (kW) to charge (positive) or discharge (negative), one per battery.
+        :return: A tuple containing the next market data and information dictionary, or (None, None) if the episode is done.
+        """
+        if self.current_step >= len(self.market_data) - 1:
+            return None, None
+        market_price = self.market_data.iloc[self.current_step][PRICE_KEY]
+        profit_deltas = self.process_actions(quantities, market_price)
+        self.current_step += 1
+        market_data = self.market_data.iloc[self.current_step]
+        return market_data, self.get_info(profit_deltas)
+
+    def get_profit(self, energy_removed: np.ndarray, spot_price_mWh: float) -> np.ndarray:
+        return np.round(energy_removed * spot_price_mWh / 1000, 2)  # Convert energy (kWh) to revenue ($)
+
+    def process_actions(self, quantities: np.ndarray, spot_price: float) -> np.ndarray:
+        """
+        Process the actions taken by the agent and return the profit delta of each battery.
+
+        :param quantities: Array of quantities (kW), one per battery.
+        :param spot_price: The current spot price in $/MWh.
+        :return: Array of profit deltas in dollars, one per battery.
+        """
+        energy_added, energy_removed = self.batteries.apply_kW(quantities)
+        return self.get_profit(energy_removed, spot_price) - self.get_profit(energy_added, spot_price)
+
+    def get_info(self, profit_deltas: np.ndarray) -> dict:
+        """
+        Return a dictionary containing relevant information for the agent.
+
+        :param profit_deltas: Array of the change in profit of each battery from the last actions.
+        :return: A dictionary containing information about the current state of the environment, where the
+            per-battery entries are arrays with one entry per battery.
+        """
+        self.total_profit = self.total_profit + profit_deltas
+        remaining_steps = len(self.market_data) - self.current_step - 1
+        return {
+            'total_profit': self.total_profit,
+            'profit_delta': profit_deltas,
+            'portfolio_profit': float(self.total_profit.sum()),
+            'battery_soc': self.batteries.state_of_charge_kWh,
+            'max_charge_rate': self.batteries.max_charge_rate_kW,
+            'max_discharge_rate': self.batteries.max_discharge_rate_kW,
+            'remaining_steps': remaining_steps
+        }
@@ -10,9 +10,10 @@ import tqdm
 import json
 
 from policies import policy_classes
-from environment import BatteryEnv, PRICE_KEY, TIMESTAMP_KEY
-from plotting import plot_results
+from environment import BatteryEnv, ConditionalOrder, PRICE_KEY, TIMESTAMP_KEY
+from plotting import DEFAULT_MAX_POINTS, export_downsampled, plot_results, render_trials
 
+CHECKPOINT_SUFFIX = '.checkpoint'  # Sidecar file, next to the output file, holding the trial plan and completed trials
 
 def load_config(file_path):
     with open(file_path, 'r') as file:
@@ -22,6 +23,49 @@ def set_seed(seed):
     random.seed(seed)
     np.random.seed(seed)
 
+def get_random_state():
+    np_state = np.random.get_state()
+    return {
+        'random': random.getstate(),
+        'numpy': [np_state[0], np_state[1].tolist(), *np_state[2:]]
+    }
+
+def restore_random_state(state):
+    version, internal_state, gauss_next = state['random']
+    random.setstate((version, tuple(internal_state), gauss_next))
+    name, keys, pos, has_gauss, cached_gaussian = state['numpy']
+    np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
+
+def load_checkpoint(checkpoint_file, plan):
+    """
+    Load the completed trials from a checkpoint written by an interrupted evaluation.
+
+    :param checkpoint_file: Path to the checkpoint sidecar file.
+    :param plan: The trial plan of the current evaluation, which must match the one in the checkpoint.
+    :return: A list of checkpoint records, one per completed trial, in trial order.
+    """
+    with open(checkpoint_file, 'r') as file:
+        lines = file.readlines()
+
+    if not lines or json.loads(lines[0]) != json.loads(json.dumps(plan)):
+        raise ValueError(f'Checkpoint {checkpoint_file} was written for a different evaluation')
+
+    records = []
+    for line in lines[1:]:
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            break  # The last line may have been cut short when the evaluation was interrupted
+    return records
+
+def write_checkpoint(checkpoint_file, plan, records):
+    temporary_file = checkpoint_file + '.tmp'
+    with open(temporary_file, 'w') as file:
+        file.write(json.dumps(plan) + '\n')
+        for record in records:
+            file.write(json.dumps(record) + '\n')
+    os.replace(temporary_file, checkpoint_file)
+
 def run_down_battery(battery_environment: BatteryEnv, market_prices):
     last_day_prices = market_prices[-288:]
     assumed_rundown_price = np.mean(last_day_prices)
@@ -44,9 +88,18 @@ def run_trial(battery_environment, policy):
         socs.append(info['battery_soc'])
         market_prices.append(state[PRICE_KEY])
         timestamps.append(state[TIMESTAMP_KEY])
-        actions.append(action)
 
-        state, info = battery_environment.step(action)
+        if isinstance(action, ConditionalOrder):
+            actions.append(action.quantity)
+            state, info, skipped = battery_environment.step_order(action)
+            profits.extend(skipped['profits'])
+            socs.extend(skipped['socs'])
+            market_prices.extend(skipped['market_prices'])
+            timestamps.extend(skipped['timestamps'])
+            actions.extend(skipped['actions'])
+        else:
+            actions.append(action)
+            state, info = battery_environment.step(action)
 
         if state is None:
             break
@@ -90,9 +143,6 @@ def perform_eval(args):
 
     set_seed(args.seed)
 
-    total_profits = []
-    total_rundown_profits = []
-    all_trials = []
     start_steps = [args.present_index]
     episode_lengths = [len(external_states) - args.present_index]
 
@@ -104,27 +154,60 @@ def perform_eval(args):
         episode_length = random.randint(1, len(external_states) - start_step)
         episode_lengths.append(episode_length)
         start_steps.append(start_step)
-    
-    for start_step, episode_length in zip(start_steps, episode_lengths):
-        historical_data = external_states.iloc[:start_step]
-        future_data = external_states.iloc[start_step:start_step + episode_length]
-
-        battery_environment = BatteryEnv(data=future_data)
-
-        policy = policy_class(**policy_config.get('parameters', {}))
-        policy.load_historical(historical_data)
 
-        trial_data = run_trial(battery_environment, policy)
+    plan = {
+        'class_name': policy_config['class_name'],
+        'parameters': policy_config.get('parameters', {}),
+        'data': args.data,
+        'seed': args.seed,
+        'present_index': args.present_index,
+        'start_steps': start_steps,
+        'episode_lengths': episode_lengths
+    }
+    checkpoint_file = output_file + CHECKPOINT_SUFFIX
+    records = []
+    if args.resume and os.path.exists(checkpoint_file):
+        records = load_checkpoint(checkpoint_file, plan)
+        print(f'Resuming from {checkpoint_file}: {len(records)} of {len(start_steps)} trials already completed')
+        if records:
+            restore_random_state(records[-1]['random_state'])
+    write_checkpoint(checkpoint_file, plan, records)
+
+    all_trials = [record['trial'] for record in records]
+    previous_seconds_elapsed = records[-1]['seconds_elapsed'] if records else 0
+    with open(checkpoint_file, 'a') as checkpoint:
+        for start_step, episode_length in list(zip(start_steps, episode_lengths))[len(records):]:
+            historical_data = external_states.iloc[:start_step]
+            future_data = external_states.iloc[start_step:start_step + episode_length]
+
+            battery_environment = BatteryEnv(data=future_data)
+
+            policy = policy_class(**policy_config.get('parameters', {}))
+            policy.load_historical(historical_data)
+
+            trial_data = run_trial(battery_environment, policy)
+
+            _trial_data = trial_data.copy()
+            _trial_data['start_step'] = start_step
+            _trial_data['episode_length'] = episode_length
+
+            all_trials.append(_trial_data)
+
+            record = {
+                'trial': _trial_data,
+                'random_state': get_random_state(),
+                'seconds_elapsed': previous_seconds_elapsed + time.time() - start
+            }
+            checkpoint.write(json.dumps(record) + '\n')
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
 
+    total_profits = []
+    total_rundown_profits = []
+    for trial_data in all_trials:
         total_profits.extend(trial_data['profits'])
         total_rundown_profits.extend(trial_data['rundown_profits'])
 
-        _trial_data = trial_data.copy()
-        _trial_data['start_step'] = start_step
-        _trial_data['episode_length'] = episode_length
-
-        all_trials.append(_trial_data)
-
     mean_profit = float(np.mean(total_profits))
     std_profit = float(np.std(total_profits))
 
@@ -140,7 +223,7 @@ def perform_eval(args):
         'score': mean_combined_profit,
         'trials': all_trials,
         'main_trial_idx': 0,
-        'seconds_elapsed': time.time() - start 
+        'seconds_elapsed': previous_seconds_elapsed + time.time() - start
     }
 
     print(f'Average profit ($): {mean_profit:.2f} ± {std_profit:.2f}')
@@ -148,14 +231,21 @@ def perform_eval(args):
 
     with open(output_file, 'w') as file:
         json.dump(outcome, file, indent=2)
+    os.remove(checkpoint_file)
 
     if args.plot:
         main_trial = outcome['trials'][outcome['main_trial_idx']]
         plot_results(main_trial['profits'], main_trial['market_prices'], main_trial['socs'], main_trial['actions'])
 
+    if args.plot_dir:
+        render_trials(outcome['trials'], args.plot_dir, args.plot_points)
+        export_downsampled(outcome['trials'], os.path.join(args.plot_dir, 'downsampled.json'), args.plot_points)
+
 def main():
     parser = argparse.ArgumentParser(description='Evaluate a single energy market strategy.')
     parser.add_argument('--plot', action='store_true', help='Plot the results of the main trial.', default=False)
+    parser.add_argument('--plot_dir', type=str, help='Render every trial to an image in this directory, without a display, and save the downsampled series to downsampled.json.', default=None)
+    parser.add_argument('--plot_points', type=int, default=DEFAULT_MAX_POINTS, help='Maximum number of points per plotted series when using --plot_dir.')
     parser.add_argument('--present_index', type=int, default=0, help='Index to split the historical data from the data which will be used for the evaluation.')
     parser.add_argument('--trials', type=int, default=1, help='Number of trials to run')
     parser.add_argument('--seed', type=int, default=42, help='Seed for randomness')
@@ -163,8 +253,11 @@ def main():
     parser.add_argument('--class_name', type=str, help='Policy class name. If not provided, the config.json policy will be used.')
     parser.add_argument('--output_file', type=str, help='File to save all the submission outputs to.', default=None)
     parser.add_argument('--param', action='append', help='Policy parameters as key=value pairs', default=[])
+    parser.add_argument('--resume', action='store_true', help='Skip the trials already completed in the checkpoint of an interrupted run with the same --output_file.', default=False)
     
     args = parser.parse_args()
+    if args.resume and not args.output_file:
+        parser.error('--resume requires --output_file')
 
     perform_eval(args)
 
@@ -1,6 +1,6 @@
 import numpy as np
 import pandas as pd
-from bot.environment import BatteryEnv, Battery, INTERVAL_DURATION
+from bot.environment import BatteryEnv, Battery, PortfolioEnv, INTERVAL_DURATION
 
 def test_battery_environment():
     data = pd.read_csv('bot/data/april15-may7_2023.csv')
@@ -49,3 +49,34 @@ def test_battery_charges_once():
     charge = battery.charge_kW(5)
     assert abs(charge - 0.41666666666666663) < 0.01
     assert abs(battery.state_of_charge_kWh - (2* 0.41666666666666663)) < 0.01
+
+def test_portfolio_matches_individual_batteries():
+    data = pd.read_csv('bot/data/april15-may7_2023.csv').iloc[:500]
+    rng = np.random.default_rng(0)
+    num_batteries = 20
+    capacities = rng.uniform(5, 50, num_batteries)
+    charge_rates = rng.uniform(1, 10, num_batteries)
+    discharge_rates = rng.uniform(1, 10, num_batteries)
+    initial_charges = rng.uniform(0, 50, num_batteries)
+    efficiencies = rng.uniform(0.7, 1.0, num_batteries)
+
+    portfolio_env = PortfolioEnv(data, capacities, charge_rates, discharge_rates, initial_charges, efficiencies)
+    battery_envs = [
+        BatteryEnv(data, capacities[i], charge_rates[i], discharge_rates[i], initial_charges[i], efficiencies[i])
+        for i in range(num_batteries)
+    ]
+    portfolio_env.initial_state()
+
+    while True:
+        quantities = rng.choice([-12.0, -3.0, 0.0, 2.5, 12.0], num_batteries)
+        state, info = portfolio_env.step(quantities)
+        infos = [battery_env.step(quantity)[1] for battery_env, quantity in zip(battery_envs, quantities)]
+        if state is None:
+            assert all(battery_info is None for battery_info in infos)
+            break
+
+        assert np.array_equal(info['battery_soc'], [battery_info['battery_soc'] for battery_info in infos])
+        assert np.array_equal(info['profit_delta'], [battery_info['profit_delta'] for battery_info in infos])
+        assert np.array_equal(info['total_profit'], [battery_info['total_profit'] for battery_info in infos])
+
+    assert np.isclose(portfolio_env.total_profit.sum(), sum(battery_env.total_profit for battery_env in battery_envs))
@@ -1,7 +1,12 @@
 import json
 import os
-from evaluate import perform_eval, run_down_battery
-from environment import BatteryEnv
+import pandas as pd
+import pytest
+import evaluate
+from evaluate import perform_eval, run_down_battery, run_trial, CHECKPOINT_SUFFIX
+from environment import BatteryEnv, ConditionalOrder
+from plotting import DEFAULT_MAX_POINTS
+from policies.policy import Policy
 import argparse
 
 def test_evaluate():
@@ -13,7 +18,10 @@ def test_evaluate():
     args.output_file = 'bot/results/tmp.json'
     args.param = []
     args.plot = False
+    args.plot_dir = None
+    args.plot_points = DEFAULT_MAX_POINTS
     args.present_index = 0
+    args.resume = False
 
     perform_eval(args)
 
@@ -39,7 +47,10 @@ def test_evaluate_start_step():
     args.output_file = 'bot/results/tmp.json'
     args.param = []
     args.plot = False
+    args.plot_dir = None
+    args.plot_points = DEFAULT_MAX_POINTS
     args.present_index = 100
+    args.resume = False
 
     perform_eval(args)
 
@@ -62,4 +73,126 @@ def test_rundown_battery():
     market_prices = [10, 10, 10, 10, 10]
     profits = run_down_battery(battery_environment, market_prices)
 
-    assert battery_environment.battery.state_of_charge_kWh == 0
\ No newline at end of file
+    assert battery_environment.battery.state_of_charge_kWh == 0
+
+class BandOrderPolicy(Policy):
+    """Charges below a price band and discharges above it, holding each decision as a ConditionalOrder."""
+    def __init__(self, low=40, high=120, max_steps=36):
+        self.low = low
+        self.high = high
+        self.max_steps = max_steps
+
+    def decide(self, external_state, internal_state):
+        price = external_state['price']
+        if price < self.low:
+            return ConditionalOrder(internal_state['max_charge_rate'], price_above=self.high, max_steps=self.max_steps)
+        if price > self.high:
+            return ConditionalOrder(-internal_state['max_discharge_rate'], price_below=self.low, max_steps=self.max_steps)
+        return ConditionalOrder(0, price_above=self.high, price_below=self.low, max_steps=self.max_steps)
+
+    def act(self, external_state, internal_state):
+        return self.decide(external_state, internal_state)
+
+    def load_historical(self, external_states):
+        pass
+
+
+class BandStepPolicy(BandOrderPolicy):
+    """Same decisions as BandOrderPolicy, but resolves the orders itself one interval at a time."""
+    def __init__(self, capacity_kWh, **kwargs):
+        super().__init__(**kwargs)
+        self.capacity_kWh = capacity_kWh
+        self.order = None
+
+    def act(self, external_state, internal_state):
+        price = external_state['price']
+        soc = internal_state['battery_soc']
+        order = self.order
+        if order is not None:
+            self.steps += 1
+            fired = (
+                (order.price_above is not None and price > order.price_above) or
+                (order.price_below is not None and price < order.price_below) or
+                (order.quantity > 0 and soc >= self.capacity_kWh) or
+                (order.quantity < 0 and soc <= 0) or
+                self.steps >= order.max_steps
+            )
+            if not fired:
+                return order.quantity
+        self.order = self.decide(external_state, internal_state)
+        self.steps = 0
+        return self.order.quantity
+
+
+def test_conditional_orders_match_stepping():
+    data = pd.read_csv('bot/data/april15-may7_2023.csv')
+
+    stepped = run_trial(BatteryEnv(data=data), BandStepPolicy(capacity_kWh=13))
+    ordered = run_trial(BatteryEnv(data=data), BandOrderPolicy())
+
+    for key in ['profits', 'socs', 'market_prices', 'actions', 'timestamps', 'final_soc', 'rundown_profits']:
+        assert ordered[key] == stepped[key], key
+    assert len(ordered['profits']) == len(data)
+
+
+def test_conditional_order_stops_at_full_battery():
+    data = pd.DataFrame({'timestamp': range(20), 'price': [10.0] * 20})
+    battery_environment = BatteryEnv(data=data, capacity_kWh=1, initial_charge=0, efficiency=1.0)
+
+    state, info, skipped = battery_environment.step_order(ConditionalOrder(5))
+
+    assert info['battery_soc'] == 1
+    assert len(skipped['actions']) == 2
+    assert battery_environment.current_step == 3
+
+
+def test_evaluate_resumes_from_checkpoint(monkeypatch):
+    args = argparse.Namespace()
+    args.class_name = 'RandomPolicy'
+    args.trials = 4
+    args.seed = 42
+    args.data = 'bot/data/april15-may7_2023.csv'
+    args.output_file = 'bot/results/tmp.json'
+    args.param = []
+    args.plot = False
+    args.plot_dir = None
+    args.plot_points = DEFAULT_MAX_POINTS
+    args.present_index = 6000
+    args.resume = False
+
+    perform_eval(args)
+    with open('bot/results/tmp.json', 'r') as file:
+        expected = json.load(file)
+    os.remove('bot/results/tmp.json')
+
+    completed_trials = []
+    def interrupted_run_trial(battery_environment, policy):
+        if len(completed_trials) == 2:
+            raise KeyboardInterrupt
+        completed_trials.append(run_trial(battery_environment, policy))
+        return completed_trials[-1]
+
+    monkeypatch.setattr(evaluate, 'run_trial', interrupted_run_trial)
+    with pytest.raises(KeyboardInterrupt):
+        perform_eval(args)
+    assert not os.path.exists('bot/results/tmp.json')
+    assert os.path.exists('bot/results/tmp.json' + CHECKPOINT_SUFFIX)
+
+    resumed_trials = []
+    def counting_run_trial(battery_environment, policy):
+        resumed_trials.append(run_trial(battery_environment, policy))
+        return resumed_trials[-1]
+
+    monkeypatch.setattr(evaluate, 'run_trial', counting_run_trial)
+    args.resume = True
+    perform_eval(args)
+    assert len(resumed_trials) == 2
+
+    with open('bot/results/tmp.json', 'r') as file:
+        data = json.load(file)
+
+    assert data['trials'] == expected['trials']
+    assert data['score'] == expected['score']
+    assert not os.path.exists('bot/results/tmp.json' + CHECKPOINT_SUFFIX)
+
+    os.remove('bot/results/tmp.json')
@@ -0,0 +1,201 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+
+DEFAULT_MAX_POINTS = 2000  # Roughly two points per horizontal pixel of the default figure
+DOWNSAMPLED_SERIES = ['profits', 'market_prices', 'socs', 'actions']
+
+def lttb(values, max_points):
+    """
+    Select the indices of a series to keep using the Largest-Triangle-Three-Buckets algorithm,
+    which preserves the visual shape of the series (peaks, troughs and trends).
+
+    :param values: Series of values, one per time step.
+    :param max_points: Maximum number of points to keep.
+    :return: Sorted array of the indices to keep, always including the first and last.
+    """
+    values = np.asarray(values, dtype=float)
+    num_values = len(values)
+    if max_points >= num_values or max_points < 3:
+        return np.arange(num_values)
+
+    steps = np.arange(num_values, dtype=float)
+    # The first and last points are always kept, the rest are split into max_points - 2 buckets
+    edges = np.append(np.linspace(1, num_values - 1, max_points - 1).astype(int), num_values)
+    indices = np.empty(max_points, dtype=int)
+    indices[0] = selected = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = edges[bucket + 1], edges[bucket + 2]
+        next_step = steps[next_start:next_end].mean()
+        next_value = values[next_start:next_end].mean()
+        areas = np.abs(
+            (steps[selected] - next_step) * (values[start:end] - values[selected]) -
+            (steps[selected] - steps[start:end]) * (next_value - values[selected])
+        )
+        selected = start + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+    indices[-1] = num_values - 1
+    return indices
+
+def min_max(values, max_points):
+    """
+    Select the indices of a series to keep by taking the minimum and maximum of each bucket,
+    which never hides a spike however narrow.
+
+    :param values: Series of values, one per time step.
+    :param max_points: Maximum number of points to keep.
+    :return: Sorted array of the indices to keep.
+    """
+    values = np.asarray(values, dtype=float)
+    num_values = len(values)
+    if max_points >= num_values or max_points < 2:
+        return np.arange(num_values)
+
+    indices = []
+    for bucket in np.array_split(np.arange(num_values), max_points // 2):
+        indices.append(bucket[np.argmin(values[bucket])])
+        indices.append(bucket[np.argmax(values[bucket])])
+    return np.unique(indices)
+
+DOWNSAMPLE_METHODS = {'lttb': lttb, 'minmax': min_max}
+
+def downsample(values, max_points=DEFAULT_MAX_POINTS, method='lttb'):
+    """
+    Downsample a series for plotting.
+
+    :param values: Series of values, one per time step.
+    :param max_points: Maximum number of points to keep (default: DEFAULT_MAX_POINTS).
+    :param method: 'lttb' or 'minmax' (default: 'lttb').
+    :return: A tuple containing the kept time steps and their values.
+    """
+    indices = DOWNSAMPLE_METHODS[method](values, max_points)
+    return indices, np.asarray(values, dtype=float)[indices]
+
+def downsample_trial(trial, max_points=DEFAULT_MAX_POINTS, method='lttb'):
+    """
+    Downsample the plotted series of a trial, e.g for export to the leaderboard UI.
+
+    :param trial: A trial as returned by evaluate.run_trial.
+    :param max_points: Maximum number of points to keep per series (default: DEFAULT_MAX_POINTS).
+    :param method: 'lttb' or 'minmax' (default: 'lttb').
+    :return: A dictionary mapping each series name to its kept 'steps', 'timestamps' and 'values'.
+    """
+    downsampled = {}
+    for key in DOWNSAMPLED_SERIES:
+        steps, values = downsample(trial[key], max_points, method)
+        downsampled[key] = {
+            'steps': steps.tolist(),
+            'timestamps': [trial['timestamps'][step] for step in steps] if 'timestamps' in trial else [],
+            'values': values.tolist()
+        }
+    return downsampled
+
+def export_downsampled(trials, output_file, max_points=DEFAULT_MAX_POINTS, method='lttb'):
+    """
+    Save the downsampled series of each trial to a JSON file.
+
+    :param trials: List of trials as returned by evaluate.run_trial.
+    :param output_file: Path of the JSON file to write.
+    :param max_points: Maximum number of points to keep per series (default: DEFAULT_MAX_POINTS).
+    :param method: 'lttb' or 'minmax' (default: 'lttb').
+    """
+    with open(output_file, 'w') as file:
+        json.dump([downsample_trial(trial, max_points, method) for trial in trials], file)
+
+def draw_results(fig, profits, market_prices, battery_soc, actions, max_points=None):
+    """
+    Draw the profits, market prices, battery state of charge and actions over time onto a figure.
+
+    :param fig: Matplotlib figure to draw on.
+    :param profits: List of profits for each time step.
+    :param market_prices: List of market prices for each time step.
+    :param battery_soc: List of battery state of charge values for each time step.
+    :param actions: List of actions for each time step.
+    :param max_points: Maximum number of points to plot per series, or None to plot every point (default: None).
+    """
+    def series(values, method='lttb'):
+        if max_points is None:
+            return np.arange(len(values)), values
+        return downsample(values, max_points, method)
+
+    ax1, ax2, ax3 = fig.subplots(3, 1, sharex=True)
+
+    # Plot bids and market prices on the first axis
+    ax1.plot(*series(market_prices), label='Market Price', color='green', linestyle='--')
+    ax1.set_ylabel('Price ($/kWh)', color='blue')
+    ax1.tick_params('y', colors='blue')
+    ax1.legend(loc='upper left')
+
+    # Create a second axis for profits on the first subplot
+    ax1_profit = ax1.twinx()
+    ax1_profit.plot(*series(profits), label='Profit', color='red')
+    ax1_profit.set_ylabel('Profit ($)', color='red')
+    ax1_profit.tick_params('y', colors='red')
+    ax1_profit.legend(loc='upper right')
+
+    # Plot battery state of charge on the second subplot
+    ax2.plot(*series(battery_soc), label='Battery State of Charge', color='purple')
+    ax2.set_xlabel('Time Step')
+    ax2.set_ylabel('Battery State of Charge (kWh)', color='purple')
+    ax2.tick_params('y', colors='purple')
+    ax2.legend(loc='upper left')
+
+    # plot the actions (buy/sell amount)
+    # plot with very thin transparent line, min/max keeps every switch between buying and selling visible
+    ax3.plot(*series(actions, 'minmax'), label='Actions', color='blue', alpha=0.1, linewidth=0.5)
+    ax3.set_xlabel('Time Step')
+    ax3.set_ylabel('Actions (kWh)', color='blue')
+    ax3.tick_params('y', colors='blue')
+    ax3.legend(loc='upper left')
+
+    fig.tight_layout()
+
+def plot_results(profits, market_prices, battery_soc, actions, output_file=None, max_points=None):
+    """
+    Plot the bids, profits, market prices, and battery state of charge over time.
+
+    :param profits: List of profits for each time step.
+    :param market_prices: List of market prices for each time step.
+    :param battery_soc: List of battery state of charge values for each time step.
+    :param actions: List of actions for each time step.
+    :param output_file: Render the plot to this image file instead of showing it (default: None).
+    :param max_points: Maximum number of points to plot per series (default: None, which plots every point
+        when showing and DEFAULT_MAX_POINTS when rendering to a file).
+    """
+    if output_file is None:
+        fig = plt.figure(figsize=(10, 8))
+        draw_results(fig, profits, market_prices, battery_soc, actions, max_points)
+        plt.show()
+    else:
+        # A bare Figure does not touch pyplot's global state, so it needs no display and is safe in worker processes
+        fig = Figure(figsize=(10, 8))
+        draw_results(fig, profits, market_prices, battery_soc, actions, max_points or DEFAULT_MAX_POINTS)
+        fig.savefig(output_file)
+
+def render_trial(trial, output_file, max_points=DEFAULT_MAX_POINTS):
+    plot_results(trial['profits'], trial['market_prices'], trial['socs'], trial['actions'],
+                 output_file=output_file, max_points=max_points)
+    return output_file
+
+def render_trials(trials, output_dir, max_points=DEFAULT_MAX_POINTS, processes=None):
+    """
+    Render every trial to 'trial_<index>.png' in a directory, using a pool of worker processes.
+
+    :param trials: List of trials as returned by evaluate.run_trial.
+    :param output_dir: Directory to save the images to.
+    :param max_points: Maximum number of points to plot per series (default: DEFAULT_MAX_POINTS).
+    :param processes: Number of worker processes (default: None, one per CPU).
+    :return: List of the image file paths, in trial order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    output_files = [os.path.join(output_dir, f'trial_{index}.png') for index in range(len(trials))]
+    if len(trials) <= 1 or processes == 1:
+        return [render_trial(*arguments) for arguments in zip(trials, output_files, [max_points] * len(trials))]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(render_trial, trials, output_files, [max_points] * len(trials)))
@@ -0,0 +1,31 @@
+from abc import ABC, abstractmethod
+
+class Policy(ABC):
+    def __init__(self, **kwargs):
+        """
+        Constructor for the Policy class. It can take flexible parameters.
+        Contestants are free to maintain internal state and use any auxiliary data or information
+        within this class. Policies will be evaluated using market data from late April to early May 2024.
+        """
+        super().__init__()
+
+    @abstractmethod
+    def act(self, external_state, internal_state):
+        """
+        Method to be called when the policy needs to make a decision.
+
+        :param external_state: A dictionary containing the current market data.
+        :param internal_state: A dictionary containing the internal state of the policy.
+        :return: The action to be taken by the policy.
+        """
+        pass
+    
+    @abstractmethod
+    def load_historical(self, external_states):
+        """
+        Load historical data to the policy. This method is called once before the simulation starts.
+
+        :param external_states: A list of dictionaries containing historical market data to be used as relevant context
+        when acting later.
+        """
+        pass
\ No newline at end of file
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+from bot.environment import BatteryEnv, Battery, PortfolioEnv, INTERVAL_DURATION
+
+def test_battery_environment():
+    data = pd.read_csv('bot/data/april15-may7_2023.csv')
+    battery_env = BatteryEnv(data=data, capacity_kWh=10000, charge_rate_kW=5, discharge_rate_kW=5, initial_charge=7.5)
+    state, info = battery_env.initial_state()
+
+
+    count = 0
+    while True:
+        quantity = 1
+
+        state, info = battery_env.step(quantity)
+
+        count += 1
+        if state is None:
+            break
+    
+    assert count == len(data)
+    
+    duration_in_hours = INTERVAL_DURATION / 60
+    energy_MWh = quantity * battery_env.battery.efficiency * duration_in_hours / 1000
+    expected_total_profit = -(
+        data["price"] * energy_MWh
+    ).round(2).sum()
+    assert battery_env.total_profit < 0
+    assert np.isclose(battery_env.total_profit, expected_total_profit, atol=1e-2)
+
+
+def test_price_for_single_discharge():
+    data = pd.read_csv('bot/data/april15-may7_2023.csv')
+    battery_env = BatteryEnv(data=data, capacity_kWh=10000, charge_rate_kW=5, discharge_rate_kW=5, initial_charge=7.5)
+
+    energy = 5
+    spot_price_MWh = 100
+    profit = battery_env.get_profit(energy, spot_price_MWh)
+    expected_profit = energy * spot_price_MWh / 1000
+
+    assert np.isclose(profit, expected_profit)
+
+def test_battery_charges_once():
+    battery = Battery(capacity=13, charge_rate=5, discharge_rate=5, initial_charge=0, efficiency=1.0)
+    charge = battery.charge_kW(5)
+    assert abs(charge - 0.41666666666666663) < 0.01
+    assert abs(battery.state_of_charge_kWh - 0.41666666666666663) < 0.01
+
+    charge = battery.charge_kW(5)
+    assert abs(charge - 0.41666666666666663) < 0.01
+    assert abs(battery.state_of_charge_kWh - (2* 0.41666666666666663)) < 0.01
+
+def test_portfolio_matches_individual_batteries():
+    data = pd.read_csv('bot/data/april15-may7_2023.csv').iloc[:500]
+    rng = np.random.default_rng(0)
+    num_batteries = 20
+    capacities = rng.uniform(5, 50, num_batteries)
+    charge_rates = rng.uniform(1, 10, num_batteries)
+    discharge_rates = rng.uniform(1, 10, num_batteries)
+    initial_charges = rng.uniform(0, 50, num_batteries)
+    efficiencies = rng.uniform(0.7, 1.0, num_batteries)
+
+    portfolio_env = PortfolioEnv(data, capacities, charge_rates, discharge_rates, initial_charges, efficiencies)
+    battery_envs = [
+        BatteryEnv(data, capacities[i], charge_rates[i], discharge_rates[i], initial_charges[i], efficiencies[i])
+        for i in range(num_batteries)
+    ]
+    portfolio_env.initial_state()
+
+    while True:
+        quantities = rng.choice([-12.0, -3.0, 0.0, 2.5, 12.0], num_batteries)
+        state, info = portfolio_env.step(quantities)
+        infos = [battery_env.step(quantity)[1] for battery_env, quantity in zip(battery_envs, quantities)]
+        if state is None:
+            assert all(battery_info is None for battery_info in infos)
+            break
+
+        assert np.array_equal(info['battery_soc'], [battery_info['battery_soc'] for battery_info in infos])
+        assert np.array_equal(info['profit_delta'], [battery_info['profit_delta'] for battery_info in infos])
+        assert np.array_equal(info['total_profit'], [battery_info['total_profit'] for battery_info in infos])
+
+    assert np.isclose(portfolio_env.total_profit.sum(), sum(battery_env.total_profit for battery_env in battery_envs))
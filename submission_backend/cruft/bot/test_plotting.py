@@ -0,0 +1,55 @@
+import json
+import os
+import numpy as np
+from plotting import downsample, downsample_trial, export_downsampled, lttb, min_max, render_trials
+
+def test_lttb_keeps_endpoints_and_spikes():
+    values = np.sin(np.linspace(0, 20, 10000))
+    values[5003] = 50
+
+    indices = lttb(values, 500)
+
+    assert len(indices) == 500
+    assert indices[0] == 0
+    assert indices[-1] == len(values) - 1
+    assert np.all(np.diff(indices) > 0)
+    assert 5003 in indices
+
+def test_downsampling_short_series_is_a_no_op():
+    values = [1, 2, 3]
+
+    assert list(lttb(values, 10)) == [0, 1, 2]
+    assert list(min_max(values, 10)) == [0, 1, 2]
+
+def test_min_max_keeps_extremes():
+    values = np.zeros(10000)
+    values[1234] = -7
+    values[8765] = 9
+
+    steps, downsampled = downsample(values, 100, method='minmax')
+
+    assert len(steps) <= 100
+    assert downsampled.min() == -7
+    assert downsampled.max() == 9
+
+def test_render_and_export_trials(tmp_path):
+    num_steps = 5000
+    trial = {
+        'profits': np.cumsum(np.random.rand(num_steps)).tolist(),
+        'market_prices': np.random.rand(num_steps).tolist(),
+        'socs': np.random.rand(num_steps).tolist(),
+        'actions': np.random.choice([-5, 0, 5], num_steps).tolist(),
+        'timestamps': list(range(num_steps))
+    }
+
+    output_files = render_trials([trial, trial], str(tmp_path), max_points=200, processes=2)
+    assert all(os.path.exists(output_file) for output_file in output_files)
+
+    export_file = os.path.join(tmp_path, 'downsampled.json')
+    export_downsampled([trial], export_file, max_points=200)
+    with open(export_file) as file:
+        exported = json.load(file)
+
+    assert exported[0] == json.loads(json.dumps(downsample_trial(trial, max_points=200)))
+    assert len(exported[0]['profits']['values']) == 200
+    assert exported[0]['profits']['timestamps'] == exported[0]['profits']['steps']
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# Market data snapshots for evaluation containers
+# ===============================================
+# Every Team's evaluation container in a batch reads the same market data,
+# i.e the same time range of the same data file.  Rather than parsing the data
+# file and writing a fresh CSV file for each Team, get_snapshot() writes one
+# immutable snapshot per data version and time range, which is bind mounted
+# read-only into every container (see eval_task.py)
+#
+# Snapshots are kept in SNAPSHOT_DIR, outside the evaluation "data_dir" that
+# is mounted read-write into every container.  Only the snapshot file itself
+# is mounted, so that a container (even running as root) can't change the
+# snapshot that other Teams' containers read
+#
+# - The data file is parsed (EnergyDB) once per process for each version of
+#   the file, i.e a warm TaskHandler worker (see task_handlers.py) reuses it
+#   for every Team until the crawler appends new data
+# - Snapshots are content-addressed: the file name is a hash of the data
+#   file's content and the time range, so any process evaluating the same
+#   batch finds the same snapshot, without writing it again
+# - Snapshots are written to a temporary file, made read-only and renamed, so
+#   that a container never sees a partly written snapshot
+# - Snapshots not used for SNAPSHOT_MAX_AGE are deleted
+#
+# The snapshot is CSV, because that's what "bot/evaluate.py --data" reads,
+# in every Team's repository.
+
+import glob
+import hashlib
+import os
+import threading
+import time
+
+from energy_db import EnergyDB
+
+ENERGY_DB_PATH = 'bot/data/april15-may7_2023.csv'  # EnergyDB() default
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', 'snapshots')  # not in "data_dir"
+SNAPSHOT_MAX_AGE = 86400  # seconds since last used
+
+DATA_VERSIONS = {}  # (path, mtime, size): (content hash, EnergyDB)
+SNAPSHOTS = {}      # (content hash, unix_start, unix_end, snapshot_dir): path
+SNAPSHOTS_LOCK = threading.Lock()
+
+def get_data_version(file_location=ENERGY_DB_PATH):
+    stat = os.stat(file_location)
+    key = (os.path.abspath(file_location), stat.st_mtime_ns, stat.st_size)
+    with SNAPSHOTS_LOCK:
+        if key not in DATA_VERSIONS:
+            with open(file_location, 'rb') as file:
+                content_hash = hashlib.sha256(file.read()).hexdigest()
+            for old_key in [old_key for old_key in DATA_VERSIONS
+                            if old_key[0] == key[0]]:
+                del DATA_VERSIONS[old_key]
+            DATA_VERSIONS[key] = (content_hash, EnergyDB(file_location))
+        return DATA_VERSIONS[key]
+
+# Returns the snapshot path and the data in it, i.e the DataFrame for
+# EnergyDB.get_data(unix_start, unix_end)
+
+def get_snapshot(unix_start, unix_end, snapshot_dir=SNAPSHOT_DIR,
+                 file_location=ENERGY_DB_PATH):
+    content_hash, energy_db = get_data_version(file_location)
+    data = energy_db.get_data(unix_start, unix_end)
+    snapshot_dir = os.path.abspath(snapshot_dir)  # for the bind mount
+    key = (content_hash, unix_start, unix_end, snapshot_dir)
+    with SNAPSHOTS_LOCK:
+        path = SNAPSHOTS.get(key)
+        if not path or not os.path.exists(path):
+            snapshot_hash = hashlib.sha256(
+                f'{content_hash}:{unix_start}:{unix_end}'.encode()).hexdigest()
+            path = os.path.join(snapshot_dir, f'{snapshot_hash}.csv')
+            if not os.path.exists(path):
+                write_snapshot(data, path)
+                prune_snapshots(snapshot_dir)
+            SNAPSHOTS[key] = path
+        os.utime(path)  # last used
+    return path, data
+
+def write_snapshot(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    data.to_csv(temporary_path)
+    os.chmod(temporary_path, 0o444)
+    os.replace(temporary_path, path)
+
+def prune_snapshots(snapshot_dir, max_age=SNAPSHOT_MAX_AGE):
+    for path in glob.glob(os.path.join(snapshot_dir, '*.csv')):
+        try:
+            if time.time() - os.stat(path).st_mtime > max_age:
+                os.remove(path)
+        except FileNotFoundError:  # pruned by another process
+            pass
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#
+# Shared DynamoDB resources
+# =========================
+# Database (task_manager.py), LeaderboardDBClient and TeamDB get their boto3
+# DynamoDB resource from get_dynamodb_resource(), rather than each creating its
+# own boto3.Session, e.g
+#
+#     db_resource = get_dynamodb_resource(
+#         aws_access_key_id, aws_secret_access_key, endpoint_url)
+#     table = create_table_once(db_resource, "teams", create_teams_table)
+#
+# There is one boto3 client (and HTTP connection pool) per process for each
+# set of credentials and endpoint.  Boto3 clients are thread safe, but boto3
+# resources aren't, so each thread gets its own resource wrapping the shared
+# client.  Creating a resource or a Table handle doesn't call DynamoDB.
+#
+# Which tables exist is cached, and creating tables (schema bootstrap) is done
+# once per process, so that constructing another DB client, e.g for each Task
+# run by a warm TaskHandler worker, costs no network round-trips.
+#
+# Resources
+# ~~~~~~~~~
+# - https://boto3.amazonaws.com/v1/documentation/api/latest/guide/resources.html#multithreading-or-multiprocessing-with-resources
+# - https://boto3.amazonaws.com/v1/documentation/api/latest/guide/retries.html
+# - https://botocore.amazonaws.com/v1/documentation/api/latest/reference/config.html
+
+import threading
+
+import boto3
+from botocore.config import Config
+
+DB_REGION_NAME = "us-east-1"
+
+DB_CLIENT_CONFIG = Config(
+    max_pool_connections=50,  # HTTP connections, shared by all threads
+    retries={"mode": "adaptive", "max_attempts": 10},  # client rate limiting
+    tcp_keepalive=True,
+    connect_timeout=5,        # seconds
+    read_timeout=30           # seconds
+)
+
+SHARED_RESOURCES = {}  # (aws_access_key_id, endpoint_url): boto3 resource
+RESOURCES_LOCK = threading.Lock()
+THREAD_LOCAL = threading.local()
+
+# Keyed by the shared boto3 client, i.e per set of credentials and endpoint
+TABLE_NAMES = {}       # client: set of table names known to exist
+BOOTSTRAPPED = {}      # client: set of names of bootstrap functions run
+BOOTSTRAP_LOCK = threading.RLock()
+
+def get_dynamodb_resource(
+        aws_access_key_id, aws_secret_access_key, endpoint_url=None):
+
+    key = (aws_access_key_id, endpoint_url)
+    resources = getattr(THREAD_LOCAL, "resources", None)
+    if resources is None:
+        resources = THREAD_LOCAL.resources = {}
+    if key not in resources:
+        with RESOURCES_LOCK:  # boto3 sessions aren't thread safe either
+            if key not in SHARED_RESOURCES:
+                boto3_session = boto3.Session(
+                    aws_access_key_id=aws_access_key_id,
+                    aws_secret_access_key=aws_secret_access_key,
+                    region_name=DB_REGION_NAME
+                )
+                db_args = {"service_name": "dynamodb",
+                           "config": DB_CLIENT_CONFIG}
+                if endpoint_url:
+                    db_args["endpoint_url"] = endpoint_url
+                SHARED_RESOURCES[key] = boto3_session.resource(**db_args)
+            shared_resource = SHARED_RESOURCES[key]
+        resources[key] = type(shared_resource)(
+            client=shared_resource.meta.client)
+    return resources[key]
+
+# --------------------------------------------------------------------------- #
+# Table names are listed again when asked for a table that isn't known to
+# exist, in case another process has created it
+
+def get_table_names(db_resource, refresh=False):
+    client = db_resource.meta.client
+    with BOOTSTRAP_LOCK:
+        if refresh or client not in TABLE_NAMES:
+            TABLE_NAMES[client] =  \
+                {table.name for table in db_resource.tables.all()}
+        return set(TABLE_NAMES[client])
+
+def table_exists(db_resource, table_name):
+    return table_name in get_table_names(db_resource) or  \
+        table_name in get_table_names(db_resource, refresh=True)
+
+# Run "function()" once per process (per set of credentials and endpoint),
+# unless forget_bootstrap() is called, e.g after destroying the tables
+
+def bootstrap_once(db_resource, name, function):
+    client = db_resource.meta.client
+    with BOOTSTRAP_LOCK:
+        bootstrapped = BOOTSTRAPPED.setdefault(client, set())
+        if name not in bootstrapped:
+            function()
+            bootstrapped.add(name)
+
+def forget_bootstrap(db_resource, name):
+    with BOOTSTRAP_LOCK:
+        BOOTSTRAPPED.get(db_resource.meta.client, set()).discard(name)
+
+# Calls "create_table()" if the table doesn't exist.  Returns the Table handle
+
+def create_table_once(db_resource, table_name, create_table):
+    def bootstrap_table():
+        if not table_exists(db_resource, table_name):
+            create_table()
+            TABLE_NAMES[db_resource.meta.client].add(table_name)
+
+    bootstrap_once(db_resource, f"table:{table_name}", bootstrap_table)
+    return db_resource.Table(table_name)
+
+def forget_table(db_resource, table_name):
+    with BOOTSTRAP_LOCK:
+        TABLE_NAMES.get(db_resource.meta.client, set()).discard(table_name)
+        forget_bootstrap(db_resource, f"table:{table_name}")
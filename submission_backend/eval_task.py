@@ -5,25 +5,45 @@ import traceback
 import docker
 import os
 import pandas as pd
-from energy_db import EnergyDB
+import sys
+import threading
+import time
+from data_snapshots import get_data_version, get_snapshot
 from leaderboard_db import LeaderboardDBClient
 from team_db import TeamDB
 from task_manager import *
+from task_limits import LIMIT_EXCEEDED_EXIT_CODE, TaskLimitExceeded
 from task_manager_utils import tm_raise_error
 
+# Each evaluation container is capped, so one submission can't starve the rest
+# of the batch.  The container is killed if still running after the timeout
+EVAL_CONTAINER_LIMITS = {
+    'mem_limit': '2g',
+    'memswap_limit': '2g',        # no swap
+    'nano_cpus': 1_000_000_000,   # 1 CPU
+    'pids_limit': 256,
+}
+EVAL_CONTAINER_TIMEOUT = 1200  # seconds
+
 def full_eval(unix_start:int, batch_unix_end:int, data_dir:str, docker_image_tag:str, team_id: int, commit_sha:str, task_id:int):
     try:
         with open('.credentials.json') as f:
             credentials = json.load(f)
-        task_db = Database(credentials['AWS_ACCESS_KEY_ID'], credentials['AWS_SECRET_ACCESS_KEY'])
+        task_db = create_database(credentials['AWS_ACCESS_KEY_ID'], credentials['AWS_SECRET_ACCESS_KEY'])
         tm = TaskManager(task_db)
-        tm.database.update_task(str(task_id), {"state_": 'running'})
+        tm.database.transition_task(str(task_id), ['pending', 'running'], 'running')
 
         db_client = LeaderboardDBClient(credentials['AWS_ACCESS_KEY_ID'], credentials['AWS_SECRET_ACCESS_KEY'])
         submission = db_client.load_latest_submission(
             team_id=team_id,
             commit_hash=commit_sha
         )    
+        # a retry of this Task, after it updated the leaderboard ?
+        idempotency_key = f'eval_task:{task_id}'
+        if submission and idempotency_key in submission.get('idempotency_keys', []):
+            print(f'Already submitted by {idempotency_key}')
+            tm.database.transition_task(str(task_id), 'running', 'success')
+            return
         if submission is None:
             first_timestamp_in_batch = unix_start
         else:
@@ -62,46 +82,72 @@ def full_eval(unix_start:int, batch_unix_end:int, data_dir:str, docker_image_tag
         submission['main_trial'] = submission['trials'][submission['main_trial_idx']]
         del submission['trials']
 
-        db_client.upsert_submission(submission)
-        tm.database.update_task(str(task_id), {'state_': 'success'})
+        db_client.upsert_submission(submission, idempotency_key)
+        tm.database.transition_task(str(task_id), 'running', 'success')
     except Exception as e:
         trace = traceback.format_exc() 
         print('ERROR', e, trace)
         tm_raise_error(tm, task_id, f'Error submitting to leaderboard, {e}, traceback: {trace}')
     
+# The market data is a shared read-only snapshot (see data_snapshots.py), the
+# same for every Team in the batch.  Only the output file is per container.
+# The snapshot mustn't be in data_dir, which the container can write to
+
 def generate_output(unix_start:int, unix_batch_start:int, batch_unix_end:int, data_dir:str, docker_image_tag:str):
-    edb = EnergyDB()
-    data = edb.get_data(unix_start, batch_unix_end)
+    input_file, data = get_snapshot(unix_start, batch_unix_end)
+    if os.path.commonpath([os.path.abspath(data_dir), input_file]) == os.path.abspath(data_dir):
+        raise ValueError(f"Snapshot {input_file} is in the data directory {data_dir}, set SNAPSHOT_DIR elsewhere")
+    earliest_timestamp = get_data_version()[1].earliest_timestamp()
 
     if unix_batch_start not in data['timestamp'].values:
-        if unix_batch_start > edb.earliest_timestamp():
-            raise ValueError(f"Start time {unix_batch_start} is after the earliest timestamp {edb.earliest_timestamp()} in the data but not actually in the data")
+        if unix_batch_start > earliest_timestamp:
+            raise ValueError(f"Start time {unix_batch_start} is after the earliest timestamp {earliest_timestamp} in the data but not actually in the data")
         else:
             start_index = 0
     else:
         start_index = data[data['timestamp'] == unix_batch_start].index[0]
 
-    input_file = os.path.join(data_dir, f'{uuid.uuid4()}.csv')
-    data.to_csv(input_file)
-
     output_file = os.path.join(data_dir, f'{uuid.uuid4()}.json')
     client = docker.from_env()
     
     container = client.containers.run(
         docker_image_tag, 
         command=f"python bot/evaluate.py --output_file {output_file} --data {input_file} --present_index {start_index}", 
-        volumes={data_dir: {'bind': data_dir, 'mode': 'rw'}},
+        volumes={
+            data_dir: {'bind': data_dir, 'mode': 'rw'},
+            input_file: {'bind': input_file, 'mode': 'ro'},
+        },
         detach=True,
         network_mode="none",
+        **EVAL_CONTAINER_LIMITS,
     )
 
-    for line in container.logs(stream=True):
-        print(line.strip())
-
-    container.stop()
-    container.remove()
-
-    os.remove(input_file)
+    timed_out = threading.Event()
+    def kill_container():
+        timed_out.set()
+        container.kill()
+    timer = threading.Timer(EVAL_CONTAINER_TIMEOUT, kill_container)
+    timer.daemon = True
+    timer.start()
+    start_time = time.time()
+    try:
+        for line in container.logs(stream=True):  # to the TaskLog
+            print(line.decode(errors='replace').rstrip())
+        exit_code = container.wait()['StatusCode']
+        container.reload()
+        oom_killed = container.attrs['State'].get('OOMKilled', False)
+    finally:
+        timer.cancel()
+        container.remove(force=True)  # also if the TaskHandler was stopped
+    print(f'---- Container run time: {time.time() - start_time:.1f} seconds, exit code: {exit_code}')
+
+    # limit breaches aren't caught by full_eval(), see task_limits.py
+    if timed_out.is_set():
+        raise TaskLimitExceeded(f'Container timed out after {EVAL_CONTAINER_TIMEOUT} seconds')
+    if oom_killed:
+        raise TaskLimitExceeded(f'Container exceeded memory limit of {EVAL_CONTAINER_LIMITS["mem_limit"]}')
+    if exit_code != 0:
+        raise RuntimeError(f'Container exit code {exit_code}')
 
     with open(output_file, 'r') as f:
         output_data = json.load(f)
@@ -121,4 +167,8 @@ def full_eval_cli(unix_start:int, batch_unix_end:int, data_dir:str, docker_image
     full_eval(unix_start, batch_unix_end, data_dir, docker_image_tag, team_id, commit_hash, task_id)
 
 if __name__ == '__main__':
-    full_eval_cli()
\ No newline at end of file
+    try:
+        full_eval_cli()
+    except TaskLimitExceeded as task_limit_exceeded:
+        print(f'BOOM {task_limit_exceeded}')
+        sys.exit(LIMIT_EXCEEDED_EXIT_CODE)
\ No newline at end of file
@@ -1,6 +1,7 @@
 import docker
 import traceback
 import platform
+import shutil
 
 
 import click
@@ -10,6 +11,9 @@ SUBMISSION_DIR = 'submission_backend/submissions'
 
 LEADERBOARD_END_DATE = 1625097600
 
+# The team's Dockerfile build steps run with the same caps as the evaluation
+BUILD_CONTAINER_LIMITS = {'memory': 2 * 1024 ** 3, 'memswap': 2 * 1024 ** 3}
+
 def get_default_platform() -> str:
     machine = platform.uname().machine
     machine = {"x86_64": "amd64"}.get(machine, machine)
@@ -24,6 +28,8 @@ def current_submission_exists_for_team(tm: TaskManager, team_id:int):
 
 def clone_and_checkout(repo_url_with_token, repo_dir, commit_hash):
     try:
+        if os.path.exists(repo_dir):  # left by a failed attempt
+            shutil.rmtree(repo_dir)
         # Execute the Git clone command
         subprocess.check_call(['git', 'clone', '--single-branch', repo_url_with_token, repo_dir])
         
@@ -38,11 +44,11 @@ def kickoff(team_id:str, team_repo:str, commit_hash:str, task_id:str, unix_start
     with open('.credentials.json') as f:
         credentials = json.load(f)
 
-    task_db = Database(credentials['AWS_ACCESS_KEY_ID'], credentials['AWS_SECRET_ACCESS_KEY'])
+    task_db = create_database(credentials['AWS_ACCESS_KEY_ID'], credentials['AWS_SECRET_ACCESS_KEY'])
     tm = TaskManager(task_db)
 
     try:
-        tm.database.update_task(task_id, {"state_": 'running'})
+        tm.database.transition_task(task_id, ['pending', 'running'], 'running')
 
         # TODO: task manager gather all tasks for this team and stop them
         repo_dir = f"{SUBMISSION_DIR}/{team_repo}"
@@ -57,27 +63,27 @@ def kickoff(team_id:str, team_repo:str, commit_hash:str, task_id:str, unix_start
         clone_and_checkout(repo_url_with_token, repo_dir, commit_hash)
 
         print('### Building image', repo_dir)
-        result = client.images.build(path=repo_dir + '/bot', tag=str(team_id), platform=get_default_platform(), quiet=False)
+        result = client.images.build(path=repo_dir + '/bot', tag=str(team_id), platform=get_default_platform(), quiet=False, container_limits=BUILD_CONTAINER_LIMITS)
         print(result[0], type(result[0]))
         print(dir(result[0]))
 
         for item in result[1]:
             print(item)
 
-        create_eval_task(tm, team_id, commit_hash, unix_start, LEADERBOARD_END_DATE)
-        tm.database.update_task(task_id, {"state_": 'success'})
+        create_eval_task(tm, team_id, commit_hash, unix_start, LEADERBOARD_END_DATE,
+                         idempotency_key=f'kickoff_task:{task_id}')  # once, even if retried
+        tm.database.transition_task(task_id, 'running', 'success')
     except Exception as e:
         trace = traceback.format_exc()
-        task = tm.database.get_task(task_id)
         e_str = f"Submission Kickoff Error: {e}, {trace}"
-        tm_raise_error(tm, task['id'], e_str)
+        tm_raise_error(tm, task_id, e_str)
         print(e_str)
 
-def create_eval_task(tm: TaskManager, team_id:int, commit_hash:str, unix_start:int, unix_end:int):
-    new_task_id = tm.database.create_task("PLACEHOLDER")
-     
-    tm.database.update_task(new_task_id, 
-                            {"command": f"python submission_backend/eval_task.py --team_id {team_id} --commit_hash {commit_hash} --task_id {new_task_id} --unix_start {unix_start} --batch_unix_end {unix_end} --docker_image_tag {str(team_id)}"})
+def create_eval_task(tm: TaskManager, team_id:int, commit_hash:str, unix_start:int, unix_end:int, idempotency_key=None):
+    # the command includes the Task id, so reserve it before creating the Task
+    new_task_id = tm.database.reserve_task_id()
+    command = f"python submission_backend/eval_task.py --team_id {team_id} --commit_hash {commit_hash} --task_id {new_task_id} --unix_start {unix_start} --batch_unix_end {unix_end} --docker_image_tag {str(team_id)}"
+    return tm.database.create_task(command, idempotency_key=idempotency_key, task_id=new_task_id)
 
 @click.command()
 @click.option('--team_name', help='The name of the team to kickoff')
@@ -1,11 +1,12 @@
 from decimal import Decimal
 import time
-import boto3
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, Key
 import json
+from dynamodb_resources import create_table_once, forget_table, get_dynamodb_resource
 
 LOG_FILE = "database/evaluated_repos.json"
 LEADERBOARD_DB_URL = "http://localhost:8000"
+IDEMPOTENCY_KEYS_KEPT = 100  # most recent keys of the updates applied to a submission
 
 def convert_floats_to_decimal(obj):
     if isinstance(obj, float):
@@ -34,51 +35,44 @@ def decimal_default(obj):
 
 class LeaderboardDBClient():
     def __init__(self, aws_access_key_id, AWS_SECRET_ACCESS_KEY) -> None:
-        self.session = boto3.Session(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-            region_name='us-east-1'
-        )
-
         self.table_name = 'leaderboard'
-        db_args = {"service_name": "dynamodb"}
-        if LEADERBOARD_DB_URL:
-            db_args["endpoint_url"] = LEADERBOARD_DB_URL
-
-        self.dynamodb = self.session.resource(**db_args)
-    
-        # create table if it does not exist already
-        if self.table_name not in [table.name for table in self.dynamodb.tables.all()]:
-            table = self.dynamodb.create_table(
-                TableName=self.table_name,
-                KeySchema=[
-                    {
-                        'AttributeName': 'team_id',
-                        'KeyType': 'HASH'
-                    },
-                    {
-                        'AttributeName': 'git_commit_hash',
-                        'KeyType': 'RANGE'
-                    }
-                ],
-                AttributeDefinitions=[
-                    {
-                        'AttributeName': 'team_id',
-                        'AttributeType': 'N'
-                    },
-                    {
-                        'AttributeName': 'git_commit_hash',
-                        'AttributeType': 'S'
-                    }
-                ],
-                ProvisionedThroughput={
-                    'ReadCapacityUnits': 5,
-                    'WriteCapacityUnits': 5
+        # shared boto3 client, see dynamodb_resources.py
+        self.dynamodb = get_dynamodb_resource(
+            aws_access_key_id, AWS_SECRET_ACCESS_KEY, LEADERBOARD_DB_URL)
+
+        # create table if it does not exist already (checked once per process)
+        self.table = create_table_once(
+            self.dynamodb, self.table_name, self.create_table)
+
+    def create_table(self):
+        table = self.dynamodb.create_table(
+            TableName=self.table_name,
+            KeySchema=[
+                {
+                    'AttributeName': 'team_id',
+                    'KeyType': 'HASH'
+                },
+                {
+                    'AttributeName': 'git_commit_hash',
+                    'KeyType': 'RANGE'
                 }
-            )
-            table.meta.client.get_waiter('table_exists').wait(TableName=self.table_name)
-
-        self.table = self.dynamodb.Table(self.table_name)
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'team_id',
+                    'AttributeType': 'N'
+                },
+                {
+                    'AttributeName': 'git_commit_hash',
+                    'AttributeType': 'S'
+                }
+            ],
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 5,
+                'WriteCapacityUnits': 5
+            }
+        )
+        table.meta.client.get_waiter('table_exists').wait(TableName=self.table_name)
         
     def is_already_submitted(self, team_id, submission_hash):
         response = self.table.get_item(
@@ -89,19 +83,24 @@ class LeaderboardDBClient():
         )
         return 'Item' in response
 
-    def submit(self, submission):
+    def submit(self, submission, idempotency_key=None):
         assert 'team_id' in submission, f'team_id (primary key) not found in {submission}'
         assert 'git_commit_hash' in submission, f'git_commit_hash (secondary key) not found in {submission}'
         
         cloned_submission = convert_floats_to_decimal(submission.copy())
         cloned_submission['submitted_at'] = int(round(time.time() * 1000))
+        if idempotency_key:
+            cloned_submission['idempotency_keys'] = [idempotency_key]
 
         response = self.table.put_item(Item=cloned_submission)
 
         if response['ResponseMetadata']['HTTPStatusCode'] != 200:
             raise ValueError(f"Failed to submit {submission}, response was {response}")
         
-    def upsert_submission(self, submission):
+    # An "idempotency_key" (e.g the eval Task id) is recorded on the submission,
+    # so that retrying the same update doesn't append the same trial twice
+
+    def upsert_submission(self, submission, idempotency_key=None):
         assert 'team_id' in submission, f'team_id (primary key) not found in {submission}'
         assert 'git_commit_hash' in submission, f'git_commit_hash (secondary key) not found in {submission}'
 
@@ -116,11 +115,11 @@ class LeaderboardDBClient():
         )
 
         if 'Item' not in existing_submission:
-            self.submit(submission)
+            self.submit(submission, idempotency_key)
         else:
-            self.update_submission(submission)
+            self.update_submission(submission, idempotency_key)
 
-    def update_submission(self, new_data):
+    def update_submission(self, new_data, idempotency_key=None):
         assert 'team_id' in new_data, f'team (primary key) not found in {new_data}'
         assert 'git_commit_hash' in new_data, f'git_commit_hash (secondary key) not found in {new_data}'
 
@@ -138,6 +137,11 @@ class LeaderboardDBClient():
             raise ValueError(f"Submission {team_id}/{submission_hash} not found")
         
         existing_submission = existing_submission['Item']
+        idempotency_keys = existing_submission.get('idempotency_keys', [])
+        if idempotency_key and idempotency_key in idempotency_keys:
+            print(f"Already updated {team_id}/{submission_hash} by {idempotency_key}")
+            return
+        previous_submitted_at = existing_submission['submitted_at']
         
         trial_data = new_data['main_trial']
         existing_trial_data = existing_submission['main_trial']
@@ -157,10 +161,17 @@ class LeaderboardDBClient():
         existing_submission['main_trial'] = combined_trial
         existing_submission['score'] = combined_trial['profits'][-1]
 
+        if idempotency_key:
+            existing_submission['idempotency_keys'] = (idempotency_keys + [idempotency_key])[-IDEMPOTENCY_KEYS_KEPT:]
+
         existing_submission = convert_floats_to_decimal(existing_submission.copy())
         existing_submission['submitted_at'] = int(round(time.time() * 1000))
 
-        response = self.table.put_item(Item=existing_submission)
+        # fails if the submission was updated by someone else in the meantime
+        response = self.table.put_item(
+            Item=existing_submission,
+            ConditionExpression=Attr('submitted_at').eq(previous_submitted_at)
+        )
 
         if response['ResponseMetadata']['HTTPStatusCode'] != 200:
             raise ValueError(f"Failed to update {new_data}, response was {response}")
@@ -215,4 +226,5 @@ class LeaderboardDBClient():
         for table in tables:
             # delete table if it is called leaderboard
             if table.name == self.table_name:
-                table.delete()
\ No newline at end of file
+                table.delete()
+        forget_table(self.dynamodb, self.table_name)
\ No newline at end of file
@@ -20,7 +20,7 @@
 
 import time
 
-from task_manager import CONFIGURATION_PATHNAME, Database, load_configuration
+from task_manager import CONFIGURATION_PATHNAME, create_database, load_configuration
 
 def get_data(database):
     print("---- Mock get data: started")
@@ -33,7 +33,7 @@ def get_data(database):
 if __name__ == "__main__":
     aws_access_key_id, aws_secret_access_key = load_configuration(
         CONFIGURATION_PATHNAME)
-    database = Database(aws_access_key_id, aws_secret_access_key)
+    database = create_database(aws_access_key_id, aws_secret_access_key)
     get_data(database)
 
 #---------------------------------------------------------------------------- #
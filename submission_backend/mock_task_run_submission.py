@@ -14,7 +14,7 @@
 import sys
 import time
 
-from task_manager import CONFIGURATION_PATHNAME, Database, load_configuration
+from task_manager import CONFIGURATION_PATHNAME, create_database, load_configuration
 
 def run_submission(database, team_name):
     print(f"---- Mock run_submission for team {team_name}: started")
@@ -28,7 +28,7 @@ if __name__ == "__main__":
 
     aws_access_key_id, aws_secret_access_key = load_configuration(
         CONFIGURATION_PATHNAME)
-    database = Database(aws_access_key_id, aws_secret_access_key)
+    database = create_database(aws_access_key_id, aws_secret_access_key)
     run_submission(database, team_name)
 
 #---------------------------------------------------------------------------- #
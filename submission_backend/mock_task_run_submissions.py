@@ -13,19 +13,19 @@
 
 import time
 
-from task_manager import CONFIGURATION_PATHNAME, Database, load_configuration
+from task_manager import CONFIGURATION_PATHNAME, create_database, load_configuration
 
 def run_submissions(database):
     print("---- Mock run_submissions: started")
-    for team_name in ["TeamA", "TeamB", "TeamC"]:
-        command = f"./mock_task_run_submission.py {team_name}"
-        task_id = database.create_task(command)
+    commands = [f"./mock_task_run_submission.py {team_name}"
+                for team_name in ["TeamA", "TeamB", "TeamC"]]
+    task_ids = database.create_tasks(commands)
     print("---- Mock run_submissions: stopped")
 
 if __name__ == "__main__":
     aws_access_key_id, aws_secret_access_key = load_configuration(
         CONFIGURATION_PATHNAME)
-    database = Database(aws_access_key_id, aws_secret_access_key)
+    database = create_database(aws_access_key_id, aws_secret_access_key)
     run_submissions(database)
 
 #---------------------------------------------------------------------------- #
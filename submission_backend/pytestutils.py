@@ -5,6 +5,7 @@ import pytest
 
 from leaderboard_db import LeaderboardDBClient
 from team_db import TeamDB
+from sqlite_database import SQLiteDatabase
 
 def docker_compose_up(directory):
     try:
@@ -102,12 +103,23 @@ def team_db_client(database_server):
 
 
 @pytest.fixture(scope='session')
-def tm_client(database_server):
+def dynamodb_tm_client(database_server, tmp_path_factory):
     with open('.credentials.json') as f:
         credentials = json.load(f)
     tm_db = Database(credentials['AWS_ACCESS_KEY_ID'], credentials['AWS_SECRET_ACCESS_KEY'])
     tm_db.destroy_tables()
     tm_db = Database(credentials['AWS_ACCESS_KEY_ID'], credentials['AWS_SECRET_ACCESS_KEY'])
 
-    tm  = TaskManager(tm_db)
+    tm  = TaskManager(tm_db, log_dir=str(tmp_path_factory.mktemp('task_logs')))
+    yield tm
+
+@pytest.fixture(scope='session')
+def tm_client(dynamodb_tm_client):
+    yield dynamodb_tm_client
+
+@pytest.fixture(scope='session')
+def sqlite_tm_client(tmp_path_factory):
+    tm_db = SQLiteDatabase(str(tmp_path_factory.mktemp('tasks') / 'tasks.sqlite'))
+
+    tm = TaskManager(tm_db, log_dir=str(tmp_path_factory.mktemp('task_logs')))
     yield tm
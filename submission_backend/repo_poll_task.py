@@ -45,7 +45,7 @@ def has_already_been_processed(leaderboard, team_id, commit_sha):
 
 def do_poll(task_id="0", unix_time=0, repos=REPOS):
     db_client = LeaderboardDBClient(credentials['AWS_ACCESS_KEY_ID'], credentials['AWS_SECRET_ACCESS_KEY'])
-    task_db_client = Database(credentials['AWS_ACCESS_KEY_ID'], credentials['AWS_SECRET_ACCESS_KEY'])
+    task_db_client = create_database(credentials['AWS_ACCESS_KEY_ID'], credentials['AWS_SECRET_ACCESS_KEY'])
     tm = TaskManager(task_db_client)
 
     try:
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+#
+# Usage: SQLite set-up
+# ====================
+# export DB_SQLITE_PATH=tasks.sqlite  # instead of DynamoDB, no Docker needed
+# ./task_manager.py run
+#
+# SQLiteDatabase stores Tasks in an embedded SQLite database file, with the
+# same Task semantics as the DynamoDB Database, e.g for unit tests and single
+# host deployments.  The file is opened in WAL (write-ahead log) mode, so that
+# readers don't block the writer, and several processes (TaskManager and the
+# Tasks it runs) can share it.
+#
+# Each Task is a row, the Task fields are stored as JSON in "fields", with
+# "state_" and "created_at" copied into indexed columns (like the DynamoDB
+# "state_index").  Writes are transactions ("BEGIN IMMEDIATE"), which take the
+# database write lock up front, so read-check-write is atomic, e.g
+# transition_task() only succeeds if the Task is still in the expected state.
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import json
+import sqlite3
+import threading
+
+from task_manager import (
+    API_PAGE_SIZE, ARCHIVE_AGE, ARCHIVE_STATES, EXPORT_SEGMENTS,
+    TASK_MANAGER_URL, Database, decode_cursor, encode_cursor
+)
+from task_metrics import timed
+
+SQLITE_TIMEOUT = 30  # seconds to wait for another writer to commit
+
+SQLITE_TASK_TABLE_NAMES = ["tasks", "tasks_archive"]
+SQLITE_INDEXED_FIELD_NAMES = ["state_", "created_at"]
+
+class SQLiteDatabase(Database):
+    tasks_table = "tasks"
+    tasks_archive_table = "tasks_archive"
+
+    def __init__(self, path):
+        self.path = path
+        self.thread_local = threading.local()
+        self.notify_url = TASK_MANAGER_URL  # None: don't notify TaskManager
+
+        self.create_tables()
+
+# SQLite connections can't be shared between threads, so that TaskManager
+# worker threads can share a Database instance, each thread lazily opens its own
+
+    @property
+    def connection(self):
+        connection = getattr(self.thread_local, "connection", None)
+        if not connection:
+            connection = sqlite3.connect(
+                self.path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")  # safe with WAL
+            self.thread_local.connection = connection
+        return connection
+
+    @contextmanager
+    def transaction(self):
+        connection = self.connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+# Database tables functions ................................................. #
+
+    def create_tables(self):
+        with self.transaction() as connection:
+            for table_name in SQLITE_TASK_TABLE_NAMES:
+                connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {table_name} ("
+                    "id INTEGER PRIMARY KEY, state_ TEXT, created_at TEXT, "
+                    "fields TEXT NOT NULL)")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS tasks_state_index "
+                "ON tasks (state_, created_at)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS counters ("
+                "item_type TEXT PRIMARY KEY, last_id INTEGER NOT NULL)")
+            connection.execute(
+                "INSERT OR IGNORE INTO counters (item_type, last_id) "
+                "SELECT 'task', COALESCE(MAX(id), 0) FROM tasks")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+                "key TEXT PRIMARY KEY, task_id INTEGER NOT NULL)")
+
+    def destroy_tables(self):
+        with self.transaction() as connection:
+            for table_name in  \
+                    SQLITE_TASK_TABLE_NAMES + ["counters", "idempotency_keys"]:
+                connection.execute(f"DROP TABLE IF EXISTS {table_name}")
+
+    def get_table_names(self):
+        rows = self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")
+        return [row[0] for row in rows]
+
+    def get_table_attributes(self, table_name):
+        rows = self.connection.execute(f"PRAGMA table_info({table_name})")
+        return [{"AttributeName": row[1], "AttributeType": row[2]}
+                for row in rows]
+
+    def get_table_data(self, table_name):
+        rows = self.connection.execute(f"SELECT * FROM {table_name}")
+        column_names = [column[0] for column in rows.description]
+        items = [dict(zip(column_names, row)) for row in rows]
+        return {"Count": len(items), "Items": items}
+
+# Database tasks functions .................................................. #
+
+    @timed
+    def create_unique_item(self, table, item_type, fields=None):
+        with self.transaction() as connection:
+            id_new = self.increment_counter(connection, item_type, 1)[0]
+            self.write_task(connection, table, id_new, fields or {})
+        return id_new
+
+    @timed
+    def reserve_ids(self, table, item_type, count=1):
+        with self.transaction() as connection:
+            return self.increment_counter(connection, item_type, count)
+
+    @timed
+    def claim_idempotency_key(self, key, task_id):
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT OR IGNORE INTO idempotency_keys (key, task_id) "
+                "VALUES (?, ?)", (key, int(task_id)))
+            claimed_task_id = connection.execute(
+                "SELECT task_id FROM idempotency_keys WHERE key = ?",
+                (key,)).fetchone()[0]
+        return None if claimed_task_id == int(task_id) else claimed_task_id
+
+    @timed
+    def advance_counter(self, table, item_type, last_id):
+        with self.transaction() as connection:
+            connection.execute(
+                "UPDATE counters SET last_id = MAX(last_id, ?) "
+                "WHERE item_type = ?", (int(last_id), item_type))
+
+    def increment_counter(self, connection, item_type, count):
+        last_id = connection.execute(
+            "UPDATE counters SET last_id = last_id + ? WHERE item_type = ? "
+            "RETURNING last_id", (count, item_type)).fetchone()[0]
+        return list(range(last_id - count + 1, last_id + 1))
+
+    @timed
+    def append_task_list(self, task_id, field_name, values):
+        with self.transaction() as connection:
+            task_fields = self.read_fields(connection, task_id)
+            if task_fields is None:
+                return False
+            task_fields[field_name] = task_fields.get(field_name, []) + values
+            self.write_task(connection, self.tasks_table, task_id, task_fields)
+        return True
+
+    @timed
+    def delete_task(self, task_id):
+        with self.transaction() as connection:
+            connection.execute(
+                "DELETE FROM tasks WHERE id = ?", (int(task_id),))
+
+    @timed
+    def get_task(self, task_id, field_names=None, archived=False):
+        table = self.tasks_archive_table if archived else self.tasks_table
+        row = self.connection.execute(
+            f"SELECT id, fields FROM {table} WHERE id = ?",
+            (int(task_id),)).fetchone()
+        return self.row_to_task(row, field_names) if row else None
+
+# "page_size" is ignored, rows are read from the cursor as they're needed
+
+    @timed
+    def get_tasks(self, task_id=None, filter=None, sort_field=None,
+                  field_names=None, page_size=None, archived=False):
+        table = self.tasks_archive_table if archived else self.tasks_table
+        conditions, parameters = self.filter_conditions(task_id, filter)
+        query = f"SELECT id, fields FROM {table}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        rows = self.connection.execute(query + " ORDER BY id", parameters)
+        results = (self.row_to_task(row, field_names) for row in rows)
+        if archived and not sort_field:  # streamed, a row at a time
+            return results
+        return self.sort_tasks(list(results), sort_field)
+
+    def filter_conditions(self, task_id, filter):
+        conditions = []
+        parameters = []
+        if task_id:
+            conditions.append("id = ?")
+            parameters.append(int(task_id))
+        if filter:  # ("key", "value"), e.g ("command", "echo 1")
+            field_name, field_value = filter
+            if field_name == "id":
+                conditions.append("id = ?")
+                parameters.append(int(field_value))
+            elif field_name in SQLITE_INDEXED_FIELD_NAMES:
+                conditions.append(f"{field_name} = ?")
+                parameters.append(field_value)
+            else:
+                conditions.append("json_extract(fields, ?) = ?")
+                parameters.extend([f"$.{field_name}", field_value])
+        return conditions, parameters
+
+# Pages are in "id" order, the cursor being the last "id" read
+
+    @timed
+    def get_tasks_page(self, filter=None, field_names=None,
+                       limit=API_PAGE_SIZE, cursor=None, archived=False):
+        table = self.tasks_archive_table if archived else self.tasks_table
+        conditions, parameters = self.filter_conditions(None, filter)
+        if cursor:
+            conditions.append("id > ?")
+            parameters.append(int(decode_cursor(cursor).get("id", 0)))
+        query = f"SELECT id, fields FROM {table}"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        rows = self.connection.execute(
+            query + " ORDER BY id LIMIT ?", parameters + [limit + 1]).fetchall()
+        tasks = [self.row_to_task(row, field_names) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = encode_cursor({"id": rows[limit - 1][0]})
+        return tasks, next_cursor
+
+# "segments" is ignored, a single reader is as fast as SQLite can go
+
+    def scan_tasks(self, archived=False, segments=EXPORT_SEGMENTS):
+        return self.get_tasks(archived=True) if archived else  \
+            iter(self.get_tasks())
+
+# All the Tasks are written in one transaction
+
+    @timed
+    def put_tasks(self, tasks, archived=False):
+        table = self.tasks_archive_table if archived else self.tasks_table
+        with self.transaction() as connection:
+            for task in tasks:
+                fields = {field_name: field_value
+                          for field_name, field_value in task.items()
+                          if field_name not in ["task", "id"]}
+                self.write_task(connection, table, task["id"], fields)
+
+# Like DynamoDB UpdateItem, updating a Task that doesn't exist creates it
+
+    @timed
+    def update_task(self, task_id, fields):
+        with self.transaction() as connection:
+            task_fields = self.read_fields(connection, task_id) or {}
+            task_fields.update(fields)
+            self.write_task(connection, self.tasks_table, task_id, task_fields)
+
+    @timed
+    def transition_task(self, task_id, from_states, to_state, fields=None,
+                        conditions=None):
+        if isinstance(from_states, str):
+            from_states = [from_states]
+        with self.transaction() as connection:
+            task_fields = self.read_fields(connection, task_id)
+            if not task_fields or task_fields.get("state_") not in from_states:
+                return None
+            for field_name, field_value in (conditions or {}).items():
+                if task_fields.get(field_name) != field_value:
+                    return None
+            task_fields.update(fields or {})
+            task_fields["state_"] = to_state
+            self.write_task(connection, self.tasks_table, task_id, task_fields)
+        return {"task": "task", "id": str(task_id), **task_fields}
+
+# Moving the Tasks is a single transaction, so a Task is never in both tables
+
+    @timed
+    def archive_tasks(self, age=ARCHIVE_AGE):
+        created_before = (datetime.utcnow() - timedelta(seconds=age)).isoformat()
+        state_variables = ", ".join("?" * len(ARCHIVE_STATES))
+        where = f"WHERE state_ IN ({state_variables}) AND created_at < ?"
+        parameters = ARCHIVE_STATES + [created_before]
+        with self.transaction() as connection:
+            connection.execute(
+                f"INSERT OR REPLACE INTO {self.tasks_archive_table} "
+                f"SELECT * FROM {self.tasks_table} {where}", parameters)
+            cursor = connection.execute(
+                f"DELETE FROM {self.tasks_table} {where}", parameters)
+        return cursor.rowcount
+
+    def read_fields(self, connection, task_id):
+        row = connection.execute(
+            "SELECT fields FROM tasks WHERE id = ?", (int(task_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def write_task(self, connection, table, task_id, fields):
+        connection.execute(
+            f"INSERT OR REPLACE INTO {table} "
+            "(id, state_, created_at, fields) VALUES (?, ?, ?, ?)",
+            (int(task_id), fields.get("state_"), fields.get("created_at"),
+             json.dumps(fields, default=float)))  # e.g imported Decimals
+
+    def row_to_task(self, row, field_names=None):
+        task_id, fields = row
+        task = {"task": "task", "id": str(task_id), **json.loads(fields)}
+        if field_names:
+            task = {field_name: task[field_name]
+                    for field_name in field_names if field_name in task}
+        return task
+
+# Database miscellaneous functions .......................................... #
+
+    def team_exists(self, team, submission_hash):  # no datapoints table
+        return False
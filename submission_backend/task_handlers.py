@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+#
+# TaskHandler registry
+# ====================
+# Task commands for Python scripts listed in TASK_HANDLERS, e.g
+#
+#     python submission_backend/eval_task.py --team_id 1 --task_id 42 ...
+#
+# ... are run by calling the script's handler in a warm worker process, rather
+# than starting a new Python interpreter.  Each worker process imports the
+# handler modules (boto3, pandas, docker, etc) and creates its Database clients
+# (see create_database()) once, then reuses them for every Task it runs.
+#
+# A handler is "module:name", where "name" is either a Click command, which
+# parses the command parameters as usual, or a function(arguments) given the
+# list of command parameters.  Any other command still runs as a subprocess.
+#
+# Successful handlers return (or "sys.exit(0)"), any exception is a Task error.
+# Handlers run with the Task limits (see task_limits.py).
+
+from contextlib import ExitStack, redirect_stderr, redirect_stdout
+import importlib
+import os
+import resource
+import time
+
+import click
+
+from task_limits import TaskLimitExceeded, limit_handler, usage_fields
+from task_logs import TaskLog
+
+TASK_HANDLERS = {  # script name: "module:name"
+    "eval_task.py": "eval_task:full_eval_cli"
+}
+
+def register_handler(script_name, handler):
+    TASK_HANDLERS[script_name] = handler
+
+# Returns the handler and the command parameters, or (None, None)
+
+def get_handler(command):
+    tokens = command.split()
+    if tokens and os.path.basename(tokens[0]).startswith("python"):
+        tokens = tokens[1:]
+    if tokens and os.path.basename(tokens[0]) in TASK_HANDLERS:
+        return TASK_HANDLERS[os.path.basename(tokens[0])], tokens[1:]
+    return None, None
+
+# Runs in the worker process.  Modules stay imported between calls.
+# Returns the usage, "max_rss_kb" being the peak of the whole worker process,
+# which is also given to TaskLimitExceeded.
+# If "log_path" is given, the handler's stdout and stderr are written to that
+# TaskLog (see task_logs.py)
+
+def run_handler(handler, arguments, limits=None, log_path=None):
+    module_name, name = handler.split(":")
+    function = getattr(importlib.import_module(module_name), name)
+    start_time = time.perf_counter()
+    start_usage = resource.getrusage(resource.RUSAGE_SELF)
+    try:
+        with ExitStack() as stack:
+            if log_path:
+                task_log = stack.enter_context(TaskLog(log_path))
+                stack.enter_context(redirect_stdout(task_log))
+                stack.enter_context(redirect_stderr(task_log))
+            stack.enter_context(limit_handler(limits or {}))
+            if isinstance(function, click.Command):
+                function.main(args=arguments, standalone_mode=False)
+            else:
+                function(arguments)
+    except SystemExit as system_exit:  # don't let it stop the worker process
+        if system_exit.code not in [None, 0]:
+            raise RuntimeError(f"Exit code {system_exit.code}") from None
+    except TaskLimitExceeded as task_limit_exceeded:
+        task_limit_exceeded.usage = handler_usage(start_time, start_usage)
+        raise
+    return handler_usage(start_time, start_usage)
+
+def handler_usage(start_time, start_usage):
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage_fields(time.perf_counter() - start_time,
+        usage.ru_utime + usage.ru_stime -
+            start_usage.ru_utime - start_usage.ru_stime,
+        usage.ru_maxrss)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+#
+# Task time and resource limits
+# =============================
+# Each Task command runs with limits, so that one misbehaving Task (such as a
+# Team's submission stuck in a loop) can't hog the evaluation host
+#
+# - timeout: wall-clock seconds, e.g "./task_manager.py create --timeout 60"
+# - cpu:     CPU seconds
+# - memory:  bytes of address space
+#
+# TASK_LIMITS gives the limits for each command type (see command_type()),
+# TASK_LIMITS_DEFAULT for any other command, and a Task "timeout" field
+# overrides the timeout.  None means unlimited.
+#
+# Subprocess commands run in their own process group with RLIMIT_CPU and
+# RLIMIT_AS set, and the whole group is killed on timeout.  The "echo" and
+# "sleep" builtin commands run in the TaskManager, with the same timeout.
+# TaskHandlers
+# (see task_handlers.py) run in a warm worker process, so instead of killing
+# the worker, interval timers (SIGALRM and SIGPROF) raise TaskLimitExceeded
+# in the handler.  Docker containers have their own limits, see eval_task.py.
+#
+# TaskLimitExceeded is a BaseException, like KeyboardInterrupt, so that a
+# command's "except Exception" (e.g eval_task.py) doesn't turn a limit breach
+# into an ordinary error.  A command run as a subprocess that exceeds its own
+# limits, e.g its container's, exits with LIMIT_EXCEEDED_EXIT_CODE.  Tasks that
+# exceed their limits aren't retried (see task_retry.py).
+#
+# The resources used by each Task are recorded in its "usage" field, as
+# integers (DynamoDB numbers) ...
+#
+#     {"wall_ms": 1234, "cpu_ms": 567, "max_rss_kb": 89012}
+
+from contextlib import contextmanager
+import os
+import resource
+import signal
+import subprocess
+import threading
+import time
+
+from task_metrics import command_type
+
+TASK_LIMITS_DEFAULT = {"timeout": 3600, "cpu": None, "memory": None}
+
+TASK_LIMITS = {  # command type: limits, merged with TASK_LIMITS_DEFAULT
+    "eval_task.py": {"timeout": 1800}  # container limits are in eval_task.py
+}
+
+CPU_LIMIT_GRACE_TIME = 5  # seconds after SIGXCPU until SIGKILL
+LOG_DRAIN_TIME = 5        # seconds to read the rest of the output after exit
+LIMIT_EXCEEDED_EXIT_CODE = 125
+
+class TaskLimitExceeded(BaseException):
+    def __init__(self, diagnostic, usage=None):
+        super().__init__(diagnostic)
+        self.usage = usage
+
+def get_task_limits(task):
+    limits = dict(TASK_LIMITS_DEFAULT)
+    limits.update(TASK_LIMITS.get(command_type(task["command"]), {}))
+    if task.get("timeout"):
+        limits["timeout"] = int(task["timeout"])
+    return limits
+
+def usage_fields(wall_time, cpu_time, max_rss_kb):
+    return {"wall_ms": int(wall_time * 1000), "cpu_ms": int(cpu_time * 1000),
+            "max_rss_kb": int(max_rss_kb)}
+
+# --------------------------------------------------------------------------- #
+# Set on the child process once it has started, rather than between fork() and
+# exec() (Popen "preexec_fn"), which can deadlock in a multi-threaded process
+# like the TaskManager.  So the command runs for an instant before its limits
+# apply, which processes it starts in that instant don't inherit
+
+def set_resource_limits(process_id, limits):
+    try:
+        if limits.get("cpu"):
+            resource.prlimit(process_id, resource.RLIMIT_CPU,
+                (limits["cpu"], limits["cpu"] + CPU_LIMIT_GRACE_TIME))
+        if limits.get("memory"):
+            resource.prlimit(process_id, resource.RLIMIT_AS,
+                (limits["memory"], limits["memory"]))
+    except ProcessLookupError:  # already exited
+        pass
+
+def kill_process_group(process_group_id):
+    try:
+        os.killpg(process_group_id, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+# Run a command, like "subprocess.run(tokens, check=True)".  Returns the usage,
+# raises TaskLimitExceeded or subprocess.CalledProcessError.
+# os.wait4() is used, rather than Popen.wait(), to get the child's usage.
+# If "log" (a TaskLog) is given, the command's stdout and stderr are written to
+# it, otherwise they are inherited
+
+def run_subprocess(tokens, limits, log=None):
+    start_time = time.perf_counter()
+    output = {"stdout": subprocess.PIPE, "stderr": subprocess.STDOUT} if log  \
+        else {}
+    process = subprocess.Popen(tokens, shell=False, start_new_session=True,
+        **output)
+    set_resource_limits(process.pid, limits)
+    pump = log.pump(process.stdout) if log else None
+    timed_out = threading.Event()
+
+    def timeout_expired():
+        timed_out.set()
+        kill_process_group(process.pid)
+
+    timer = None
+    if limits.get("timeout"):
+        timer = threading.Timer(limits["timeout"], timeout_expired)
+        timer.daemon = True
+        timer.start()
+    try:
+        _, wait_status, rusage = os.wait4(process.pid, 0)
+    finally:
+        if timer:
+            timer.cancel()
+    if pump:  # a daemonized grandchild could hold the pipe open, don't wait
+        pump.join(LOG_DRAIN_TIME)
+    process.returncode = os.waitstatus_to_exitcode(wait_status)
+    usage = usage_fields(time.perf_counter() - start_time,
+        rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss)
+
+    if timed_out.is_set():
+        raise TaskLimitExceeded(
+            f"Timeout after {limits['timeout']} seconds", usage)
+    if limits.get("cpu") and (process.returncode == -signal.SIGXCPU or
+            process.returncode == -signal.SIGKILL and  \
+            usage["cpu_ms"] >= limits["cpu"] * 1000):  # ignored SIGXCPU
+        raise TaskLimitExceeded(
+            f"CPU limit of {limits['cpu']} seconds exceeded", usage)
+    if process.returncode == LIMIT_EXCEEDED_EXIT_CODE:
+        raise TaskLimitExceeded(
+            f"Limit exceeded, exit code {process.returncode}", usage)
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, tokens)
+    return usage
+
+# Run a builtin command, "echo" or "sleep", in the calling thread.  Returns the
+# usage, raises TaskLimitExceeded, like run_subprocess()
+
+def run_builtin(tokens, limits):
+    start_time = time.perf_counter()
+    start_usage = resource.getrusage(resource.RUSAGE_THREAD)
+    timed_out = False
+    if tokens[0] == "echo":
+        print(f"---- {' '.join(tokens[1:])}")
+    elif tokens[0] == "sleep":
+        seconds = int(tokens[1])
+        timed_out = bool(limits.get("timeout")) and seconds > limits["timeout"]
+        time.sleep(limits["timeout"] if timed_out else seconds)
+    usage = resource.getrusage(resource.RUSAGE_THREAD)
+    usage = usage_fields(time.perf_counter() - start_time,
+        usage.ru_utime + usage.ru_stime -
+            start_usage.ru_utime - start_usage.ru_stime,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    if timed_out:
+        raise TaskLimitExceeded(
+            f"Timeout after {limits['timeout']} seconds", usage)
+    return usage
+
+# --------------------------------------------------------------------------- #
+# Limits a TaskHandler running in the (main thread of the) worker process.
+# The memory limit applies to the whole worker process, while it runs
+
+@contextmanager
+def limit_handler(limits):
+    def limit_exceeded(signal_number, frame):
+        if signal_number == signal.SIGALRM:
+            raise TaskLimitExceeded(
+                f"Timeout after {limits['timeout']} seconds")
+        raise TaskLimitExceeded(
+            f"CPU limit of {limits['cpu']} seconds exceeded")
+
+    previous_handlers = {
+        signal_number: signal.signal(signal_number, limit_exceeded)
+        for signal_number in [signal.SIGALRM, signal.SIGPROF]}
+    memory_limit = resource.getrlimit(resource.RLIMIT_AS)
+    try:
+        if limits.get("memory"):
+            resource.setrlimit(resource.RLIMIT_AS,
+                (limits["memory"], memory_limit[1]))
+        if limits.get("timeout"):
+            signal.setitimer(signal.ITIMER_REAL, limits["timeout"])
+        if limits.get("cpu"):
+            signal.setitimer(signal.ITIMER_PROF, limits["cpu"])
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        resource.setrlimit(resource.RLIMIT_AS, memory_limit)
+        for signal_number, previous_handler in previous_handlers.items():
+            signal.signal(signal_number, previous_handler)
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#
+# Task log capture
+# ================
+# The stdout and stderr of each Task, e.g a Team's submission printing every
+# step, are captured into a TaskLog, rather than being printed by the
+# TaskManager, which would slow down its run loop and lose the output
+#
+# - A gzip compressed log file per Task attempt, in TASK_LOG_DIR, e.g
+#   "task_logs/task_000042_1.log.gz", which can be read with "zcat" ...
+#   or "./task_manager.py logs 42 --follow" whilst the Task runs
+# - A ring buffer of the last TASK_LOG_TAIL_LINES lines, which are recorded
+#   in the Task "log" field when it finishes ...
+#
+#     {"path": "/.../task_000042_1.log.gz", "bytes": 1234, "dropped": 0,
+#      "tail": ["last line", ...]}
+#
+# Storage is bounded: only the first TASK_LOG_MAX_BYTES of each Task's output
+# are written to its log file (the tail is still kept), and the oldest log
+# files are deleted once TASK_LOG_DIR holds more than TASK_LOG_DIR_MAX_BYTES.
+#
+# The log file is flushed (zlib Z_SYNC_FLUSH) every TASK_LOG_FLUSH_TIME, so
+# that a follower can decompress everything written so far.
+
+from collections import deque
+import codecs
+import glob
+import gzip
+import os
+import sys
+import threading
+import time
+import zlib
+
+TASK_LOG_DIR = os.environ.get("TASK_LOG_DIR", "task_logs")
+TASK_LOG_MAX_BYTES = 16 * 1024 * 1024        # uncompressed, per Task attempt
+TASK_LOG_DIR_MAX_BYTES = 1024 * 1024 * 1024  # compressed, all log files
+TASK_LOG_TAIL_LINES = 20     # kept in the Task item, so keep it small ...
+TASK_LOG_LINE_LENGTH = 400   # characters per tail line
+TASK_LOG_FLUSH_TIME = 1.0    # seconds
+TASK_LOG_POLL_TIME = 0.5     # seconds between reads when following
+
+def task_log_path(log_dir, task):
+    return os.path.abspath(os.path.join(log_dir,
+        f"task_{int(task['id']):06d}_{int(task.get('attempts', 1))}.log.gz"))
+
+# Delete the oldest log files until there are at most "max_bytes" of them
+
+def prune_task_logs(log_dir, max_bytes=TASK_LOG_DIR_MAX_BYTES):
+    log_files = []
+    for path in glob.glob(os.path.join(log_dir, "task_*.log.gz")):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:  # pruned by another TaskManager
+            continue
+        log_files.append((stat.st_mtime, stat.st_size, path))
+    total_bytes = sum(size for _, size, _ in log_files)
+    for _, size, path in sorted(log_files):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+
+# --------------------------------------------------------------------------- #
+# File-like, so that it can replace sys.stdout and sys.stderr, e.g
+#
+#     with TaskLog(path) as task_log, contextlib.redirect_stdout(task_log):
+#         ...
+
+class TaskLog():
+    def __init__(self, path, max_bytes=TASK_LOG_MAX_BYTES,
+                 tail_lines=TASK_LOG_TAIL_LINES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.bytes = 0          # written to the log file
+        self.dropped = 0        # over "max_bytes", not written
+        self.tail = deque(maxlen=tail_lines)
+        self.partial_line = ""
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.file = gzip.open(path, "wb")
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self.flush_loop, daemon=True)
+        self.flusher.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.close()
+
+    def write(self, text):
+        data = text.encode(errors="replace")
+        with self.lock:
+            if self.closed.is_set():
+                return len(text)
+            if self.bytes + len(data) <= self.max_bytes:
+                self.file.write(data)
+                self.bytes += len(data)
+            else:
+                self.dropped += len(data)
+            lines = (self.partial_line + text).split("\n")
+            self.partial_line = lines.pop()
+            self.tail.extend(line[:TASK_LOG_LINE_LENGTH] for line in lines)
+        return len(text)
+
+    def flush(self):  # the log file is flushed by flush_loop()
+        pass
+
+    def flush_loop(self):
+        while not self.closed.wait(TASK_LOG_FLUSH_TIME):
+            with self.lock:
+                if not self.closed.is_set():
+                    self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.closed.is_set():
+                return
+            if self.dropped:
+                self.file.write(f"\n... {self.dropped} bytes not logged, "
+                    f"over the {self.max_bytes} byte limit\n".encode())
+            self.file.close()
+            if self.partial_line:
+                self.tail.append(self.partial_line[:TASK_LOG_LINE_LENGTH])
+                self.partial_line = ""
+            self.closed.set()
+
+    def summary(self):
+        with self.lock:
+            return {"path": self.path, "bytes": self.bytes,
+                    "dropped": self.dropped, "tail": list(self.tail)}
+
+# Pump a subprocess's output (a binary pipe) into the TaskLog, until EOF
+
+    def pump(self, pipe):
+        thread = threading.Thread(target=self.pump_lines, args=(pipe,),
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    def pump_lines(self, pipe):
+        with pipe:
+            for line in iter(pipe.readline, b""):
+                self.write(line.decode(errors="replace"))
+
+# Summary of a TaskLog written by another process, e.g a TaskHandler worker
+
+def read_task_log_summary(path, tail_lines=TASK_LOG_TAIL_LINES):
+    tail = deque(maxlen=tail_lines)
+    byte_count = 0
+    try:
+        with gzip.open(path, "rb") as file:
+            for line in file:
+                byte_count += len(line)
+                tail.append(line.decode(errors="replace")
+                                .rstrip("\n")[:TASK_LOG_LINE_LENGTH])
+    except (FileNotFoundError, EOFError):
+        pass
+    return {"path": path, "bytes": byte_count, "dropped": 0, "tail": list(tail)}
+
+# --------------------------------------------------------------------------- #
+# Copy a log file to "file".  When following, keep reading what is appended to
+# the log file until "finished()" is True, e.g the Task is no longer running
+
+def read_task_log(path, file=sys.stdout, follow=False, finished=None,
+                  poll_time=TASK_LOG_POLL_TIME):
+    while follow and not os.path.exists(path):
+        if finished and finished():
+            return False
+        time.sleep(poll_time)
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)  # gzip
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    last_read = False
+    with open(path, "rb") as log_file:
+        while not decompressor.eof:
+            data = log_file.read(64 * 1024)
+            if data:
+                file.write(decoder.decode(decompressor.decompress(data)))
+                file.flush()
+                continue
+            if not follow or last_read:
+                break
+            last_read = finished is not None and finished()
+            if not last_read:
+                time.sleep(poll_time)
+    file.write(decoder.decode(b"", final=True))
+    return True
@@ -12,14 +12,20 @@
 # -------------------------------------------------
 # ./task_manager check             # test database (developers only)
 # ./task_manager create <COMMAND>
-# ./task_manager delete <TASK_ID>  # warning: may cause problems
+# ./task_manager create <COMMAND> --after <TASK_ID> --after <TASK_ID>
+# ./task_manager delete <TASK_ID>
 # ./task_manager destroy           # don't destroy the production database
 # ./task_manager list
 # ./task_manager list --all        # show all Task fields
+# ./task_manager list --archived   # show archived Task history
+# ./task_manager archive --days 7  # archive finished Tasks older than 7 days
 # ./task_manager list --field command <COMMAND>
 # ./task_manager list --field id <TASK_ID>
 # ./task_manager list --field state <pending|running|success|error>
 # ./task_manager update <TASK_ID> <FIELD_NAME> <FIELD_VALUE>
+# ./task_manager export tasks.jsonl   # all Tasks as JSON lines, "-" is stdout
+# ./task_manager import tasks.jsonl   # e.g migrate to another table or backend
+# ./task_manager run --sleep 5 --workers 4
 #
 # Usage: AWS CLI
 # --------------
@@ -49,7 +55,6 @@
 # * FIX: Improve DynamoDB Tasks table schema partition and sort keys
 #   - Run performance tests before and after improving partition and sort keys
 #
-# * FIX: create_unique_item() problem with gaps in the task ids
 # * Consider Tasks table: "id" sort key type ... integer or string ?
 #
 # - FIX: Capture database errors (avoid messy stack traceback)
@@ -58,18 +63,15 @@
 # - Review Slack conversation with Louka: trading submission detailed design
 #
 # - Implement logger with date/time
-# - Implement performance measurement
 #
 # - Refactor "class Database" into separate source code file
 # - Create "class Task"
 #
-# * Implement task_manager import and export commands
-#
 # - Create AWS Boto3 configuration data structure
 #   - Include optional local Boto3 endpoint
 #
 # - TaskHandler template and example
-#   - Use Service Provider Interface (SPI) ?
+#   - Use Service Provider Interface (SPI) ? ... see task_handlers.py
 #   - Process.run()
 #   - Update DynamoDB
 #   - Run Docker container
@@ -86,21 +88,97 @@
 #   - Task queue CRUD
 #   - Event --> pending Task
 
-import boto3
+import base64
 from boto3.dynamodb.conditions import Attr, Key
 from botocore.exceptions import ClientError as BotocoreClientError
 import click
-from datetime import date, datetime, timezone
-from flask import Flask
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from dynamodb_resources import (
+    bootstrap_once, forget_bootstrap, forget_table, get_dynamodb_resource,
+    get_table_names, table_exists
+)
+from flask import Flask, request
 import json
+import multiprocessing
 import os
 from pprint import pprint
+import queue
+import socket
 import subprocess
+import sys
+from task_handlers import get_handler, run_handler
+from task_limits import (
+    TaskLimitExceeded, get_task_limits, run_builtin, run_subprocess
+)
+from task_logs import (
+    TASK_LOG_DIR, TaskLog, prune_task_logs, read_task_log,
+    read_task_log_summary, task_log_path
+)
+from task_metrics import (
+    METRICS, METRICS_CONTENT_TYPE, TASKS, TASK_QUEUE_WAIT_SECONDS,
+    TASK_RUN_SECONDS, TIMER_LATENESS_SECONDS, command_type, timed
+)
+from task_queue import coalesce_tasks, order_pending_tasks
+from task_retry import get_retry_policy, retry_delay
+from task_scheduler import CrontabError, TimerScheduler, parse_crontab
+import threading
 import time
+import urllib.error
+import urllib.request
+import uuid
+from werkzeug.serving import make_server
 
 RUN_LOOP_SLEEP_TIME = 60  # seconds ... can be overridden on the command line
+                          # also how often Timer changes are read (see below)
+RUN_WORKERS = 1           # concurrent Tasks ... can be overridden on the command line
+
+# Task handlers (see task_handlers.py) run in a pool of worker processes, which
+# are started ("spawn") rather than forked from the multi-threaded TaskManager
+HANDLER_START_METHOD = "spawn"
+
+# Creating a Task notifies the TaskManager run loop via HTTP, so that it starts
+# the Task immediately.  Polling every RUN_LOOP_SLEEP_TIME is the fallback
+TASK_MANAGER_HOST = "localhost"
+TASK_MANAGER_PORT = int(os.environ.get("TASK_MANAGER_PORT", 8001))
+TASK_MANAGER_URL = os.environ.get(
+    "TASK_MANAGER_URL", f"http://{TASK_MANAGER_HOST}:{TASK_MANAGER_PORT}")
+NOTIFY_TIMEOUT = 0.5  # seconds ... don't hold up Task creation
+
+# The same port serves the HTTP Task API (see create_app()), e.g for operators
+# and the web UI.  Waiting for a Task to change state is a long-poll request,
+# woken up by this TaskManager's own state transitions, otherwise re-reading
+# the Task every TASK_WAIT_POLL_TIME
+API_PAGE_SIZE = 50            # Tasks per page, unless "limit" is given ...
+API_MAX_PAGE_SIZE = 1000      # ... up to this many
+TASK_WAIT_TIME = 30           # seconds, unless "timeout" is given ...
+TASK_WAIT_MAX_TIME = 60       # ... up to this many
+TASK_WAIT_POLL_TIME = 2       # seconds
+
+# Running Tasks are claimed with a lease, so that several TaskManagers (on
+# different hosts) can share the same tasks table.  The owner renews the lease
+# every LEASE_HEARTBEAT_TIME, while the Task runs.  A Task whose lease expired,
+# because its TaskManager crashed, is requeued by any other TaskManager
+LEASE_TIME = 120           # seconds
+LEASE_HEARTBEAT_TIME = 30  # seconds
+
+# Finished Tasks are moved to the archive table once they are ARCHIVE_AGE old,
+# so that the tasks table only holds the recent working set
+ARCHIVE_AGE = 7 * 86400       # seconds ... can be overridden on the command line
+ARCHIVE_INTERVAL = 3600       # seconds between archiving by the run loop
+ARCHIVE_STATES = ["success", "error", "superseded"]
+ARCHIVE_BATCH_SIZE = 100      # Tasks read per query page, then batch written
+
+EXPORT_SEGMENTS = 4           # parallel scan segments ... command line option
+IMPORT_BATCH_SIZE = 100       # Tasks read, then batch written (25 per request)
 
 CONFIGURATION_PATHNAME = ".credentials.json"
+
+# Setting DB_SQLITE_PATH stores Tasks in an embedded SQLite database file,
+# rather than DynamoDB, e.g for development and single host deployments
+DB_SQLITE_PATH = os.environ.get("DB_SQLITE_PATH")
 # DB_URL = None                   # use AWS hosted DynamoDB instance
 DB_URL = "http://localhost:8000"  # use local DynamoDB instance
 
@@ -108,17 +186,54 @@ DB_URL = "http://localhost:8000"  # use local DynamoDB instance
 DB_PREFIX = os.environ.get("USER", os.environ.get("USERNAME"))
 DB_DATAPOINTS_TABLE_NAME = f"{DB_PREFIX}_datapoints"  # "green-battery-hack"
 DB_TASKS_TABLE_NAME = f"{DB_PREFIX}_tasks"
+DB_TASKS_ARCHIVE_TABLE_NAME = f"{DB_PREFIX}_tasks_archive"
 
 DB_TABLE_SCHEMAS = {
-    DB_DATAPOINTS_TABLE_NAME: ("commit_id", "team", 5, 5),
-    DB_TASKS_TABLE_NAME:      ("task",      "id",   1, 1)
+    DB_DATAPOINTS_TABLE_NAME:    ("commit_id", "team", 5, 5),
+    DB_TASKS_TABLE_NAME:         ("task",      "id",   1, 1),
+    DB_TASKS_ARCHIVE_TABLE_NAME: ("task",      "id",   1, 1)
+}
+
+# Global secondary indexes, so that finding Tasks in a given state (such as
+# "pending") reads just those Tasks, rather than every Task ever created
+
+DB_TASKS_STATE_INDEX_NAME = "state_index"
+DB_TABLE_INDEXES = {
+    DB_TASKS_TABLE_NAME: [
+        (DB_TASKS_STATE_INDEX_NAME, "state_", "created_at", 1, 1)
+    ]
 }
 
 # Note: DynamoDB has the "state" reserved word, so "state_" is used instead
 # Note: "created_at" and "run_at" are when Task creation and execution occurred
 
+TASK_STATES = [
+    "waiting", "pending", "running", "success", "error", "superseded", "timer"
+]
+ACTIVE_STATES = [state_ for state_ in TASK_STATES if state_ not in ARCHIVE_STATES]
+
 DB_TASK_FIELD_NAMES = [  # mutable task fields, i.e not task keys
-    "command", "created_at", "crontab", "diagnostic", "run_at", "state_"
+    "attempts", "command", "created_at", "crontab", "dependents",
+    "depends_on", "diagnostic", "idempotency_key", "lease_expires", "log",
+    "not_before", "owner", "priority", "run_at", "state_", "superseded_by",
+    "team", "timeout", "usage"
+]
+
+# Each item type has a counter item holding the last allocated id, e.g
+# {"task": "counter", "id": "task", "last_id": 42}, which is atomically
+# incremented to allocate new ids.  Not in the "task" partition, so queries
+# for Tasks don't see it
+
+DB_COUNTER_KEY = "counter"
+
+# Likewise, each idempotency key has an item holding the id of the Task created
+# with it, e.g {"task": "idempotency_key", "id": "kickoff_task:42", "task_id":
+# "43"}, which is created conditionally, so only one Task is ever created
+
+DB_IDEMPOTENCY_KEY = "idempotency_key"
+
+DB_TASK_LIST_FIELD_NAMES = [  # task fields shown by print_tasks()
+    "id", "command", "created_at", "crontab", "depends_on", "state_"
 ]
 
 # --------------------------------------------------------------------------- #
@@ -134,29 +249,56 @@ DB_TASK_FIELD_NAMES = [  # mutable task fields, i.e not task keys
 #   AttributeName: diagnostic, AttributeType: S, "Message for success or error"
 #   AttributeName: created_at, AttributeType: S, datetime.utcnow().isoformat()
 #   AttributeName: run_at,     AttributeType: S, datetime.utcnow().isoformat()
+#   AttributeName: owner,      AttributeType: S, TaskManager that ran the Task
+#   AttributeName: lease_expires, AttributeType: N, seconds since the epoch
+#   AttributeName: depends_on, AttributeType: L, parent Task ids
+#   AttributeName: dependents, AttributeType: L, child Task ids
+#   GlobalSecondaryIndex: state_index (state_: HASH, created_at: RANGE)
+#
+# Table: energy_tasks_archive
+#   Same as energy_tasks, without the index: finished Tasks moved by archive
+#
+# Storage interface: Another storage backend, e.g SQLiteDatabase, subclasses
+# Database and implements create_tables(), destroy_tables(), get_table_names(),
+# create_unique_item(), reserve_ids(), advance_counter(),
+# claim_idempotency_key(), get_task(),
+# get_tasks(), get_tasks_page(), scan_tasks(), put_tasks(), update_task(), transition_task(),
+# append_task_list(), delete_task() and archive_tasks() ...
+# the Task semantics, including the conditional transitions, must be the same
+# as DynamoDB
 
 class Database():
     def __init__(self, aws_access_key_id, aws_secret_access_key):
-        self.boto3_session = boto3.Session(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name="us-east-1"
-        )
+        self.aws_access_key_id = aws_access_key_id
+        self.aws_secret_access_key = aws_secret_access_key
+        self.notify_url = TASK_MANAGER_URL  # None: don't notify TaskManager
 
-        db_args = {"service_name": "dynamodb"}
-        if DB_URL:
-            db_args["endpoint_url"] = DB_URL
-    #   self.db_client = self.boto3_session.client(**db_args)      # low-level
-        self.db_resource = self.boto3_session.resource(**db_args)  # high-level
-        self.delete_task_warning = True
+        bootstrap_once(self.db_resource, "Database", self.create_schema)
 
-        self.create_tables()
-        self.datapoints_table = self.get_table(DB_DATAPOINTS_TABLE_NAME)
-        self.tasks_table = self.get_table(DB_TASKS_TABLE_NAME)
+# Boto3 resources are not thread safe, so that TaskManager worker threads can
+# share a Database instance, each thread gets its own resource, which share a
+# pooled boto3 client (see dynamodb_resources.py)
+
+    @property
+    def db_resource(self):
+        return get_dynamodb_resource(
+            self.aws_access_key_id, self.aws_secret_access_key, DB_URL)
+
+    @property
+    def datapoints_table(self):
+        return self.db_resource.Table(DB_DATAPOINTS_TABLE_NAME)
+
+    @property
+    def tasks_table(self):
+        return self.db_resource.Table(DB_TASKS_TABLE_NAME)
+
+    @property
+    def tasks_archive_table(self):
+        return self.db_resource.Table(DB_TASKS_ARCHIVE_TABLE_NAME)
 
 # Database tables functions ................................................. #
 
-    def create_table(self, table_name, table_schema):
+    def create_table(self, table_name, table_schema, index_schemas=()):
         partition_key_name, sort_key_name,  \
             read_capacity_units, write_capacity_units = table_schema
 
@@ -170,6 +312,13 @@ class Database():
             attr_def.append(
                 {"AttributeName": sort_key_name, "AttributeType": "S"})
 
+        table_args = {}
+        if index_schemas:
+            attr_def = self.index_attribute_definitions(attr_def, index_schemas)
+            table_args["GlobalSecondaryIndexes"] = [
+                self.index_definition(index_schema)
+                for index_schema in index_schemas]
+
         table = self.db_resource.create_table(
             TableName=table_name,
             KeySchema=key_schema,
@@ -177,16 +326,80 @@ class Database():
             ProvisionedThroughput={
                 "ReadCapacityUnits": read_capacity_units,
                 "WriteCapacityUnits": write_capacity_units
-            }
+            },
+            **table_args
         )
         table.wait_until_exists()
         return table
 
+# Schema bootstrap, done once per process (see Database.__init__())
+
+    def create_schema(self):
+        self.create_tables()
+        self.create_counter(self.tasks_table, "task")
+
     def create_tables(self):
         for table_name, table_schema in DB_TABLE_SCHEMAS.items():
+            index_schemas = DB_TABLE_INDEXES.get(table_name, [])
             table = self.get_table(table_name)
             if not table:
-                table = self.create_table(table_name, table_schema)
+                table = self.create_table(table_name, table_schema, index_schemas)
+            else:
+                self.create_indexes(table, index_schemas)
+
+# Add any missing indexes to tables created before the indexes were defined
+
+    def create_indexes(self, table, index_schemas):
+        index_names = [index["IndexName"]
+                       for index in table.global_secondary_indexes or []]
+        for index_schema in index_schemas:
+            index_name = index_schema[0]
+            if index_name in index_names:
+                continue
+            print(f"## Creating index {table.name}.{index_name}")
+            attr_def = self.index_attribute_definitions(
+                table.attribute_definitions, [index_schema])
+            table.update(
+                AttributeDefinitions=attr_def,
+                GlobalSecondaryIndexUpdates=[
+                    {"Create": self.index_definition(index_schema)}]
+            )
+            while self.get_index_status(table, index_name) != "ACTIVE":
+                time.sleep(1)
+
+    def get_index_status(self, table, index_name):
+        table.reload()
+        for index in table.global_secondary_indexes or []:
+            if index["IndexName"] == index_name:
+                return index.get("IndexStatus", "ACTIVE")
+        return None
+
+    def index_attribute_definitions(self, attr_def, index_schemas):
+        attr_def = list(attr_def)
+        attr_names = [attr["AttributeName"] for attr in attr_def]
+        for index_schema in index_schemas:
+            for attr_name in index_schema[1:3]:
+                if attr_name not in attr_names:
+                    attr_def.append(
+                        {"AttributeName": attr_name, "AttributeType": "S"})
+                    attr_names.append(attr_name)
+        return attr_def
+
+    def index_definition(self, index_schema):
+        index_name, partition_key_name, sort_key_name,  \
+            read_capacity_units, write_capacity_units = index_schema
+        return {
+            "IndexName": index_name,
+            "KeySchema": [
+                {"AttributeName": partition_key_name, "KeyType": "HASH"},
+                {"AttributeName": sort_key_name, "KeyType": "RANGE"}
+            ],
+            "Projection": {"ProjectionType": "ALL"},
+            "ProvisionedThroughput": {
+                "ReadCapacityUnits": read_capacity_units,
+                "WriteCapacityUnits": write_capacity_units
+            }
+        }
 
     """
     def describe_table(self, table_name):
@@ -199,10 +412,12 @@ class Database():
             table = self.get_table(table_name)
             if table:
                 table.delete()
+            forget_table(self.db_resource, table_name)
+        forget_bootstrap(self.db_resource, "Database")
 
     def get_table(self, table_name):
         table = None
-        if table_name in self.get_table_names():
+        if table_exists(self.db_resource, table_name):  # cached
             table = self.db_resource.Table(table_name)
         return table
 
@@ -215,19 +430,135 @@ class Database():
         return table.scan()
 
     def get_table_names(self):
-    #   table_names = self.db_client.list_tables()["TableNames"]
-        table_names = [table.name for table in self.db_resource.tables.all()]
-        return table_names
+        return sorted(get_table_names(self.db_resource, refresh=True))
 
 # Database tasks functions .................................................. #
 
-    def create_task(self, command):
+# A Task that "depends_on" other (parent) Tasks is "waiting" until they have
+# all succeeded, then becomes "pending".  If any parent fails, then so does the
+# Task.  Each parent lists its "dependents", so that finishing it releases them.
+# The parents are checked again after being updated, in case a parent finished
+# in the meantime (before its "dependents" included this Task).  A parent that
+# was "superseded" is replaced by the Task it was merged into (see
+# TaskManager.coalesce_pending_tasks)
+
+# Creating a Task with an "idempotency_key" that has already been used doesn't
+# create another Task, but returns the id of the Task created with it, e.g so
+# that a retried Task doesn't create its follow-on Task twice
+
+# A command that includes its own Task id (e.g "--task_id") is created with an
+# id from reserve_task_id(), so that the Task is never pending without it
+
+    def create_task(self, command, depends_on=None, timeout=None,
+                    priority=None, idempotency_key=None, task_id=None):
         fields = {
             "state_": "pending", "command": command, "diagnostic": "",
             "created_at": self.datetime_now_utc_iso(),
             "run_at": ""
         }
-        return self.create_unique_item(self.tasks_table, "task", fields)
+        if timeout:  # seconds, overrides TASK_LIMITS (see task_limits.py)
+            fields["timeout"] = int(timeout)
+        if priority is not None:  # overrides TASK_PRIORITIES (task_queue.py)
+            fields["priority"] = int(priority)
+        if depends_on:
+            fields["state_"] = "waiting"
+            fields["depends_on"] = [str(parent_id) for parent_id in depends_on]
+        if idempotency_key or task_id:
+            task_id = task_id or self.reserve_task_id()
+            if idempotency_key:
+                existing_task_id =  \
+                    self.claim_idempotency_key(idempotency_key, task_id)
+                if existing_task_id:
+                    return existing_task_id
+                fields["idempotency_key"] = idempotency_key
+            self.put_tasks([{"task": "task", "id": str(task_id), **fields}])
+        else:
+            task_id = self.create_unique_item(self.tasks_table, "task", fields)
+        if depends_on:
+            for parent_id in fields["depends_on"]:
+                self.append_task_list(parent_id, "dependents", [str(task_id)])
+            self.release_task(task_id)
+        else:
+            self.notify_task_manager(task_id)
+        return task_id
+
+    def reserve_task_id(self):
+        return self.reserve_ids(self.tasks_table, "task")[0]
+
+# Create many Tasks, e.g one per Team, reserving their ids in one request and
+# writing them in batches (25 Tasks per request).  Returns the Task ids
+
+    def create_tasks(self, commands):
+        if not commands:
+            return []
+        task_ids = self.reserve_ids(self.tasks_table, "task", len(commands))
+        created_at = self.datetime_now_utc_iso()
+        self.put_tasks([
+            {"task": "task", "id": str(task_id), "state_": "pending",
+             "command": command, "diagnostic": "", "created_at": created_at,
+             "run_at": ""}
+            for task_id, command in zip(task_ids, commands)])
+        self.notify_task_manager()
+        return task_ids
+
+# Fan-out a group of Tasks, which run in parallel (once "depends_on" Tasks
+# have succeeded), then optionally fan-in to a "join_command" Task, which runs
+# once the whole group has succeeded.  Returns the group and join Task ids
+
+    def create_group(self, commands, depends_on=None, join_command=None):
+        task_ids = [self.create_task(command, depends_on)
+                    for command in commands]
+        join_task_id = None
+        if join_command:
+            join_task_id = self.create_task(join_command, task_ids)
+        return task_ids, join_task_id
+
+# Move a "waiting" Task to "pending" or "error", depending upon its parents.
+# Transitions are conditional on "waiting", so releasing twice is harmless
+
+    def release_task(self, task_id):
+        task = self.get_task(task_id)
+        if not task or task["state_"] != "waiting":
+            return
+        parent_states = {}
+        for parent_id in task.get("depends_on", []):
+            parent_states[parent_id] = self.get_parent_state(parent_id, task_id)
+
+        failed_ids = [parent_id for parent_id, state_ in parent_states.items()
+                      if state_ == "error"]
+        if failed_ids:
+            diagnostic = f"Error: Depends on failed Task {', '.join(failed_ids)}"
+            task = self.transition_task(
+                task_id, "waiting", "error", {"diagnostic": diagnostic})
+            if task:
+                self.release_dependents(task)
+        elif all(state_ == "success" for state_ in parent_states.values()):
+            if self.transition_task(task_id, "waiting", "pending"):
+                self.notify_task_manager(task_id)
+
+    def release_dependents(self, task):
+        for dependent_id in task.get("dependents", []):
+            self.release_task(dependent_id)
+
+# A "superseded" parent never finishes, so the Task waits for the Task that it
+# was merged into ("superseded_by") instead, by being added to its "dependents"
+# before its state is read.  A parent superseded without a "superseded_by"
+# Task, or that no longer exists, counts as failed
+
+    def get_parent_state(self, parent_id, task_id):
+        field_names = ["state_", "superseded_by"]
+        while True:
+            parent = self.get_task(parent_id, field_names) or  \
+                     self.get_task(parent_id, field_names, archived=True)
+            if not parent or parent["state_"] != "superseded":
+                return parent["state_"] if parent else "error"
+            parent_id = parent.get("superseded_by")
+            if not parent_id:
+                return "error"
+            merged_task = self.get_task(parent_id, ["state_", "dependents"])
+            if merged_task and  \
+                    str(task_id) not in merged_task.get("dependents", []):
+                self.append_task_list(parent_id, "dependents", [str(task_id)])
 
     def create_timer(self, command, crontab):
         fields = {
@@ -236,75 +567,323 @@ class Database():
             "created_at": self.datetime_now_utc_iso(),
             "run_at": self.datetime_epoch()[1]
         }
-        return self.create_unique_item(self.tasks_table, "task", fields)
+        timer_id = self.create_unique_item(self.tasks_table, "task", fields)
+        self.notify_task_manager(timer_id)
+        return timer_id
 
-# TODO: FIX: to always find the maximum id, not be confused by id_last["Count"]
-#       This is a potential problem when there is a gap in the task ids
-#       Avoid deleting tasks until the problem is resolved
+# Ids are allocated by atomically adding to the counter item ("UpdateItem ADD"),
+# so concurrent creators never contend for the same id, in one round-trip.
+# "attribute_not_exists(id)" is just a safety net, e.g if the counter item
+# was deleted or reset by hand
 
+    @timed
     def create_unique_item(self, table, item_type, fields=None):
-        id_key = id_value = item_type
-        id_new = 1
-        saved = False
-
-        id_last = table.query(
-            KeyConditionExpression=Key(id_key).eq(id_value),
-            ScanIndexForward=False,
-            Limit=1
+        while True:
+            id_new = self.reserve_ids(table, item_type)[0]
+            item = {item_type: item_type, "id": str(id_new)}
+            if fields:
+                item.update(fields)
+            try:
+                table.put_item(
+                    Item=item,
+                    ConditionExpression="attribute_not_exists(#id)",
+                    ExpressionAttributeNames={"#id": "id"}
+                )
+                return id_new
+            except BotocoreClientError as botocore_client_error:
+                if not self.is_conditional_check_failed(botocore_client_error):
+                    raise
+                print(f"Warning: {item_type} id {id_new} already exists")
+
+# Reserve a contiguous block of "count" ids, returns a list of integer ids
+
+    @timed
+    def reserve_ids(self, table, item_type, count=1):
+        result = table.update_item(
+            Key={item_type: DB_COUNTER_KEY, "id": item_type},
+            UpdateExpression="ADD last_id :count",
+            ExpressionAttributeValues={":count": count},
+            ReturnValues="UPDATED_NEW"
         )
-        if id_last["Count"] > 0:
-            id_new = int(id_last["Items"][0]["id"]) + 1
+        last_id = int(result["Attributes"]["last_id"])
+        return list(range(last_id - count + 1, last_id + 1))
 
-        while not saved:  # put new item, but only if the item doesn't exist
-            try:
-                id = str(id_new)
-                item = {id_key: id_value, "id": id}
-                if fields:
-                    item.update(fields)
-                condition_expr = f"attribute_not_exists({id_value})"
-                table.put_item(Item=item, ConditionExpression=condition_expr)
-                saved = True
-        #   except dynamo.meta.table.exceptions.ConditionalCheckFailedException
-            except Exception as exception:   # handle race condition, try again
-                id_new += 1
-        return int(id_new)
-
-# TODO: FIX: create_unique_item() problem with gaps in the task ids
+# Returns None if "key" is now claimed for "task_id", otherwise the id of the
+# Task that has already claimed it
 
+    @timed
+    def claim_idempotency_key(self, key, task_id):
+        item_key = {"task": DB_IDEMPOTENCY_KEY, "id": key}
+        try:
+            self.tasks_table.put_item(
+                Item={**item_key, "task_id": str(task_id)},
+                ConditionExpression="attribute_not_exists(#id)",
+                ExpressionAttributeNames={"#id": "id"}
+            )
+            return None
+        except BotocoreClientError as botocore_client_error:
+            if not self.is_conditional_check_failed(botocore_client_error):
+                raise
+        item = self.tasks_table.get_item(Key=item_key, ConsistentRead=True)
+        return int(item["Item"]["task_id"])
+
+# Make sure that ids up to "last_id" are never reserved, e.g after import
+
+    @timed
+    def advance_counter(self, table, item_type, last_id):
+        try:
+            table.update_item(
+                Key={item_type: DB_COUNTER_KEY, "id": item_type},
+                UpdateExpression="SET last_id = :last_id",
+                ConditionExpression="last_id < :last_id",
+                ExpressionAttributeValues={":last_id": last_id}
+            )
+        except BotocoreClientError as botocore_client_error:
+            if not self.is_conditional_check_failed(botocore_client_error):
+                raise  # otherwise, the counter is already past "last_id"
+
+# The counter item starts at the maximum existing id.  Finding it means reading
+# every id, since "id" is a string sort key ("9" > "10"), but only once per table
+
+    def create_counter(self, table, item_type):
+        key = {item_type: DB_COUNTER_KEY, "id": item_type}
+        if "Item" in table.get_item(Key=key, ConsistentRead=True):
+            return
+        query_args = {"KeyConditionExpression": Key(item_type).eq(item_type)}
+        query_args.update(self.projection_args(["id"]))
+        ids = [int(item["id"]) for item in self.query_items(table, query_args)]
+        try:
+            table.put_item(
+                Item={**key, "last_id": max(ids, default=0)},
+                ConditionExpression="attribute_not_exists(#id)",
+                ExpressionAttributeNames={"#id": "id"}
+            )
+        except BotocoreClientError as botocore_client_error:
+            if not self.is_conditional_check_failed(botocore_client_error):
+                raise  # otherwise, another process has just created it
+
+    def is_conditional_check_failed(self, botocore_client_error):
+        error_code = botocore_client_error.response["Error"]["Code"]
+        return error_code == "ConditionalCheckFailedException"
+
+# Append values to a list field, e.g "dependents".  Returns False if the Task
+# doesn't exist
+
+    @timed
+    def append_task_list(self, task_id, field_name, values):
+        try:
+            self.tasks_table.update_item(
+                Key={"task": "task", "id": str(task_id)},
+                UpdateExpression=
+                    "SET #f = list_append(if_not_exists(#f, :empty), :values)",
+                ConditionExpression="attribute_exists(#id)",
+                ExpressionAttributeNames={"#f": field_name, "#id": "id"},
+                ExpressionAttributeValues={":empty": [], ":values": values})
+            return True
+        except BotocoreClientError as botocore_client_error:
+            if self.is_conditional_check_failed(botocore_client_error):
+                return False
+            raise
+
+    @timed
     def delete_task(self, task_id):
-        if self.delete_task_warning:
-            self.delete_task_warning = False
-            print("Warning: Using Database.delete_task() may cause problems")
         self.tasks_table.delete_item(
             Key={"task": "task", "id": str(task_id)})
 
-    def get_task(self, task_id):
+    @timed
+    def get_task(self, task_id, field_names=None, archived=False):
         key = {"task": "task", "id": str(task_id)}
-        result = self.tasks_table.get_item(Key=key)
+        get_args = {"Key": key, "ConsistentRead": True}
+        if field_names:
+            get_args.update(self.projection_args(field_names))
+        table = self.tasks_archive_table if archived else self.tasks_table
+        result = table.get_item(**get_args)
         return result.get("Item")
 
-    def get_tasks(self, task_id=None, filter=None, sort_field=None):
-        if not task_id:
-            key_condition_expr = Key("task").eq("task")
-        else:
-            key_condition_expr = Key("task").eq("task") & Key("id").eq(task_id)
-
-        if not filter:  # ("key", "value"), e.g ("state_", "pending")
-            results = self.tasks_table.query(
-                KeyConditionExpression=key_condition_expr)["Items"]
+# Tasks in a given state are found via the "state_" index, i.e only reading
+# those Tasks.  Other filters have to read all the Tasks in the partition.
+# Note: Index reads are eventually consistent, use get_task() to confirm
+#       a Task's current state before acting upon it
+
+    @timed
+    def get_tasks(self, task_id=None, filter=None, sort_field=None,
+                  field_names=None, page_size=None, archived=False):
+        query_args = self.tasks_query_args(task_id, filter, field_names, archived)
+        if page_size:
+            query_args["Limit"] = page_size
+
+        table = self.tasks_archive_table if archived else self.tasks_table
+        results = self.query_items(table, query_args)
+        if archived and not sort_field:  # streamed, a page at a time
+            return results
+        results = list(results)
+        return self.sort_tasks(results, sort_field)
+
+    def tasks_query_args(self, task_id, filter, field_names, archived):
+        query_args = {}
+        if field_names:
+            query_args.update(self.projection_args(field_names))
+        if filter and filter[0] == "state_" and not task_id and not archived:
+            query_args["IndexName"] = DB_TASKS_STATE_INDEX_NAME
+            query_args["KeyConditionExpression"] = Key("state_").eq(filter[1])
         else:
-            filter_expr=Attr(filter[0]).eq(filter[1])
-            results = self.tasks_table.query(
-                KeyConditionExpression=key_condition_expr,
-                FilterExpression=filter_expr)["Items"]
-
+            if not task_id:
+                key_condition_expr = Key("task").eq("task")
+            else:
+                key_condition_expr =  \
+                    Key("task").eq("task") & Key("id").eq(task_id)
+            query_args["KeyConditionExpression"] = key_condition_expr
+            if filter:  # ("key", "value"), e.g ("command", "echo 1")
+                query_args["FilterExpression"] = Attr(filter[0]).eq(filter[1])
+        return query_args
+
+# One page of at most "limit" Tasks, e.g for the HTTP API (see create_app()).
+# Returns the Tasks and the cursor for the next page, None after the last page.
+# Pages are in key order, i.e by "created_at" when filtered by "state_",
+# otherwise by "id" as a string.  A filtered query may read several pages of
+# items to fill a page of Tasks
+
+    @timed
+    def get_tasks_page(self, filter=None, field_names=None,
+                       limit=API_PAGE_SIZE, cursor=None, archived=False):
+        query_args = self.tasks_query_args(None, filter, field_names, archived)
+        if cursor:
+            query_args["ExclusiveStartKey"] = decode_cursor(cursor)
+        table = self.tasks_archive_table if archived else self.tasks_table
+        tasks = []
+        while True:
+            query_args["Limit"] = limit - len(tasks)
+            response = table.query(**query_args)
+            tasks.extend(response["Items"])
+            last_key = response.get("LastEvaluatedKey")
+            if not last_key or len(tasks) >= limit:
+                break
+            query_args["ExclusiveStartKey"] = last_key
+        return tasks, encode_cursor(last_key) if last_key else None
+
+    def sort_tasks(self, tasks, sort_field):
         if sort_field:
             if sort_field in "id":
                 get_key_function = lambda d: int(d.get(sort_field, ""))
             else:
                 get_key_function = lambda d: d.get(sort_field, "")
-            results = sorted(results, key=get_key_function)
-        return results
+            tasks = sorted(tasks, key=get_key_function)
+        return tasks
+
+# Move finished Tasks created more than "age" seconds ago to the archive table,
+# a query page of ARCHIVE_BATCH_SIZE Tasks at a time.  Each page is written to
+# the archive before being deleted, so a crash may leave a Task in both tables,
+# but never in neither.  Returns the number of Tasks archived
+
+    @timed
+    def archive_tasks(self, age=ARCHIVE_AGE):
+        created_before = (datetime.utcnow() - timedelta(seconds=age)).isoformat()
+        archived_count = 0
+        for state_ in ARCHIVE_STATES:
+            query_args = {
+                "IndexName": DB_TASKS_STATE_INDEX_NAME,
+                "KeyConditionExpression": Key("state_").eq(state_) &
+                                          Key("created_at").lt(created_before),
+                "Limit": ARCHIVE_BATCH_SIZE
+            }
+            tasks = []
+            for task in self.query_items(self.tasks_table, query_args):
+                tasks.append(task)
+                if len(tasks) == ARCHIVE_BATCH_SIZE:
+                    archived_count += self.archive_batch(tasks)
+                    tasks = []
+            archived_count += self.archive_batch(tasks)
+        return archived_count
+
+    def archive_batch(self, tasks):
+        self.put_tasks(tasks, archived=True)
+        with self.tasks_table.batch_writer() as batch:
+            for task in tasks:
+                batch.delete_item(Key={"task": "task", "id": task["id"]})
+        return len(tasks)
+
+# Write whole Tasks, replacing any with the same id.  "batch_writer()" sends
+# 25 Tasks per BatchWriteItem request, resending any unprocessed items
+
+    @timed
+    def put_tasks(self, tasks, archived=False):
+        table = self.tasks_archive_table if archived else self.tasks_table
+        with table.batch_writer() as batch:
+            for task in tasks:
+                batch.put_item(Item=task)
+
+# Stream every Task, in no particular order, e.g for export.  The table is
+# read by "segments" parallel scans, one worker thread each, which pass their
+# pages back to this generator
+
+    def scan_tasks(self, archived=False, segments=EXPORT_SEGMENTS):
+        table_name = DB_TASKS_ARCHIVE_TABLE_NAME if archived  \
+            else DB_TASKS_TABLE_NAME
+        pages = queue.Queue()  # unbounded, so an abandoned export can't block
+
+        def scan_segment(segment):
+            table = self.db_resource.Table(table_name)  # thread's own resource
+            scan_args = {"Segment": segment, "TotalSegments": segments}
+            try:
+                while True:
+                    response = table.scan(**scan_args)
+                    pages.put(response["Items"])
+                    if "LastEvaluatedKey" not in response:
+                        break
+                    scan_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+            finally:
+                pages.put(None)  # segment finished
+
+        with ThreadPoolExecutor(max_workers=segments,
+                                thread_name_prefix="scan_segment") as executor:
+            futures = [executor.submit(scan_segment, segment)
+                       for segment in range(segments)]
+            finished_segments = 0
+            while finished_segments < segments:
+                items = pages.get()
+                if items is None:
+                    finished_segments += 1
+                    continue
+                for item in items:
+                    if item["task"] == "task":  # not the counter item
+                        yield item
+            for future in futures:
+                future.result()  # raise any scan error
+
+# DynamoDB returns at most 1 MB per query, follow "LastEvaluatedKey" for more
+
+    def query_items(self, table, query_args):
+        query_args = dict(query_args)
+        while True:
+            response = table.query(**query_args)
+            yield from response["Items"]
+            if "LastEvaluatedKey" not in response:
+                break
+            query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+# Only read the given fields.  Field names are substituted with placeholders,
+# because some are DynamoDB reserved words
+
+    def projection_args(self, field_names):
+        attr_names = {f"#p{index}": field_name
+                      for index, field_name in enumerate(field_names)}
+        return {
+            "ProjectionExpression": ", ".join(attr_names.keys()),
+            "ExpressionAttributeNames": attr_names
+        }
+
+    def notify_task_manager(self, task_id=None):  # best effort
+        if self.notify_url:
+            url = f"{self.notify_url}/notify"
+            if task_id:
+                url += f"?task_id={task_id}"
+            notify_request = urllib.request.Request(url, data=b"", method="POST")
+            try:
+                with urllib.request.urlopen(notify_request,
+                                            timeout=NOTIFY_TIMEOUT):
+                    pass
+            except (urllib.error.URLError, OSError):
+                pass
 
     def print_tasks(self, tasks, field_names=None, prefix="  Task"):
         if field_names:
@@ -318,10 +897,13 @@ class Database():
                 state_ = task["state_"]
                 if state_ == "timer":
                     command = f"[{task['crontab']}] {command}"
+                if state_ == "waiting":
+                    command = f"[after {' '.join(task['depends_on'])}] {command}"
                 print(f"{prefix} {id:06d}: {created_at} {state_:7}: {command}")
             else:
                 pprint(task)
 
+    @timed
     def update_task(self, task_id, fields):
         key = {"task": "task", "id": task_id}
         expression_attr_values = {}
@@ -342,6 +924,50 @@ class Database():
             ExpressionAttributeValues=expression_attr_values
         )
 
+    # Apply a state change and any other field changes in a single conditional
+    # write, which only succeeds if the task is still in one of "from_states"
+    # and its field values match "conditions", e.g {"owner": owner}.
+    # Returns the updated task, or None if another updater got there first.
+
+    @timed
+    def transition_task(self, task_id, from_states, to_state, fields=None,
+                        conditions=None):
+        if isinstance(from_states, str):
+            from_states = [from_states]
+        fields = {**(fields or {}), "state_": to_state}
+
+        expression_attr_names = {"#state": "state_"}
+        expression_attr_values = {}
+        update_exprs = []
+        for index, (field_name, field_value) in enumerate(fields.items()):
+            expression_attr_names[f"#f{index}"] = field_name
+            expression_attr_values[f":f{index}"] = field_value
+            update_exprs.append(f"#f{index} = :f{index}")
+        state_variables = []
+        for index, from_state in enumerate(from_states):
+            expression_attr_values[f":s{index}"] = from_state
+            state_variables.append(f":s{index}")
+        condition_exprs = [f"#state IN ({', '.join(state_variables)})"]
+        for index, (field_name, field_value) in  \
+                enumerate((conditions or {}).items()):
+            expression_attr_names[f"#c{index}"] = field_name
+            expression_attr_values[f":c{index}"] = field_value
+            condition_exprs.append(f"#c{index} = :c{index}")
+
+        try:
+            response = self.tasks_table.update_item(
+                Key={"task": "task", "id": str(task_id)},
+                UpdateExpression="SET " + ", ".join(update_exprs),
+                ConditionExpression=" AND ".join(condition_exprs),
+                ExpressionAttributeNames=expression_attr_names,
+                ExpressionAttributeValues=expression_attr_values,
+                ReturnValues="ALL_NEW")
+        except BotocoreClientError as botocore_client_error:
+            if self.is_conditional_check_failed(botocore_client_error):
+                return None
+            raise
+        return response["Attributes"]
+
     def valid_task_field_name(self, field_name):
         return field_name in DB_TASK_FIELD_NAMES
 
@@ -391,120 +1017,581 @@ class Database():
 # --------------------------------------------------------------------------- #
 
 class TaskManager():
-    def __init__(self, database):
+    def __init__(self, database, owner=None, log_dir=TASK_LOG_DIR):
         self.database: Database = database
+        self.owner = owner or  \
+            f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.server = None
+        self.notified_task_ids = set()  # may not be in the state index yet
+        self.notified_lock = threading.Lock()
+        self.timers = TimerScheduler()
+        self.handler_pool = None  # None: run every command as a subprocess
+        self.handler_workers = RUN_WORKERS
+        self.handler_lock = threading.Lock()
+        self.retry_time = None  # earliest "not_before" of the pending Tasks
+        self.log_dir = log_dir  # see task_logs.py
+        self.task_changed = threading.Condition()  # see wait_for_task()
+        self.task_change_count = 0
+
+    # Returns None if the task was changed by someone else in the meantime
 
     def process_start(self, task, new_state):
         task_id = task["id"]
-        command = task["command"]
         run_previous = task["run_at"]
-        task["run_at"] = self.database.datetime_now_utc_iso()
-        task["state_"] = new_state
-        if new_state != "timer":
-            self.database.update_task(task_id, {"run_at": task["run_at"]})
-        self.database.update_task(task_id, {"state_": task["state_"]})
+        run_at = self.database.datetime_now_utc_iso()
+        fields = {
+            "run_at": run_at, "owner": self.owner,
+            "lease_expires": int(time.time()) + LEASE_TIME,
+            "log": {"path": task_log_path(self.log_dir, task)}
+        }
         if task["diagnostic"] != "":
-            task["diagnostic"] = ""
-            self.database.update_task(
-                task_id, {"diagnostic": task["diagnostic"]})
+            fields["diagnostic"] = ""
+        started_task = self.database.transition_task(
+            task_id, "pending", new_state, fields)
+        if not started_task:
+            return None
+        self.notify_task_changed()
+        command = started_task["command"]  # may have been coalesced meanwhile
+        task["command"] = command
+        task["run_at"] = run_at
+        task["diagnostic"] = ""
+        task["state_"] = new_state
+        task["log"] = fields["log"]
         return task_id, command, run_previous
 
+    # Returns False if the task is no longer pending, e.g already started
+
     def process_task(self, task):
-        task_id, command, run_previous = self.process_start(task, "running")
+        started = self.process_start(task, "running")
+        if not started:
+            return False
+        task_id, command, run_previous = started
+        self.database.print_tasks([task], prefix="vvvv Running Task")
         tokens = command.split()
-        if tokens[0] == "echo":
-            print(f"---- {' '.join(tokens[1:])}")
-        elif tokens[0] == "sleep":
-            time.sleep(int(tokens[1]))
+        handler, arguments = get_handler(command)
+        limits = get_task_limits(task)
+        usage = None
+        retryable = True
+        log_path = task["log"]["path"]
+        log = None
+        if tokens[0] in ["echo", "sleep"]:
+            try:
+                usage = run_builtin(tokens, limits)
+            except TaskLimitExceeded as task_limit_exceeded:
+                usage = task_limit_exceeded.usage
+                task["diagnostic"] = f"Error: {task_limit_exceeded}: {command}"
+                task["state_"] = "error"
+                retryable = False
+                print(f"BOOM {task['diagnostic']}")
+        elif handler and self.handler_pool:
+            prune_task_logs(self.log_dir)
+            try:
+                usage = self.run_handler(handler, arguments, limits, log_path)
+            except TaskLimitExceeded as task_limit_exceeded:
+                usage = task_limit_exceeded.usage
+                task["diagnostic"] = f"Error: {task_limit_exceeded}: {command}"
+                task["state_"] = "error"
+                retryable = False
+                print(f"BOOM {task['diagnostic']}")
+            except Exception as error:
+                task["diagnostic"] = f"Error: {handler}: {error}"
+                task["state_"] = "error"
+                print(f"BOOM {task['diagnostic']}")
+            log = read_task_log_summary(log_path)
         else:
+            prune_task_logs(self.log_dir)
+            task_log = TaskLog(log_path)
             try:
-                result = subprocess.run(
-                    tokens, check=True, shell=False, timeout=None)
+                usage = run_subprocess(tokens, limits, task_log)
             except (FileNotFoundError, PermissionError) as error:
                 task["diagnostic"] = f"Error: {error}"
                 task["state_"] = "error"
                 print(f"BOOM {task['diagnostic']}")
+            except TaskLimitExceeded as task_limit_exceeded:
+                usage = task_limit_exceeded.usage
+                task["diagnostic"] = f"Error: {task_limit_exceeded}: {command}"
+                task["state_"] = "error"
+                retryable = False
+                print(f"BOOM {task['diagnostic']}")
             except subprocess.CalledProcessError as called_process_error:
                 error_code = called_process_error.returncode
-                task["diagnostic"] =  \
-                    f"Error code {error_code}: {' '.join(command)}"
+                task["diagnostic"] = f"Error code {error_code}: {command}"
                 task["state_"] = "error"
                 print(f"BOOM {task['diagnostic']}")
+            finally:
+                task_log.close()
+            log = task_log.summary()
 
-    # TODO: Replace individual update_task() with table.put_item() ?
-    # https://boto3.amazonaws.com/v1/documentation/api/latest/guide/dynamodb.html#creating-a-new-item
+    # The command may have already finished the task itself (see eval_task.py),
+    # in which case the task is no longer "running" and is left as it is,
+    # apart from the "usage" and "log".  Likewise, if the lease was lost, the Task
+    # belongs to another TaskManager
 
         if task["state_"] != "error":
             task["state_"] = "success"
+            fields = {}
         else:
-            self.database.update_task(
-                task_id, {"diagnostic": task["diagnostic"]})
-
-        self.database.update_task(task_id, {"state_": task["state_"]})
-
-    def crontab_error(self, task):
+            fields = {"diagnostic": task["diagnostic"]}
+        if usage:
+            fields["usage"] = usage
+        if log:
+            fields["log"] = log
+        finished_task = self.database.transition_task(
+            task_id, "running", task["state_"], fields,
+            conditions={"owner": self.owner})
+        if not finished_task:
+            finished_task = self.database.get_task(task_id)
+            if finished_task and (usage or log) and  \
+                    finished_task["state_"] in ["success", "error"]:
+                self.database.transition_task(task_id,
+                    finished_task["state_"], finished_task["state_"],
+                    {key: value for key, value in fields.items()
+                     if key in ["usage", "log"]},
+                    conditions={"owner": self.owner})
+        if finished_task and finished_task["state_"] == "error" and  \
+                retryable and self.retry_task(finished_task):
+            return True
+        if finished_task and finished_task["state_"] in ["success", "error"]:
+            self.database.release_dependents(finished_task)
+        return True
+
+    # Move a failed Task back to "pending", to be started again after a
+    # backoff (see task_retry.py).  Returns False if there are no attempts left
+
+    def retry_task(self, task):
+        delay = retry_delay(task)
+        if delay is None:
+            return False
+        attempts = int(task.get("attempts", 1)) + 1
+        max_attempts = get_retry_policy(task)["max_attempts"]
+        diagnostic = f"Retry {attempts}/{max_attempts} in {delay:.0f} "  \
+                     f"seconds, after: {task['diagnostic']}"
+        if not self.database.transition_task(task["id"], "error", "pending",
+                {"attempts": attempts, "not_before": int(time.time() + delay),
+                 "diagnostic": diagnostic},
+                conditions={"owner": self.owner}):
+            return False
+        print(f"---- Task {int(task['id']):06d}: {diagnostic}")
+        return True
+
+    def crontab_error(self, task, diagnostic):
         task_id = task["id"]
-        diagnostic = f"Error: Invalid crontab field: {task['crontab']}"
+        diagnostic = f"Error: Invalid crontab: {diagnostic}"
         print(f"Timer {int(task_id):06d}: {diagnostic}")
-        self.database.update_task(
-            task_id, {"diagnostic": task["diagnostic"]})
+        task["diagnostic"] = diagnostic
         task["state_"] = "error"
-        self.database.update_task(task_id, {"state_": task["state_"]})
+        self.timers.remove(task_id)
+        self.database.transition_task(
+            task_id, "timer", "error", {"diagnostic": diagnostic})
 
-    def process_timer(self, task):
-        task_id, command, run_previous = self.process_start(task, "timer")
-        crontabs = task["crontab"].split()
-        if len(crontabs) != 6:
-            self.crontab_error(task)
-        else:
-            time_scales = [1, 60, 3600, 86400]  # seconds
-            for time_index in range(len(time_scales)):
-                time_scale = time_scales[time_index]
-                crontab = crontabs[time_index]
-                if "/" in crontab:
-                    try:
-                        absolute_time, relative_time = crontab.split("/")
-                    except ValueError as value_error:
-                        self.crontab_error(task)
-
-                    run_previous = self.database.utc_iso_since_epoch(
-                        run_previous)
-                    run_previous_delta = time.time() - run_previous
-                    if run_previous_delta >= int(relative_time) * time_scale:
-                        new_task_id = self.database.create_task(command)
-                        task["run_at"] = self.database.datetime_now_utc_iso()
-                        self.database.update_task(
-                            task_id, {"run_at": task["run_at"]})
-                        new_task = self.database.get_task(new_task_id)
-                        self.database.print_tasks(
-                            [new_task], prefix="---- Create")
-
-    def run(self, run_loop_sleep_time=RUN_LOOP_SLEEP_TIME):
+    # Timers are read from the database every RUN_LOOP_SLEEP_TIME, picking up
+    # Timers that were changed or deleted by hand.  New Timers notify the run
+    # loop (see get_pending_tasks()), so they are scheduled straight away
+
+    def add_timer(self, task):
+        try:
+            self.timers.add(task)
+        except CrontabError as crontab_error:
+            self.crontab_error(task, crontab_error)
+
+    def sync_timers(self):
+        timers = self.database.get_tasks(filter=("state_", "timer"))
+        for timer, crontab_error in self.timers.sync(timers):
+            self.crontab_error(timer, crontab_error)
+
+    # Every TaskManager sharing the tasks table schedules every Timer, so each
+    # firing is claimed before creating its Task: the Timer "run_at" is set to
+    # the due time, only if "run_at" hasn't changed since it was read.  Only one
+    # TaskManager succeeds, the others skip the firing
+
+    def process_timer(self, task, due_time=None):
+        timer = self.database.get_task(task["id"])
+        if not timer or timer["state_"] != "timer":  # no longer a Timer
+            self.timers.remove(task["id"])
+            return
+        due_time = due_time if due_time is not None else time.time()
+        run_at = datetime.fromtimestamp(due_time, timezone.utc)  \
+            .replace(tzinfo=None).isoformat(timespec="microseconds")
+        if timer["run_at"] >= run_at:  # fired by another TaskManager
+            return
+        fields = {"run_at": run_at}
+        if timer["diagnostic"] != "":
+            fields["diagnostic"] = ""
+        if not self.database.transition_task(timer["id"], "timer", "timer",
+                fields, conditions={"run_at": timer["run_at"]}):
+            return
+        task["run_at"] = run_at
+        new_task_id = self.database.create_task(timer["command"])
+        new_task = self.database.get_task(new_task_id)
+        self.database.print_tasks([new_task], prefix="---- Create")
+
+    def start_handler_pool(self, workers):
+        self.handler_workers = workers
+        self.handler_pool = ProcessPoolExecutor(max_workers=workers,
+            mp_context=multiprocessing.get_context(HANDLER_START_METHOD))
+
+    def stop_handler_pool(self):
+        if self.handler_pool:
+            self.handler_pool.shutdown()
+            self.handler_pool = None
+
+    # A handler that kills its worker process breaks the whole pool, so the
+    # pool is replaced (once) for the following Tasks
+
+    def run_handler(self, handler, arguments, limits=None, log_path=None):
+        handler_pool = self.handler_pool
+        try:
+            return handler_pool.submit(
+                run_handler, handler, arguments, limits, log_path).result()
+        except BrokenProcessPool:
+            with self.handler_lock:
+                if self.handler_pool is handler_pool:
+                    print("BOOM Task handler process died, restarting pool")
+                    handler_pool.shutdown(wait=False)
+                    self.start_handler_pool(self.handler_workers)
+            raise
+
+    def run_task(self, task):
+        task_start_time = time.time()
+        created_at = self.database.utc_iso_since_epoch(task["created_at"])
+        queue_wait_time = task_start_time - created_at
+        if not self.process_task(task):  # index may be out of date
+            return
+        self.notify_task_changed()
+        task_run_time = time.time() - task_start_time
+        TASK_QUEUE_WAIT_SECONDS.observe(
+            queue_wait_time, command=command_type(task["command"]))
+        TASK_RUN_SECONDS.observe(task_run_time,
+            command=command_type(task["command"]), state=task["state_"])
+        print(f"^^^^ Task {int(task['id']):06d}: "
+              f"queue wait: {queue_wait_time:.1f} seconds, "
+              f"run time: {task_run_time:.1f} seconds")
+
+    def start_server(self, port=TASK_MANAGER_PORT):
+        try:
+            self.server = make_server(
+                TASK_MANAGER_HOST, port, create_app(self), threaded=True)
+        except OSError as os_error:
+            print(f"## Notify endpoint disabled, polling only: {os_error}")
+            return
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"## Notify endpoint: http://{TASK_MANAGER_HOST}:{port}/notify")
+
+    def stop_server(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+# Timers are processed every "run_loop_sleep_time" by the run loop thread,
+# whilst up to "workers" pending Tasks run concurrently in worker threads.
+# The run loop wakes up early whenever a worker finishes or a Task is created
+# (via the notify endpoint), to start pending Tasks without waiting for the
+# rest of the sleep time.
+
+    def run(self, run_loop_sleep_time=RUN_LOOP_SLEEP_TIME, workers=RUN_WORKERS,
+            port=TASK_MANAGER_PORT, handlers=True):
+        workers = workers if workers > 0 else os.cpu_count()
+        self.start_server(port)
+        if handlers:
+            self.start_handler_pool(workers)
+        running = {}        # task_id: Future
+        running_tasks = {}  # task_id: Task, for fair share
+        timer_sync_time = 0
+        lease_time = 0
+        archive_time = 0
+        print(f"## TaskManager owner: {self.owner}")
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix="task_worker") as executor:
+            while not self.stop_event.is_set():
+                loop_start_time = time.time()
+                self.wake_event.clear()
+
+                if loop_start_time >= timer_sync_time:
+                    timer_sync_time = loop_start_time + run_loop_sleep_time
+                    self.sync_timers()
+                for task, due_time in self.timers.pop_due():
+                    TIMER_LATENESS_SECONDS.observe(max(0, time.time() - due_time))
+                    self.process_timer(task, due_time)
+
+                for task_id, future in list(running.items()):
+                    if future.done():
+                        del running[task_id]
+                        del running_tasks[task_id]
+                        if future.exception():
+                            print(f"BOOM Task {int(task_id):06d}: "
+                                  f"{future.exception()}")
+
+                if loop_start_time >= lease_time:
+                    lease_time = loop_start_time + LEASE_HEARTBEAT_TIME
+                    self.renew_leases(list(running))
+                    self.requeue_expired_tasks()
+
+                if loop_start_time >= archive_time:
+                    archive_time = loop_start_time + ARCHIVE_INTERVAL
+                    archived_count = self.database.archive_tasks()
+                    if archived_count:
+                        print(f"---- Archived {archived_count} Tasks")
+
+                if len(running) < workers:
+                    tasks = self.get_pending_tasks(running_tasks.values())
+                    for task in tasks:
+                        if len(running) >= workers:
+                            break
+                        if task["id"] not in running:
+                            future = executor.submit(self.run_task, task)
+                            future.add_done_callback(
+                                lambda future: self.wake_event.set())
+                            running[task["id"]] = future
+                            running_tasks[task["id"]] = task
+
+                loop_processing_time = time.time() - loop_start_time
+                wake_time = min(timer_sync_time, lease_time)
+                if self.timers.next_time() is not None:
+                    wake_time = min(wake_time, self.timers.next_time())
+                if self.retry_time is not None:
+                    wake_time = min(wake_time, self.retry_time)
+                sleep_time = max(0, wake_time - time.time())
+                print(f"## Tasks processing: {loop_processing_time:.1f} seconds, "
+                      f"running: {len(running)}/{workers}, "
+                      f"timers: {len(self.timers)}, "
+                      f"sleeping: {sleep_time:.1f} seconds")
+                self.wake_event.wait(sleep_time)
+        self.stop_handler_pool()
+        self.stop_server()
+
+    def renew_leases(self, task_ids):
+        lease_expires = int(time.time()) + LEASE_TIME
+        for task_id in task_ids:
+            self.database.transition_task(
+                task_id, "running", "running",
+                {"lease_expires": lease_expires},
+                conditions={"owner": self.owner})
+
+    # Conditional on "lease_expires" being unchanged, so that a late heartbeat
+    # from the owner and the requeue can't both succeed.  Running Tasks without
+    # a lease are left alone, e.g started by hand via eval_task.py
+
+    def requeue_expired_tasks(self):
+        now = int(time.time())
+        for task in self.database.get_tasks(filter=("state_", "running")):
+            lease_expires = task.get("lease_expires")
+            if lease_expires is None or lease_expires > now:
+                continue
+            diagnostic = f"Lease expired, owner: {task.get('owner')}"
+            if self.database.transition_task(
+                    task["id"], "running", "pending",
+                    {"diagnostic": diagnostic},
+                    conditions={"lease_expires": lease_expires}):
+                print(f"---- Requeue Task {int(task['id']):06d}: {diagnostic}")
+                with self.notified_lock:
+                    self.notified_task_ids.add(task["id"])
+
+    # Returned in the order to start them, see task_queue.py
+
+    def get_pending_tasks(self, running_tasks=()):
+        tasks = self.database.get_tasks(filter=("state_", "pending"))
+        with self.notified_lock:
+            notified_task_ids = self.notified_task_ids
+            self.notified_task_ids = set()
+        for task_id in notified_task_ids - {task["id"] for task in tasks}:
+            task = self.database.get_task(task_id)
+            if task and task["state_"] == "pending":
+                tasks.append(task)
+            elif task and task["state_"] == "timer":
+                self.add_timer(task)
+        now = time.time()
+        not_before_times = [int(task["not_before"]) for task in tasks
+                            if int(task.get("not_before", 0)) > now]
+        self.retry_time = min(not_before_times, default=None)
+        tasks = [task for task in tasks if int(task.get("not_before", 0)) <= now]
+        tasks = self.coalesce_pending_tasks(tasks)
+        return order_pending_tasks(tasks, running_tasks)
+
+    # Merge redundant pending Tasks (see task_queue.py).  The merged Task's
+    # command is updated first, then the other Tasks are superseded.  Every
+    # update is conditional on the Task still being pending with the command
+    # that was read, so a Task that another TaskManager has started or
+    # coalesced in the meantime is left as it is.  Then a time range may be
+    # run twice, but a superseded Task's range is always in a pending Task.
+    # A Task that gained "dependents" whilst being superseded releases them,
+    # so that they depend upon the merged Task.  Returns the pending Tasks
+    # that are left
+
+    def coalesce_pending_tasks(self, tasks):
+        superseded_ids = set()
+        for task, command, superseded_tasks in coalesce_tasks(tasks):
+            merged_task = self.database.transition_task(
+                task["id"], "pending", "pending", {"command": command},
+                conditions={"command": task["command"]})
+            if not merged_task:  # already started or coalesced
+                continue
+            task["command"] = command
+            for superseded_task in superseded_tasks:
+                superseded_task = self.database.transition_task(
+                    superseded_task["id"], "pending", "superseded",
+                    {"diagnostic": f"Superseded by Task {task['id']}",
+                     "superseded_by": task["id"]},
+                    conditions={"command": superseded_task["command"]})
+                if superseded_task:
+                    superseded_ids.add(superseded_task["id"])
+                    self.database.release_dependents(superseded_task)
+            print(f"---- Coalesced {len(superseded_tasks) + 1} Tasks into "
+                  f"Task {int(task['id']):06d}: {command}")
+        return [task for task in tasks if task["id"] not in superseded_ids]
+
+    # Queue depth is read when the metrics are requested, rather than tracked.
+    # Only the active states are counted, because the finished Tasks grow
+    # without bound until they're archived ... and would be read every scrape
+
+    def collect_metrics(self):
+        for state_ in ACTIVE_STATES:
+            tasks = self.database.get_tasks(
+                filter=("state_", state_), field_names=["id"])
+            TASKS.set(len(tasks), state=state_)
+
+    # Wake up the HTTP API requests waiting for a Task to change state
+
+    def notify_task_changed(self):
+        with self.task_changed:
+            self.task_change_count += 1
+            self.task_changed.notify_all()
+
+    # Returns the Task as soon as it isn't in "state" (by default, its state
+    # when called), or after "timeout" seconds.  Returns None if there's no
+    # such Task.  The Task is read again when this TaskManager changes a Task's
+    # state, or every TASK_WAIT_POLL_TIME in case someone else did
+
+    def wait_for_task(self, task_id, state=None, timeout=TASK_WAIT_TIME):
+        deadline = time.time() + timeout
         while True:
-            loop_start_time = time.time()
-
-            for task_state in ["timer", "pending"]:
-                filter = ("state_", task_state)
-                tasks = self.database.get_tasks(filter=filter)
-            #   print(f"## Fetched {task_state} Tasks: count={len(tasks)}")
-
-                for task in tasks:
-                    if task_state == "timer":
-                        self.process_timer(task)
-                    if task_state == "pending":
-                        task_start_time = time.time()
-                        prefix = "vvvv Running Task"
-                        self.database.print_tasks([task], prefix=prefix)
-                        self.process_task(task)
-                        task_process_time = time.time() - task_start_time
-                        prefix = "^^^^ Task processing: "
-                        print(f"{prefix}{task_process_time:.1f} seconds")
-
-            loop_processing_time = time.time() - loop_start_time
-            sleep_time = max(0, run_loop_sleep_time - loop_processing_time)
-            print(f"## Tasks processing: {loop_processing_time:.1f} seconds, "
-                  f"sleeping: {sleep_time:.1f} seconds")
-            time.sleep(run_loop_sleep_time)
+            change_count = self.task_change_count
+            task = self.database.get_task(task_id)
+            if not task:
+                return None
+            state = state or task["state_"]
+            wait_time = min(TASK_WAIT_POLL_TIME, deadline - time.time())
+            if task["state_"] != state or wait_time <= 0:
+                return task
+            with self.task_changed:
+                self.task_changed.wait_for(
+                    lambda: self.task_change_count != change_count, wait_time)
+
+    def stop(self):  # run() returns once the running Tasks have finished
+        self.stop_event.set()
+        self.wake_event.set()
+
+# --------------------------------------------------------------------------- #
+
+def create_app(task_manager):
+    app = Flask(__name__)
+
+    @app.post("/notify")
+    def notify():
+        task_id = request.args.get("task_id")
+        if task_id:
+            with task_manager.notified_lock:
+                task_manager.notified_task_ids.add(str(task_id))
+        task_manager.wake_event.set()
+        task_manager.notify_task_changed()
+        return "", 204
+
+    # HTTP Task API ... JSON in and out, errors are {"error": diagnostic}
+    #
+    # POST /tasks              {"command": "...", "after": ["42"], "timeout",
+    #                           "priority", "idempotency_key"}
+    # GET  /tasks              ?state=pending&field=command&value=...
+    #                          &fields=id,state_&limit=50&cursor=...&archived=1
+    #                          --> {"tasks": [...], "cursor": next page or null}
+    # GET  /tasks/<id>         ?fields=id,state_&archived=1
+    # GET  /tasks/<id>/wait    ?state=running&timeout=30 (long-poll)
+
+    database = task_manager.database
+
+    def json_response(body, status=200):
+        return app.response_class(json.dumps(body, default=json_default),
+            status=status, mimetype="application/json")
+
+    def error_response(diagnostic, status=400):
+        return json_response({"error": diagnostic}, status)
+
+    def field_names_arg():
+        if not request.args.get("fields"):
+            return None
+        field_names = ["state_" if field_name == "state" else field_name
+                       for field_name in request.args["fields"].split(",")]
+        for field_name in field_names:
+            if field_name not in ["id"] and  \
+                    not database.valid_task_field_name(field_name):
+                raise ValueError(f"Invalid field name: {field_name}")
+        return ["id"] + [name for name in field_names if name != "id"]
+
+    def int_arg(name, default, maximum):
+        value = request.args.get(name, default, type=int)
+        if value is None or not 0 < value <= maximum:
+            raise ValueError(f"{name} must be from 1 to {maximum}")
+        return value
+
+    @app.errorhandler(ValueError)
+    def value_error(error):
+        return error_response(f"Error: {error}")
+
+    @app.post("/tasks")
+    def create_task():
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict) or not body.get("command"):
+            return error_response('Error: JSON body must include "command"')
+        task_id = database.create_task(body["command"],
+            depends_on=body.get("after"), timeout=body.get("timeout"),
+            priority=body.get("priority"),
+            idempotency_key=body.get("idempotency_key"))
+        return json_response(database.get_task(task_id), 201)
+
+    @app.get("/tasks")
+    def list_tasks():
+        filter = None
+        if request.args.get("state"):
+            if request.args["state"] not in TASK_STATES:
+                raise ValueError(f"Invalid state: {request.args['state']}")
+            filter = ("state_", request.args["state"])
+        elif request.args.get("field"):
+            if not database.valid_task_field_name(request.args["field"]):
+                raise ValueError(f"Invalid field name: {request.args['field']}")
+            filter = (request.args["field"], request.args.get("value", ""))
+        tasks, cursor = database.get_tasks_page(filter=filter,
+            field_names=field_names_arg(),
+            limit=int_arg("limit", API_PAGE_SIZE, API_MAX_PAGE_SIZE),
+            cursor=request.args.get("cursor"),
+            archived=bool(request.args.get("archived")))
+        return json_response({"tasks": tasks, "cursor": cursor})
+
+    @app.get("/tasks/<task_id>")
+    def get_task(task_id):
+        task = database.get_task(task_id, field_names=field_names_arg(),
+            archived=bool(request.args.get("archived")))
+        if not task:
+            return error_response(f"Error: Task id {task_id} not found", 404)
+        return json_response(task)
+
+    @app.get("/tasks/<task_id>/wait")
+    def wait_for_task(task_id):
+        state = request.args.get("state")
+        if state and state not in TASK_STATES:
+            raise ValueError(f"Invalid state: {state}")
+        task = task_manager.wait_for_task(task_id, state,
+            int_arg("timeout", TASK_WAIT_TIME, TASK_WAIT_MAX_TIME))
+        if not task:
+            return error_response(f"Error: Task id {task_id} not found", 404)
+        return json_response(task)
+
+    @app.get("/metrics")
+    def metrics():
+        task_manager.collect_metrics()
+        return METRICS.render(), 200, {"Content-Type": METRICS_CONTENT_TYPE}
+
+    return app
 
 # --------------------------------------------------------------------------- #
 
@@ -536,7 +1623,7 @@ def check_database(database):
     task_id = database.create_task("echo 0")  # create: 1
     task_id = database.create_task("echo 2")  # create: 2
     task_id = database.create_task("echo 3")  # create: 3
-    database.delete_task(task_id)             # delete: 3, FIX: (task_id - 1)
+    database.delete_task(task_id)             # delete: 3
 
     print(f"DB Task 1")
     task = database.get_task("1")
@@ -549,6 +1636,78 @@ def check_database(database):
     database.update_task("1", {"command": "echo 1"})
     database.print_tasks([database.get_task("1")])
 
+# Tasks run by the TaskManager must use create_database(), so that they use the
+# same storage backend as the TaskManager
+
+# Databases are cached, so that Task handlers running in a warm worker process
+# (see task_handlers.py) don't set-up the Database again for every Task
+
+DATABASES = {}  # (aws_access_key_id, DB_SQLITE_PATH): Database
+DATABASES_LOCK = threading.Lock()
+
+def create_database(aws_access_key_id=None, aws_secret_access_key=None):
+    with DATABASES_LOCK:
+        key = (aws_access_key_id, DB_SQLITE_PATH)
+        if key not in DATABASES:
+            if DB_SQLITE_PATH:
+                from sqlite_database import SQLiteDatabase  # imports this module
+                DATABASES[key] = SQLiteDatabase(DB_SQLITE_PATH)
+            else:
+                DATABASES[key] = Database(
+                    aws_access_key_id, aws_secret_access_key)
+        return DATABASES[key]
+
+# Page cursors are the (JSON) key of the last item read, opaque to the client
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, UnicodeError):
+        key = None
+    if not isinstance(key, dict):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return key
+
+# DynamoDB numbers are Decimals, which are written as JSON numbers
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == int(value) else float(value)
+    raise TypeError(f"Type not serializable: {type(value)}")
+
+# Export and import Tasks as JSON lines, keeping their ids.  DynamoDB numbers
+# are read back as Decimals.  Returns the number of Tasks
+
+def export_tasks(database, file, archived=False, segments=EXPORT_SEGMENTS):
+    task_count = 0
+    for task in database.scan_tasks(archived=archived, segments=segments):
+        file.write(json.dumps(task, default=json_default) + "\n")
+        task_count += 1
+    return task_count
+
+def import_tasks(database, file, archived=False):
+    task_count = 0
+    last_id = 0
+    tasks = []
+    for line in file:
+        if line.strip():
+            task = json.loads(line, parse_float=Decimal)
+            tasks.append({**task, "task": "task", "id": str(task["id"])})
+            last_id = max(last_id, int(task["id"]))
+        if len(tasks) == IMPORT_BATCH_SIZE:
+            database.put_tasks(tasks, archived=archived)
+            task_count += len(tasks)
+            tasks = []
+    database.put_tasks(tasks, archived=archived)
+    task_count += len(tasks)
+    database.advance_counter(database.tasks_table, "task", last_id)
+    if not archived:
+        database.notify_task_manager()
+    return task_count
+
 def load_configuration(configuration_file):
     try:
         with open(configuration_file) as file:
@@ -572,11 +1731,22 @@ def validate_field_name(database, field_name):
 @click.pass_context
 def main(context):
     """Task Manager server"""
-    aws_access_key_id, aws_secret_access_key = load_configuration(
-        CONFIGURATION_PATHNAME)
-    database = Database(aws_access_key_id, aws_secret_access_key)
+    aws_access_key_id = aws_secret_access_key = None
+    if not DB_SQLITE_PATH:
+        aws_access_key_id, aws_secret_access_key = load_configuration(
+            CONFIGURATION_PATHNAME)
+    database = create_database(aws_access_key_id, aws_secret_access_key)
     context.obj = TaskManager(database)
 
+@main.command(name="archive",
+    help="Move finished Tasks older than --days to the archive table")
+@click.pass_obj
+@click.option("--days", "-d", nargs=1, default=ARCHIVE_AGE / 86400,
+    help="Archive Tasks created more than this many days ago")
+def archive_tasks(task_manager, days):
+    archived_count = task_manager.database.archive_tasks(age=days * 86400)
+    print(f"Archived {archived_count} Tasks")
+
 @main.command(help="Check (test) database")
 @click.pass_obj
 def check(task_manager):
@@ -585,9 +1755,19 @@ def check(task_manager):
 @main.command(name="create", help="Create task")
 @click.pass_obj
 @click.argument("command", nargs=1, required=True, default=None)
-def create_task(task_manager, command):
+@click.option("--after", "-a", multiple=True,
+    help="Run after this Task id has succeeded, may be repeated")
+@click.option("--timeout", "-t", type=int, default=None,
+    help="Seconds until the Task is stopped, overriding TASK_LIMITS")
+@click.option("--priority", "-p", type=int, default=None,
+    help="Higher priority Tasks run first, overriding TASK_PRIORITIES")
+@click.option("--idempotency-key", "-k", default=None,
+    help="Don't create another Task if one was created with this key")
+def create_task(task_manager, command, after, timeout, priority,
+                idempotency_key):
     database = task_manager.database
-    task_id = database.create_task(command)
+    task_id = database.create_task(command, depends_on=after, timeout=timeout,
+        priority=priority, idempotency_key=idempotency_key)
     task = database.get_task(task_id)
     database.print_tasks([task])
 
@@ -612,8 +1792,17 @@ def create_timer(task_manager, command, crontab):
     0   0   0   *   *   *     "n" matches exact value, e.g just at midnight
     0   *   0/4 *   *   *     "Absolute time/Relative time", e.g every 4 hours
     *   0/1 *   *   *   *     "Absolute time/Relative time", e.g every minute
+    0   30  9   *   *   1,5   "n,m" matches either, e.g Monday and Friday 9:30
+
+    \b
+    A "*" second, minute or hour below the first specified field matches 0.
+    Times are UTC.
     """
     database = task_manager.database
+    try:
+        parse_crontab(crontab)
+    except CrontabError as crontab_error:
+        raise SystemExit(f"Error: Invalid crontab: {crontab_error}")
     timer_id = database.create_timer(command, crontab)
     timer = database.get_task(timer_id)
     database.print_tasks([timer])
@@ -634,19 +1823,41 @@ def destroy(task_manager):
         task_manager.database.destroy_tables()
         print("Database table(s) deleted")
 
+@main.command(name="export", help="Write all Tasks to FILE as JSON lines")
+@click.pass_obj
+@click.argument("file", type=click.File("w"), default="-")
+@click.option("--archived", is_flag=True, help="Export archived Tasks")
+@click.option("--segments", nargs=1, default=EXPORT_SEGMENTS,
+    help="Number of parallel scans")
+def export_command(task_manager, file, archived, segments):
+    task_count = export_tasks(
+        task_manager.database, file, archived=archived, segments=segments)
+    print(f"Exported {task_count} Tasks", file=sys.stderr)
+
+@main.command(name="import",
+    help="Read Tasks from FILE as JSON lines, replacing Tasks with the same id")
+@click.pass_obj
+@click.argument("file", type=click.File("r"), default="-")
+@click.option("--archived", is_flag=True, help="Import into the archive")
+def import_command(task_manager, file, archived):
+    task_count = import_tasks(task_manager.database, file, archived=archived)
+    print(f"Imported {task_count} Tasks")
+
 @main.command(name="list",
     help="List tasks optionally searching by field, e.g command, id, state")
 @click.pass_obj
 @click.option("--all", "-a", is_flag=True, help="Show all Task fields")
+@click.option("--archived", is_flag=True,
+    help="List archived Tasks, page by page in no particular order")
 @click.option("--field", "-f", nargs=2, help="List Tasks with this field value")
-def list_tasks(task_manager, all, field):
+def list_tasks(task_manager, all, archived, field):
     database = task_manager.database
     filter = None
     tasks = None
     if field:
         field_name, field_value = field
         if field_name == "id":
-            task = database.get_task(field_value)
+            task = database.get_task(field_value, archived=archived)
             if not task:
                 raise SystemExit(f"Error: Task id {field_value} not found")
             tasks = [task]
@@ -656,15 +1867,57 @@ def list_tasks(task_manager, all, field):
             validate_field_name(database, field_name)
             filter = (field_name, field_value)
     if not tasks:
-        tasks = database.get_tasks(filter=filter, sort_field="id")
+        field_names = None if all else DB_TASK_LIST_FIELD_NAMES
+        tasks = database.get_tasks(
+            filter=filter, sort_field=None if archived else "id",
+            field_names=field_names, archived=archived,
+            page_size=ARCHIVE_BATCH_SIZE if archived else None)
     database.print_tasks(tasks, "all" if all else None)
 
+@main.command(name="logs", help="Show the output of a Task")
+@click.pass_obj
+@click.argument("task_id", nargs=1, required=True, default=None)
+@click.option("--follow", "-f", is_flag=True,
+    help="Keep showing the output until the Task has finished")
+@click.option("--archived", is_flag=True, help="Show an archived Task")
+def logs(task_manager, task_id, follow, archived):
+    database = task_manager.database
+    task = database.get_task(task_id, archived=archived)
+    if not task:
+        raise SystemExit(f"Error: Task id {task_id} not found")
+    if not task.get("log"):
+        raise SystemExit(f"Error: Task id {task_id} hasn't run yet")
+    path = task["log"]["path"]
+
+    def finished():
+        task = database.get_task(task_id)
+        return not task or task["state_"] != "running" or  \
+            task["log"]["path"] != path  # retried
+
+    if follow and task["state_"] == "running":
+        read_task_log(path, follow=True, finished=finished)
+    elif os.path.exists(path):
+        read_task_log(path)
+    elif task["log"].get("tail"):  # e.g pruned, or on another TaskManager host
+        print(f"Log file {path} not found, last lines were ...", file=sys.stderr)
+        for line in task["log"]["tail"]:
+            print(line)
+    else:
+        raise SystemExit(f"Error: Log file {path} not found")
+
 @main.command(help="Run task_manager server")
 @click.pass_obj
 @click.option("--sleep", "-s", nargs=1, default=RUN_LOOP_SLEEP_TIME,
     help="Run loop sleep time")
-def run(task_manager, sleep):
-    task_manager.run(run_loop_sleep_time=sleep)
+@click.option("--workers", "-w", nargs=1, default=RUN_WORKERS,
+    help="Maximum concurrent Tasks, 0 for one per CPU core")
+@click.option("--port", "-p", nargs=1, default=TASK_MANAGER_PORT,
+    help="Notify endpoint port, which wakes up the run loop")
+@click.option("--handlers/--no-handlers", default=True,
+    help="Run Task handlers in warm worker processes, or as subprocesses")
+def run(task_manager, sleep, workers, port, handlers):
+    task_manager.run(run_loop_sleep_time=sleep, workers=workers, port=port,
+                     handlers=handlers)
 
 @main.command(name="update", help="Update task field, e.g command, state")
 @click.pass_obj
@@ -677,6 +1930,8 @@ def update_task(task_manager, task_id, field_name, field_value):
         field_name = "state_"
     validate_field_name(database, field_name)
     database.update_task(task_id, {field_name: field_value})
+    if field_name == "state_" and field_value == "pending":
+        database.notify_task_manager(task_id)
     task = database.get_task(task_id)
     database.print_tasks([task])
 
@@ -1,7 +1,6 @@
 from task_manager import *
 
 def tm_raise_error(tm: TaskManager, task_id, error_message):
-    tm.database.update_task(str(task_id), {
-        'state_': 'error',
+    tm.database.transition_task(str(task_id), ['pending', 'running'], 'error', {
         'diagnostic': error_message
     })
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+#
+# TaskManager performance measurement
+# ===================================
+# Metrics are kept in memory by the TaskManager process and served by its
+# HTTP endpoint in the Prometheus text format, e.g
+#
+#     curl http://localhost:8001/metrics
+#
+# - task_manager_db_operation_seconds: Database call latency, per operation
+# - task_manager_tasks: Tasks in each state, i.e queue depth
+# - task_manager_task_queue_wait_seconds: run_at minus created_at
+# - task_manager_task_run_seconds: run time, per command type and final state
+# - task_manager_timer_lateness_seconds: Timer start time minus due time
+#
+# Resources
+# ~~~~~~~~~
+# - https://prometheus.io/docs/instrumenting/exposition_formats
+
+import bisect
+import functools
+import os
+import threading
+import time
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DB_LATENCY_BUCKETS = [  # seconds
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+]
+TASK_TIME_BUCKETS = [  # seconds
+    0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600
+]
+
+# Label values are tuples of (name, value) pairs, sorted by name
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = [
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"')
+                         .replace("\n", "\\n"))
+        for name, value in labels]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+def format_value(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+# --------------------------------------------------------------------------- #
+
+class Gauge():
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.series = {}  # labels: value
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.series[tuple(sorted(labels.items()))] = value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self.lock:
+            for labels, value in sorted(self.series.items()):
+                lines.append(
+                    f"{self.name}{format_labels(labels)} {format_value(value)}")
+        return lines
+
+# Bucket counts are kept per bucket and made cumulative ("le") when rendered
+
+class Histogram():
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = sorted(buckets)
+        self.lock = threading.Lock()
+        self.series = {}  # labels: [bucket_counts, sum, count]
+
+    def observe(self, value, **labels):
+        bucket_index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.setdefault(
+                tuple(sorted(labels.items())),
+                [[0] * len(self.buckets), 0.0, 0])
+            if bucket_index < len(self.buckets):
+                series[0][bucket_index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (bucket_counts, total, count) in  \
+                    sorted(self.series.items()):
+                cumulative_count = 0
+                for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative_count += bucket_count
+                    bucket_labels = labels + (("le", format_value(bucket)),)
+                    lines.append(f"{self.name}_bucket"
+                        f"{format_labels(bucket_labels)} {cumulative_count}")
+                bucket_labels = labels + (("le", "+Inf"),)
+                lines.append(
+                    f"{self.name}_bucket{format_labels(bucket_labels)} {count}")
+                lines.append(
+                    f"{self.name}_sum{format_labels(labels)} {format_value(total)}")
+                lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+class Metrics():
+    def __init__(self):
+        self.metrics = []
+
+    def gauge(self, name, help):
+        return self.add(Gauge(name, help))
+
+    def histogram(self, name, help, buckets):
+        return self.add(Histogram(name, help, buckets))
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# --------------------------------------------------------------------------- #
+
+METRICS = Metrics()
+
+DB_OPERATION_SECONDS = METRICS.histogram(
+    "task_manager_db_operation_seconds",
+    "Database call latency in seconds", DB_LATENCY_BUCKETS)
+TASKS = METRICS.gauge(
+    "task_manager_tasks", "Number of Tasks in each active state")
+TASK_QUEUE_WAIT_SECONDS = METRICS.histogram(
+    "task_manager_task_queue_wait_seconds",
+    "Time from Task creation until it started running", TASK_TIME_BUCKETS)
+TASK_RUN_SECONDS = METRICS.histogram(
+    "task_manager_task_run_seconds",
+    "Task run time in seconds", TASK_TIME_BUCKETS)
+TIMER_LATENESS_SECONDS = METRICS.histogram(
+    "task_manager_timer_lateness_seconds",
+    "Time from when a Timer was due until it ran", DB_LATENCY_BUCKETS)
+
+# Decorator for Database methods, measures the latency of each call
+
+def timed(function):
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            DB_OPERATION_SECONDS.observe(
+                time.perf_counter() - start_time,
+                backend=type(self).__name__, operation=function.__name__)
+    return wrapper
+
+# Command type, i.e the script or program, without the parameters
+#     "python submission_backend/eval_task.py --team_id 1" --> "eval_task.py"
+
+def command_type(command):
+    tokens = command.split()
+    if not tokens:
+        return ""
+    program = os.path.basename(tokens[0])
+    if program.startswith("python") and len(tokens) > 1:
+        return os.path.basename(tokens[1])
+    return program
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+#
+# Pending Task queue for the TaskManager
+# ======================================
+# Ordering
+# ~~~~~~~~
+# When there are more pending Tasks than free workers, the TaskManager starts
+# them in the order given by order_pending_tasks() ...
+#
+# 1. Highest priority first.  A Task "priority" field, e.g
+#    "./task_manager.py create --priority 10", or else TASK_PRIORITIES for its
+#    command type, so that getting live data and updating the leaderboard isn't
+#    stuck behind a backlog of evaluations.
+#
+# 2. Aging: a Task's priority goes up by one for every PRIORITY_AGING_TIME it
+#    has been waiting, so that low priority Tasks are never starved.
+#
+# 3. Fair share: Tasks of equal priority are interleaved across Teams, in
+#    proportion to TEAM_WEIGHTS (default 1), counting the Tasks each Team
+#    already has running.  A Team pushing many commits only delays its own
+#    Tasks.  The Team is the Task "team" field, or its "--team_id" parameter.
+#    Tasks without a Team each count as a Team of their own.
+#
+# 4. Oldest (lowest id) first.
+#
+# Coalescing
+# ~~~~~~~~~~
+# When the TaskManager falls behind, several pending Tasks can do the same
+# work over adjacent time ranges, e.g an eval_task.py per batch for the same
+# Team and commit.  Pending Tasks with the same coalesce_key(), whose time
+# ranges overlap or are adjacent, are merged into the oldest one, whose time
+# range becomes the union of their time ranges.  Time ranges separated by a gap
+# aren't merged, so that no Task covers a time range nobody asked for.
+# The others are "superseded", with a diagnostic naming the merged Task.
+# Tasks that other Tasks depend on, or that depend on other Tasks, are never
+# coalesced.
+
+from collections import Counter, deque
+from datetime import datetime
+import heapq
+import time
+
+from task_metrics import command_type
+from task_scheduler import datetime_to_epoch
+
+TASK_PRIORITY_DEFAULT = 0
+
+TASK_PRIORITIES = {  # command type: priority, higher runs first
+    "crawler.py": 20,              # live data
+    "mock_task_get_data.py": 20,
+    "repo_poll_task.py": 10,
+    "kickoff_task.py": 5,
+    "eval_task.py": 0              # batches, also updates the leaderboard
+}
+
+PRIORITY_AGING_TIME = 600  # seconds waiting per extra priority level
+
+TEAM_WEIGHTS = {}  # team: weight, i.e share of the workers, default 1
+
+COALESCE_COMMANDS = {  # command type: (key parameters, start, end parameters)
+    "eval_task.py": (["--team_id", "--commit_hash"],
+                     "--unix_start", "--batch_unix_end")
+}
+
+def task_priority(task):
+    if task.get("priority") is not None:
+        return int(task["priority"])
+    return TASK_PRIORITIES.get(command_type(task["command"]),
+                               TASK_PRIORITY_DEFAULT)
+
+def aged_priority(task, now):
+    created_at = datetime_to_epoch(datetime.fromisoformat(task["created_at"]))
+    waiting_time = max(0, now - created_at)
+    return task_priority(task) + int(waiting_time // PRIORITY_AGING_TIME)
+
+def task_team(task):
+    if task.get("team") is not None:
+        return str(task["team"])
+    return command_parameter(task["command"], "--team_id")
+
+def command_parameter(command, name):
+    tokens = command.split()
+    for index, token in enumerate(tokens[:-1]):
+        if token == name:
+            return tokens[index + 1]
+    return None
+
+# Returns the pending Tasks in the order to start them, given the Tasks that
+# are already running
+
+def order_pending_tasks(tasks, running_tasks=(), now=None):
+    now = now if now is not None else time.time()
+    team_running = Counter(task_team(task) for task in running_tasks)
+    priority_tasks = {}  # aged priority: [task, ...]
+    for task in tasks:
+        priority_tasks.setdefault(aged_priority(task, now), []).append(task)
+
+    ordered_tasks = []
+    for priority in sorted(priority_tasks, reverse=True):
+        team_queues = {}  # team: deque of Tasks, oldest first
+        for task in sorted(priority_tasks[priority],
+                           key=lambda task: int(task["id"])):
+            team = task_team(task) or ("task", task["id"])
+            team_queues.setdefault(team, deque()).append(task)
+
+    # Heap of (team share, oldest Task id, team), where the share counts the
+    # Team's next Task, so that the Team that would be furthest below its
+    # weight goes next (like weighted fair queueing)
+
+        heap = []
+        for team, team_queue in team_queues.items():
+            heapq.heappush(heap, (team_share(team, team_running),
+                                  int(team_queue[0]["id"]), team))
+        while heap:
+            _, _, team = heapq.heappop(heap)
+            ordered_tasks.append(team_queues[team].popleft())
+            team_running[team] += 1
+            if team_queues[team]:
+                heapq.heappush(heap, (team_share(team, team_running),
+                                      int(team_queues[team][0]["id"]), team))
+    return ordered_tasks
+
+def team_share(team, team_running):
+    return (team_running[team] + 1) / TEAM_WEIGHTS.get(team, 1)
+
+# --------------------------------------------------------------------------- #
+# Returns (command type, key parameter values), or None if the Task can't be
+# coalesced
+
+def coalesce_key(task):
+    coalesce_command = COALESCE_COMMANDS.get(command_type(task["command"]))
+    if not coalesce_command or task.get("dependents") or task.get("depends_on"):
+        return None
+    key_names, start_name, end_name = coalesce_command
+    values = [command_parameter(task["command"], name)
+              for name in key_names + [start_name, end_name]]
+    if None in values:
+        return None
+    return (command_type(task["command"]), *values[:len(key_names)])
+
+# Returns a list of (merged Task, new command, superseded Tasks)
+
+def coalesce_tasks(tasks):
+    key_tasks = {}  # coalesce key: [task, ...]
+    for task in tasks:
+        key = coalesce_key(task)
+        if key:
+            key_tasks.setdefault(key, []).append(task)
+
+    coalesced = []
+    for key, tasks_ in key_tasks.items():
+        _, start_name, end_name = COALESCE_COMMANDS[key[0]]
+        for start, end, group in contiguous_ranges(tasks_, start_name, end_name):
+            if len(group) < 2:
+                continue
+            group = sorted(group, key=lambda task: int(task["id"]))
+            command = replace_command_parameters(
+                group[0]["command"], {start_name: start, end_name: end})
+            coalesced.append((group[0], command, group[1:]))
+    return coalesced
+
+# Returns a list of (start, end, Tasks) for each group of Tasks whose time
+# ranges overlap or are adjacent, i.e the end of one is the start of another
+
+def contiguous_ranges(tasks, start_name, end_name):
+    ranges = sorted(((int(command_parameter(task["command"], start_name)),
+                      int(command_parameter(task["command"], end_name)), task)
+                     for task in tasks), key=lambda range_: range_[:2])
+    groups = []
+    for start, end, task in ranges:
+        if groups and start <= groups[-1][1]:
+            groups[-1][1] = max(groups[-1][1], end)
+            groups[-1][2].append(task)
+        else:
+            groups.append([start, end, [task]])
+    return [tuple(group) for group in groups]
+
+def replace_command_parameters(command, parameters):
+    tokens = command.split()
+    for index, token in enumerate(tokens[:-1]):
+        if token in parameters:
+            tokens[index + 1] = str(parameters[token])
+    return " ".join(tokens)
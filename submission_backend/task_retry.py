@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+#
+# Task retry policies
+# ===================
+# A Task that fails, e.g because of a Docker daemon hiccup, a GitHub 5xx or
+# DynamoDB throttling, is retried according to the policy for its command type
+# (see command_type()), rather than staying in "error" until an operator
+# re-creates it by hand
+#
+# - max_attempts: including the first attempt, 1 means never retry
+# - backoff:      seconds before the first retry, doubling for each retry ...
+# - max_backoff:  ... up to this many seconds
+#
+# The failed Task goes back to "pending", with "attempts" incremented and a
+# "not_before" time (epoch seconds), before which the TaskManager won't start
+# it.  Half of each backoff is random (jitter), so that Tasks that failed
+# together don't all retry together.  Tasks stopped for exceeding their limits
+# (see task_limits.py) aren't retried.
+#
+# Retried Tasks must be idempotent, e.g eval_task.py records the Task id as an
+# idempotency key on the leaderboard submission, so that a retry doesn't
+# append the same trial twice (see LeaderboardDBClient.update_submission()).
+
+import random
+
+from task_metrics import command_type
+
+RETRY_POLICY_DEFAULT = {"max_attempts": 1, "backoff": 30, "max_backoff": 600}
+
+RETRY_POLICIES = {  # command type: policy, merged with RETRY_POLICY_DEFAULT
+    "eval_task.py": {"max_attempts": 3, "backoff": 60},
+    "kickoff_task.py": {"max_attempts": 3, "backoff": 60},
+    "repo_poll_task.py": {"max_attempts": 5, "backoff": 10, "max_backoff": 300}
+}
+
+def get_retry_policy(task):
+    policy = dict(RETRY_POLICY_DEFAULT)
+    policy.update(RETRY_POLICIES.get(command_type(task["command"]), {}))
+    return policy
+
+# Seconds until the next attempt, or None if there are no attempts left
+
+def retry_delay(task):
+    policy = get_retry_policy(task)
+    attempts = int(task.get("attempts", 1))
+    if attempts >= policy["max_attempts"]:
+        return None
+    backoff = min(policy["max_backoff"], policy["backoff"] * 2 ** (attempts - 1))
+    return backoff / 2 + random.uniform(0, backoff / 2)
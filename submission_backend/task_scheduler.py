@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+#
+# Timer scheduling for the TaskManager
+# ====================================
+# Each Timer has a CRONTAB of six fields (see "./task_manager.py timer --help")
+#
+#     second minute hour day_of_month month day_of_week
+#
+# ... each field being "*" (any value), "n" (exact value), "a/b" (every b,
+# starting at a), "*/b" (every b) or a comma separated list of those.
+#
+# A "*" second, minute or hour finer than the coarsest specified field matches
+# just its first value, so that "0 * 0/4 * * *" means every 4 hours (on the
+# hour), rather than every minute of every fourth hour, and "* * * 1 * *"
+# means midnight on the first of each month.  When both day of month and
+# day of week are specified, either may match (like Unix crontab).
+# Times are UTC, like the Task "created_at" and "run_at" fields.
+#
+# The TimerScheduler keeps the next fire time of every Timer in a min-heap,
+# so that the TaskManager run loop can sleep exactly until the next due Timer.
+
+import bisect
+import calendar
+from datetime import datetime, timedelta, timezone
+import heapq
+import time
+
+CRONTAB_FIELDS = [  # name, minimum value, maximum value
+    ("second", 0, 59), ("minute", 0, 59), ("hour", 0, 23),
+    ("day of month", 1, 31), ("month", 1, 12), ("day of week", 1, 7)
+]
+
+CRONTAB_SEARCH_DAYS = 8 * 366  # long enough to find "29 February" on a Monday
+
+class CrontabError(ValueError):
+    pass
+
+# --------------------------------------------------------------------------- #
+# Parse a CRONTAB into a list of six sorted lists of the matching values,
+# plus whether day of month and day of week were each specified (not "*")
+
+def parse_crontab(crontab):
+    fields = crontab.split()
+    if len(fields) != len(CRONTAB_FIELDS):
+        raise CrontabError(f"Expected {len(CRONTAB_FIELDS)} fields: {crontab}")
+
+    coarsest = max([index for index, field in enumerate(fields)
+                    if field != "*"], default=-1)
+    values = []
+    for index, (field, (name, minimum, maximum)) in  \
+            enumerate(zip(fields, CRONTAB_FIELDS)):
+        if field == "*" and index < min(coarsest, 3):
+            values.append([minimum])
+        else:
+            values.append(parse_crontab_field(field, name, minimum, maximum))
+    return values, fields[3] != "*", fields[5] != "*"
+
+def parse_crontab_field(field, name, minimum, maximum):
+    values = set()
+    for term in field.split(","):
+        try:
+            if term == "*":
+                values.update(range(minimum, maximum + 1))
+            elif "/" in term:
+                start, step = term.split("/")
+                start = minimum if start == "*" else int(start)
+                if int(step) < 1 or not minimum <= start <= maximum:
+                    raise ValueError
+                values.update(range(start, maximum + 1, int(step)))
+            else:
+                if not minimum <= int(term) <= maximum:
+                    raise ValueError
+                values.add(int(term))
+        except ValueError:
+            raise CrontabError(f"Invalid {name} field: {field}") from None
+    return sorted(values)
+
+# --------------------------------------------------------------------------- #
+# Next time (naive UTC datetime) strictly after "after" matching a parsed
+# CRONTAB.  Each field that doesn't match skips straight to the next value
+# that does, rather than stepping one second at a time
+
+def next_fire_time(schedule, after):
+    (seconds, minutes, hours, days, months, weekdays), by_day, by_weekday =  \
+        schedule
+    time_ = after.replace(microsecond=0) + timedelta(seconds=1)
+    end = time_ + timedelta(days=CRONTAB_SEARCH_DAYS)
+
+    def next_value(values, value):
+        index = bisect.bisect_left(values, value)
+        return values[index] if index < len(values) else None
+
+    while time_ < end:
+        if time_.month not in months:
+            month = next_value(months, time_.month)
+            if month is None:
+                time_ = datetime(time_.year + 1, months[0], 1)
+            else:
+                time_ = datetime(time_.year, month, 1)
+            continue
+
+        day_matches = time_.day in days
+        weekday_matches = time_.isoweekday() in weekdays
+        if by_day and by_weekday:
+            day_matches = day_matches or weekday_matches
+        elif by_weekday:
+            day_matches = weekday_matches
+        if not day_matches:
+            time_ = datetime(time_.year, time_.month, time_.day) +  \
+                timedelta(days=1)
+            continue
+
+        hour = next_value(hours, time_.hour)
+        if hour != time_.hour:
+            day = datetime(time_.year, time_.month, time_.day)
+            time_ = day + timedelta(days=1) if hour is None else  \
+                day.replace(hour=hour)
+            continue
+
+        minute = next_value(minutes, time_.minute)
+        if minute != time_.minute:
+            hour_ = time_.replace(minute=0, second=0)
+            time_ = hour_ + timedelta(hours=1) if minute is None else  \
+                hour_.replace(minute=minute)
+            continue
+
+        second = next_value(seconds, time_.second)
+        if second is None:
+            time_ = time_.replace(second=0) + timedelta(minutes=1)
+            continue
+        return time_.replace(second=second)
+
+    raise CrontabError("CRONTAB never matches")
+
+def datetime_to_epoch(datetime_utc):
+    return calendar.timegm(datetime_utc.timetuple())
+
+def epoch_to_datetime(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).replace(tzinfo=None)
+
+# --------------------------------------------------------------------------- #
+# Timers are kept in "timers" (id: (timer, schedule, fire_time)) and in the
+# "heap" of (fire_time, id).  Changing or removing a Timer leaves its old heap
+# entry in place, which is skipped when it no longer matches "timers"
+
+class TimerScheduler():
+    def __init__(self):
+        self.timers = {}
+        self.heap = []
+
+# Add or replace a Timer, which will next fire after "now".  Missed runs,
+# e.g while the TaskManager was stopped, are not caught up (like Unix crontab).
+# Raises CrontabError
+
+    def add(self, timer, now=None):
+        now = now if now is not None else time.time()
+        schedule = parse_crontab(timer["crontab"])
+        fire_time = datetime_to_epoch(
+            next_fire_time(schedule, epoch_to_datetime(now)))
+        self.timers[timer["id"]] = (timer, schedule, fire_time)
+        heapq.heappush(self.heap, (fire_time, timer["id"]))
+        return fire_time
+
+    def remove(self, timer_id):
+        self.timers.pop(timer_id, None)
+
+# Synchronize with the current list of Timers, only (re)scheduling Timers
+# that are new or whose "command" or "crontab" changed.  Returns a list of
+# (timer, CrontabError) for the Timers that can't be scheduled
+
+    def sync(self, timers, now=None):
+        invalid_timers = []
+        for timer_id in set(self.timers) - {timer["id"] for timer in timers}:
+            self.remove(timer_id)
+        for timer in timers:
+            scheduled = self.timers.get(timer["id"])
+            if scheduled and  \
+                    scheduled[0]["command"] == timer["command"] and  \
+                    scheduled[0]["crontab"] == timer["crontab"]:
+                continue
+            try:
+                self.add(timer, now)
+            except CrontabError as crontab_error:
+                self.remove(timer["id"])
+                invalid_timers.append((timer, crontab_error))
+        return invalid_timers
+
+    def next_time(self):
+        while self.heap:
+            fire_time, timer_id = self.heap[0]
+            scheduled = self.timers.get(timer_id)
+            if scheduled and scheduled[2] == fire_time:
+                return fire_time
+            heapq.heappop(self.heap)  # stale entry
+        return None
+
+# Return a list of (timer, due_time) for the Timers due at "now", each Timer
+# being rescheduled for its next time
+
+    def pop_due(self, now=None):
+        now = now if now is not None else time.time()
+        due_timers = []
+        while self.next_time() is not None and self.next_time() <= now:
+            fire_time, timer_id = heapq.heappop(self.heap)
+            timer, schedule, _ = self.timers[timer_id]
+            due_timers.append((timer, fire_time))
+            fire_time = datetime_to_epoch(
+                next_fire_time(schedule, epoch_to_datetime(now)))
+            self.timers[timer_id] = (timer, schedule, fire_time)
+            heapq.heappush(self.heap, (fire_time, timer_id))
+        return due_timers
+
+    def __len__(self):
+        return len(self.timers)
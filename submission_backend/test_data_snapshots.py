@@ -0,0 +1,47 @@
+from datetime import datetime, timezone
+import os
+import stat
+
+from data_snapshots import *
+
+DATA = """timestamp,price
+2023-04-15 00:05:00,-46.9
+2023-04-15 00:10:00,-40.1
+2023-04-15 00:15:00,-35.2
+"""
+
+def test_snapshot_shared_by_batch_and_read_only(tmp_path):
+    data_file = tmp_path / 'data.csv'
+    data_file.write_text(DATA)
+    snapshot_dir = str(tmp_path / 'snapshots')
+    start = int(datetime(2023, 4, 15, 0, 5, tzinfo=timezone.utc).timestamp())
+
+    path, data = get_snapshot(start, start + 600, snapshot_dir, str(data_file))
+    assert list(data['price']) == [-46.9, -40.1]
+    assert not os.stat(path).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+    inode = os.stat(path).st_ino
+
+    for _ in range(3):  # other Teams in the batch
+        assert get_snapshot(start, start + 600, snapshot_dir, str(data_file))[0] == path
+    assert os.stat(path).st_ino == inode  # not written again
+    assert len(os.listdir(os.path.dirname(path))) == 1
+
+    other_path, _ = get_snapshot(start, start + 900, snapshot_dir, str(data_file))
+    assert other_path != path  # another batch
+
+    SNAPSHOTS.clear()  # another process finds the same snapshot
+    assert get_snapshot(start, start + 600, snapshot_dir, str(data_file))[0] == path
+
+    data_file.write_text(DATA + "2023-04-15 00:20:00,-30.0\n")
+    os.utime(data_file, ns=(0, 0))  # new data version, even with the same mtime
+    path_2, data = get_snapshot(start, start + 600, snapshot_dir, str(data_file))
+    assert path_2 != path and len(data) == 2
+
+def test_prune_snapshots(tmp_path):
+    old_path = tmp_path / 'old.csv'
+    new_path = tmp_path / 'new.csv'
+    for path in [old_path, new_path]:
+        path.write_text(DATA)
+    os.utime(old_path, (0, 0))
+    prune_snapshots(str(tmp_path))
+    assert os.listdir(tmp_path) == ['new.csv']
@@ -0,0 +1,33 @@
+from dynamodb_resources import *
+from pytestutils import *
+
+def test_db_clients_share_a_client_and_skip_bootstrap(
+        dynamodb_tm_client, db_client, team_db_client):
+    with open('.credentials.json') as f:
+        credentials = json.load(f)
+    credentials = (credentials['AWS_ACCESS_KEY_ID'], credentials['AWS_SECRET_ACCESS_KEY'])
+
+    api_calls = []
+    client = dynamodb_tm_client.database.db_resource.meta.client
+    client.meta.events.register(
+        "before-call.dynamodb", lambda **kwargs: api_calls.append(kwargs["model"].name))
+
+    # Like full_eval() running in a warm worker process: no DynamoDB calls
+    database = Database(*credentials)
+    leaderboard = LeaderboardDBClient(*credentials)
+    team_db = TeamDB(*credentials)
+    assert database.get_table(DB_TASKS_TABLE_NAME)
+    assert api_calls == []
+
+    assert leaderboard.dynamodb.meta.client is client
+    assert team_db.dynamodb.meta.client is client
+    resources = []
+    thread = threading.Thread(
+        target=lambda: resources.append(database.db_resource))
+    thread.start()
+    thread.join()
+    assert resources[0] is not database.db_resource  # one resource per thread
+    assert resources[0].meta.client is client
+
+    assert team_db.get_team(1)["team_name"] == "camp dock"
+    assert api_calls == ["GetItem"]
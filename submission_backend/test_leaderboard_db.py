@@ -116,6 +116,17 @@ def test_leaderboard_db_updates(db_client):
     assert updated_submission['submitted_at'] > original_submitted_at
     assert updated_submission['main_trial']['profits'] == [-7.979027700261019, 3.5329587136597684, 2.3123123, 1.34]
 
+    # retrying the same update (idempotency key) doesn't append the trial twice
+    submission3 = dict(submission2)
+    submission3['main_trial'] = dict(submission2['main_trial'],
+        timestamps=[1704068400, 1704068700])
+    for _ in range(2):
+        db_client.upsert_submission(submission3, idempotency_key='eval_task:42')
+    updated_submission = db_client.load_all_submissions(team_id)[0]
+    assert updated_submission['main_trial']['timestamps'][-4:] ==  \
+        [1704067800, 1704068100, 1704068400, 1704068700]
+    assert updated_submission['idempotency_keys'] == ['eval_task:42']
+
     # delete all existing submissions
     db_client.delete_submission(team_id, "098fffa0-bf29-45ef-81c8-b10d72aa62e2")
     existing_submissions = db_client.load_all_submissions(team_id)
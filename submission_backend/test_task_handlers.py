@@ -0,0 +1,94 @@
+from task_handlers import *
+from task_limits import TaskLimitExceeded
+from pytestutils import *
+import pytest
+
+def write_pid(arguments):  # handler run by the worker processes
+    with open(arguments[0], "w") as file:
+        file.write(str(os.getpid()))
+
+def fail(arguments):
+    print("about to fail")
+    raise ValueError("handler failed")
+
+def test_get_handler():
+    assert get_handler("python submission_backend/eval_task.py --task_id 1") ==  \
+        ("eval_task:full_eval_cli", ["--task_id", "1"])
+    assert get_handler("./eval_task.py") == ("eval_task:full_eval_cli", [])
+    assert get_handler("python other.py") == (None, None)
+    assert get_handler("echo eval_task.py") == (None, None)
+
+def test_handlers_run_in_warm_worker_processes(sqlite_tm_client, tmp_path):
+    database = sqlite_tm_client.database
+    register_handler("write_pid.py", "test_task_handlers:write_pid")
+    register_handler("fail.py", "test_task_handlers:fail")
+    pid_files = [tmp_path / f"pid_{index}" for index in range(3)]
+    task_ids = [database.create_task(f"python write_pid.py {pid_file}")
+                for pid_file in pid_files]
+    failed_id = database.create_task("./fail.py")
+
+    run_thread = threading.Thread(target=sqlite_tm_client.run,
+        kwargs={"run_loop_sleep_time": 1, "workers": 1})
+    run_thread.start()
+    start_time = time.time()
+    while any(database.get_task(task_id)["state_"] in ["pending", "running"]
+              for task_id in task_ids + [failed_id]):
+        assert time.time() - start_time < 30, "Handlers did not run"
+        time.sleep(0.1)
+    sqlite_tm_client.stop()
+    run_thread.join()
+    sqlite_tm_client.stop_event.clear()
+
+    assert [database.get_task(task_id)["state_"] for task_id in task_ids] ==  \
+        ["success"] * 3
+    pids = {pid_file.read_text() for pid_file in pid_files}
+    assert len(pids) == 1 and pids != {str(os.getpid())}
+    failed_task = database.get_task(failed_id)
+    assert failed_task["state_"] == "error"
+    assert "handler failed" in failed_task["diagnostic"]
+    assert failed_task["log"]["tail"] == ["about to fail"]  # not on stdout
+
+    for task_id in task_ids + [failed_id]:
+        database.delete_task(task_id)
+    del TASK_HANDLERS["write_pid.py"], TASK_HANDLERS["fail.py"]
+
+def spin(arguments):
+    while True:
+        pass
+
+def test_handler_limits_stop_the_handler_not_the_worker():
+    register_handler("spin.py", "test_task_handlers:spin")
+    handler, arguments = get_handler("python spin.py")
+    with pytest.raises(TaskLimitExceeded, match="Timeout after 1 seconds"):
+        run_handler(handler, arguments, {"timeout": 1})
+    with pytest.raises(TaskLimitExceeded, match="CPU limit of 1 seconds"):
+        run_handler(handler, arguments, {"cpu": 1})
+    usage = run_handler("test_task_handlers:write_pid", [os.devnull])
+    assert usage["wall_ms"] < 1000 and usage["max_rss_kb"] > 0
+    del TASK_HANDLERS["spin.py"]
+
+def sleep_catching_errors(arguments):  # like full_eval()
+    try:
+        time.sleep(10)
+    except Exception:
+        pass
+
+def test_handler_timeout_is_a_limit_breach_not_retried(sqlite_tm_client):
+    import task_retry
+    database = sqlite_tm_client.database
+    register_handler("sleepy.py", "test_task_handlers:sleep_catching_errors")
+    task_retry.RETRY_POLICIES["sleepy.py"] = {"max_attempts": 3}
+    sqlite_tm_client.start_handler_pool(1)
+    try:
+        task_id = database.create_task("python sleepy.py", timeout=1)
+        assert sqlite_tm_client.process_task(database.get_task(task_id))
+    finally:
+        sqlite_tm_client.stop_handler_pool()
+        del TASK_HANDLERS["sleepy.py"], task_retry.RETRY_POLICIES["sleepy.py"]
+
+    task = database.get_task(task_id)
+    assert task["state_"] == "error"
+    assert "Timeout after 1 seconds" in task["diagnostic"]
+    assert task["usage"]["wall_ms"] >= 1000
+    assert "attempts" not in task and "not_before" not in task
+    database.delete_task(task_id)
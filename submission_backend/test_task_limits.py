@@ -0,0 +1,36 @@
+from task_limits import *
+import pytest
+import subprocess
+import sys
+
+def test_get_task_limits():
+    assert get_task_limits({"command": "echo 1"}) == TASK_LIMITS_DEFAULT
+    limits = get_task_limits({"command": "python eval_task.py", "timeout": 5})
+    assert limits["timeout"] == 5
+
+def test_subprocess_limits():
+    usage = run_subprocess(["true"], {"timeout": 5})
+    assert usage.keys() == {"wall_ms", "cpu_ms", "max_rss_kb"}
+
+    with pytest.raises(TaskLimitExceeded, match="Timeout after 1 seconds") as error:
+        run_subprocess(["sh", "-c", "sleep 10 & wait"], {"timeout": 1})
+    assert error.value.usage["wall_ms"] < 5000  # the whole group was killed
+
+    with pytest.raises(TaskLimitExceeded, match="CPU limit of 1 seconds") as error:
+        run_subprocess([sys.executable, "-c", "while True: pass"], {"cpu": 1})
+    assert error.value.usage["cpu_ms"] >= 900
+
+    with pytest.raises(subprocess.CalledProcessError):  # MemoryError
+        run_subprocess([sys.executable, "-c",
+            "import time; time.sleep(0.5); bytearray(1 << 30)"],
+            {"memory": 256 * 1024 * 1024})
+
+def test_builtin_limits():
+    assert run_builtin(["echo", "hello"], {"timeout": 5})["wall_ms"] < 1000
+    with pytest.raises(TaskLimitExceeded, match="Timeout after 1 seconds") as error:
+        run_builtin(["sleep", "10"], {"timeout": 1})
+    assert 1000 <= error.value.usage["wall_ms"] < 5000
+
+    with pytest.raises(subprocess.CalledProcessError):
+        run_subprocess([sys.executable, "-c", "bytearray(512 * 1024 * 1024)"],
+                       {"memory": 256 * 1024 * 1024})
@@ -0,0 +1,51 @@
+from task_logs import *
+import io
+import threading
+import time
+
+def test_task_log_caps_file_and_keeps_tail(tmp_path):
+    path = str(tmp_path / "logs" / "task_000001_1.log.gz")
+    with TaskLog(path, max_bytes=100, tail_lines=3) as task_log:
+        for index in range(100):
+            task_log.write(f"line {index:02d}\n")
+        task_log.write("no newline")
+
+    summary = task_log.summary()
+    assert summary["bytes"] == 96  # whole lines up to "max_bytes"
+    assert summary["dropped"] == 8 * 100 + 10 - 96
+    assert summary["tail"] == ["line 98", "line 99", "no newline"]
+
+    output = io.StringIO()
+    assert read_task_log(path, output)
+    lines = output.getvalue().splitlines()
+    assert lines[:2] == ["line 00", "line 01"]
+    assert lines[-1] == "... 714 bytes not logged, over the 100 byte limit"
+    assert read_task_log_summary(path, tail_lines=1)["tail"] == [lines[-1]]
+
+def test_follow_task_log_while_written(tmp_path):
+    path = str(tmp_path / "task_000002_1.log.gz")
+    done = threading.Event()
+
+    def write_log():
+        with TaskLog(path) as task_log:
+            for index in range(3):
+                task_log.write(f"step {index}\n")
+                time.sleep(TASK_LOG_FLUSH_TIME * 1.5)
+        done.set()
+
+    writer = threading.Thread(target=write_log)
+    writer.start()
+    output = io.StringIO()
+    read_task_log(path, output, follow=True, finished=done.is_set,
+                  poll_time=0.1)
+    writer.join()
+    assert output.getvalue() == "step 0\nstep 1\nstep 2\n"
+
+def test_prune_task_logs_deletes_oldest(tmp_path):
+    for index in range(4):
+        path = tmp_path / f"task_{index:06d}_1.log.gz"
+        path.write_bytes(b"x" * 100)
+        os.utime(path, (index, index))
+    prune_task_logs(str(tmp_path), max_bytes=250)
+    assert sorted(path.name for path in tmp_path.iterdir()) ==  \
+        ["task_000002_1.log.gz", "task_000003_1.log.gz"]
@@ -1,6 +1,14 @@
+import io
+import re
 from task_manager import *
 from pytestutils import *
 
+# The Task semantics are the same for every storage backend
+
+@pytest.fixture(params=["dynamodb", "sqlite"])
+def tm_client(request):
+    return request.getfixturevalue(f"{request.param}_tm_client")
+
 def test_tm_create_task_with_parameters(tm_client: TaskManager):
     task_id = tm_client.database.create_task("cowsay 'great scott'")
 
@@ -42,4 +50,549 @@ def test_updates_task(tm_client: TaskManager):
 def test_tm_create_task(tm_client: TaskManager):
     tasks = tm_client.database.get_tasks()
 
-    assert len(tasks) == 0
\ No newline at end of file
+    assert len(tasks) == 0
+
+def test_tm_runs_pending_tasks_concurrently(tm_client: TaskManager):
+    task_ids = [tm_client.database.create_task("sleep 2") for _ in range(3)]
+
+    run_thread = threading.Thread(
+        target=tm_client.run, kwargs={"run_loop_sleep_time": 1, "workers": 3})
+    start_time = time.time()
+    run_thread.start()
+    while any(tm_client.database.get_task(task_id)["state_"] != "success"
+              for task_id in task_ids):
+        assert time.time() - start_time < 5, "Tasks did not run concurrently"
+        time.sleep(0.1)
+    tm_client.stop()
+    run_thread.join()
+    tm_client.stop_event.clear()
+
+    for task_id in task_ids:
+        tm_client.database.delete_task(task_id)
+    assert len(tm_client.database.get_tasks()) == 0
+
+def test_tm_starts_created_task_without_polling(tm_client: TaskManager):
+    run_thread = threading.Thread(
+        target=tm_client.run, kwargs={"run_loop_sleep_time": 60})
+    run_thread.start()
+    while not tm_client.server:
+        time.sleep(0.01)
+    time.sleep(0.5)  # let the run loop go to sleep
+
+    start_time = time.time()
+    task_id = tm_client.database.create_task("echo notified")
+    while tm_client.database.get_task(task_id)["state_"] != "success":
+        assert time.time() - start_time < 5, "Task waited for the next poll"
+        time.sleep(0.05)
+    tm_client.stop()
+    run_thread.join()
+    tm_client.stop_event.clear()
+
+    tm_client.database.delete_task(task_id)
+    assert len(tm_client.database.get_tasks()) == 0
+
+def test_get_tasks_by_state_with_pagination_and_projection(tm_client: TaskManager):
+    database = tm_client.database
+    task_ids = [database.create_task(f"echo {index}") for index in range(5)]
+    for task_id in task_ids[:3]:
+        database.update_task(str(task_id), {"state_": "success"})
+
+    tasks = database.get_tasks(filter=("state_", "success"), sort_field="id",
+                               page_size=1)
+    assert [int(task["id"]) for task in tasks] == task_ids[:3]
+
+    tasks = database.get_tasks(filter=("state_", "pending"), sort_field="id",
+                               field_names=["id", "state_"], page_size=1)
+    assert [int(task["id"]) for task in tasks] == task_ids[3:]
+    assert all(task.keys() == {"id", "state_"} for task in tasks)
+
+    for task_id in task_ids:
+        database.delete_task(task_id)
+    assert len(database.get_tasks()) == 0
+
+def test_create_task_ids_are_unique_under_concurrency(tm_client: TaskManager):
+    database = tm_client.database
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        task_ids = list(executor.map(
+            lambda index: database.create_task(f"echo {index}"), range(32)))
+
+    assert len(set(task_ids)) == 32
+    assert sorted(task_ids) == list(range(min(task_ids), min(task_ids) + 32))
+
+    block = database.reserve_ids(database.tasks_table, "task", 10)
+    assert block == list(range(max(task_ids) + 1, max(task_ids) + 11))
+
+    for task_id in task_ids:
+        database.delete_task(task_id)
+    assert database.create_task("echo after delete") == block[-1] + 1
+    database.delete_task(block[-1] + 1)
+    assert len(database.get_tasks()) == 0
+
+def test_transition_task_only_from_expected_state(tm_client: TaskManager):
+    database = tm_client.database
+    task_id = database.create_task("echo transition")
+
+    task = database.transition_task(
+        task_id, "pending", "running", {"diagnostic": "started"})
+    assert task["state_"] == "running"
+    assert task["diagnostic"] == "started"
+
+    # A second claim of the same task loses the race and changes nothing
+    assert database.transition_task(task_id, "pending", "running") is None
+    assert database.transition_task(
+        task_id, ["pending", "timer"], "error", {"diagnostic": "lost"}) is None
+    task = database.get_task(task_id)
+    assert task["state_"] == "running"
+    assert task["diagnostic"] == "started"
+
+    task = database.transition_task(task_id, ["pending", "running"], "success")
+    assert task["state_"] == "success"
+
+    # A task finished by its own command is not overwritten by the TaskManager
+    assert not tm_client.process_task(database.get_task(task_id))
+    assert database.get_task(task_id)["state_"] == "success"
+    database.delete_task(task_id)
+
+def test_leases_are_renewed_by_owner_and_requeued_when_expired(
+        tm_client: TaskManager):
+    database = tm_client.database
+    other_tm = TaskManager(database, owner="crashed-host")
+    expired_id = database.create_task("echo expired")
+    leased_id = database.create_task("echo leased")
+    now = int(time.time())
+    database.transition_task(expired_id, "pending", "running",
+        {"owner": other_tm.owner, "lease_expires": now - 1})
+    database.transition_task(leased_id, "pending", "running",
+        {"owner": tm_client.owner, "lease_expires": now + 5})
+
+    # Only the owner can renew a lease or finish the Task
+    other_tm.renew_leases([leased_id])
+    assert database.get_task(leased_id)["lease_expires"] == now + 5
+    tm_client.renew_leases([leased_id])
+    assert database.get_task(leased_id)["lease_expires"] >= now + LEASE_TIME
+
+    tm_client.requeue_expired_tasks()
+    task = database.get_task(expired_id)
+    assert task["state_"] == "pending"
+    assert "crashed-host" in task["diagnostic"]
+    assert database.get_task(leased_id)["state_"] == "running"
+    pending_task_ids = {task["id"] for task in tm_client.get_pending_tasks()}
+    assert str(expired_id) in pending_task_ids
+
+    # The requeued Task is claimed again, with a new owner and lease
+    assert tm_client.process_task(database.get_task(expired_id))
+    task = database.get_task(expired_id)
+    assert task["state_"] == "success"
+    assert task["owner"] == tm_client.owner
+    assert task["diagnostic"] == ""
+
+    for task_id in [expired_id, leased_id]:
+        database.delete_task(task_id)
+
+def test_tm_runs_timer_on_time_without_polling(tm_client: TaskManager):
+    run_thread = threading.Thread(
+        target=tm_client.run, kwargs={"run_loop_sleep_time": 60})
+    run_thread.start()
+    while not tm_client.server:
+        time.sleep(0.01)
+    time.sleep(0.5)  # let the run loop go to sleep
+
+    timer_id = tm_client.database.create_timer("echo tick", "* * * * * *")
+    start_time = time.time()
+    while len(tm_client.database.get_tasks(filter=("command", "echo tick"))) < 2:
+        assert time.time() - start_time < 5, "Timer waited for the next poll"
+        time.sleep(0.1)
+    tm_client.stop()
+    run_thread.join()
+    tm_client.stop_event.clear()
+
+    assert tm_client.database.get_task(timer_id)["run_at"] > "1970"
+    for task in tm_client.database.get_tasks(filter=("command", "echo tick")):
+        tm_client.database.delete_task(task["id"])
+    tm_client.timers.remove(str(timer_id))
+    assert len(tm_client.database.get_tasks()) == 0
+
+def test_timer_fires_once_across_task_managers(tm_client: TaskManager):
+    database = tm_client.database
+    task_managers = [TaskManager(database) for _ in range(2)]
+    timer_id = database.create_timer("echo shared tick", "* * * * * *")
+    timer = database.get_task(timer_id)
+    due_time = time.time()
+
+    barrier = threading.Barrier(len(task_managers))
+    def fire(task_manager):
+        barrier.wait()
+        task_manager.process_timer(dict(timer), due_time)
+    threads = [threading.Thread(target=fire, args=(task_manager,))
+               for task_manager in task_managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for task_manager in task_managers:  # late, or a stale copy of the Timer
+        task_manager.process_timer(dict(timer), due_time)
+    tasks = database.get_tasks(filter=("state_", "pending"))
+    assert [task["command"] for task in tasks] == ["echo shared tick"]
+
+    for task_manager in task_managers:  # next firing
+        task_manager.process_timer(dict(timer), due_time + 1)
+    tasks = database.get_tasks(filter=("state_", "pending"))
+    assert len(tasks) == 2
+
+    for task in tasks + [timer]:
+        database.delete_task(task["id"])
+
+def test_archive_moves_old_finished_tasks(tm_client: TaskManager):
+    database = tm_client.database
+    task_ids = [database.create_task(f"echo {index}") for index in range(5)]
+    old_created_at = (datetime.utcnow() - timedelta(days=30)).isoformat()
+    for task_id in task_ids[:3]:
+        database.update_task(str(task_id),
+            {"state_": "success", "created_at": old_created_at})
+    database.update_task(str(task_ids[3]), {"state_": "success"})
+
+    assert database.archive_tasks(age=86400) == 3
+    assert [int(task["id"]) for task in database.get_tasks(sort_field="id")] ==  \
+        task_ids[3:]
+    archived_tasks = database.get_tasks(archived=True, page_size=1)
+    assert sorted(int(task["id"]) for task in archived_tasks) == task_ids[:3]
+    assert database.get_task(task_ids[0], archived=True)["state_"] == "success"
+    assert database.get_task(task_ids[0]) is None
+    assert database.archive_tasks(age=86400) == 0
+
+    for task_id in task_ids[3:]:
+        database.delete_task(task_id)
+    assert len(database.get_tasks()) == 0
+
+def test_metrics_endpoint(tm_client: TaskManager):
+    database = tm_client.database
+    task_id = database.create_task("echo metrics")
+    tm_client.run_task(database.get_task(task_id))
+
+    response = create_app(tm_client).test_client().get("/metrics")
+    assert response.status_code == 200
+    metrics = response.get_data(as_text=True)
+    backend = type(database).__name__
+    assert f'task_manager_db_operation_seconds_count{{backend="{backend}",'  \
+           f'operation="transition_task"}}' in metrics
+    assert 'task_manager_tasks{state="pending"} 0.0' in metrics
+    assert 'task_manager_tasks{state="success"}' not in metrics
+    assert 'task_manager_task_run_seconds_count{command="echo",state="success"}'  \
+        in metrics
+    assert 'task_manager_task_queue_wait_seconds_bucket{command="echo",le="+Inf"}'  \
+        in metrics
+
+    database.delete_task(task_id)
+
+def test_task_api_create_list_and_get(tm_client: TaskManager):
+    client = create_app(tm_client).test_client()
+    task_ids = []
+    for index in range(5):
+        response = client.post("/tasks", json={"command": f"echo {index}"})
+        assert response.status_code == 201
+        task_ids.append(response.get_json()["id"])
+    assert client.post("/tasks", json={}).status_code == 400
+
+    listed_ids = []
+    cursor = None
+    while True:
+        query = {"state": "pending", "fields": "command", "limit": 2}
+        if cursor:
+            query["cursor"] = cursor
+        body = client.get("/tasks", query_string=query).get_json()
+        assert len(body["tasks"]) <= 2
+        assert all(task.keys() == {"id", "command"} for task in body["tasks"])
+        listed_ids += [task["id"] for task in body["tasks"]]
+        cursor = body["cursor"]
+        if not cursor:
+            break
+    assert sorted(listed_ids) == sorted(task_ids)
+
+    response = client.get(f"/tasks/{task_ids[0]}", query_string={"fields": "state"})
+    assert response.get_json() == {"id": task_ids[0], "state_": "pending"}
+    assert client.get("/tasks/999999").status_code == 404
+    assert client.get("/tasks", query_string={"fields": "nope"}).status_code == 400
+    assert client.get("/tasks", query_string={"cursor": "nope"}).status_code == 400
+
+    for task_id in task_ids:
+        tm_client.database.delete_task(task_id)
+
+def test_task_api_wait_returns_on_state_change(tm_client: TaskManager):
+    database = tm_client.database
+    client = create_app(tm_client).test_client()
+    task_id = database.create_task("echo wait")
+    run_thread = threading.Timer(0.5, tm_client.run_task,
+                                 args=(database.get_task(task_id),))
+    run_thread.start()
+    start_time = time.time()
+    response = client.get(f"/tasks/{task_id}/wait",
+                          query_string={"state": "pending", "timeout": 10})
+    assert time.time() - start_time < TASK_WAIT_POLL_TIME
+    assert response.get_json()["state_"] in ["running", "success"]
+    run_thread.join()
+
+    start_time = time.time()  # no change, until the timeout
+    response = client.get(f"/tasks/{task_id}/wait", query_string={"timeout": 1})
+    assert response.get_json()["state_"] == "success"
+    assert time.time() - start_time >= 1
+    assert client.get("/tasks/999999/wait").status_code == 404
+
+    database.delete_task(task_id)
+
+def test_task_dependencies_fan_out_and_fan_in(tm_client: TaskManager):
+    database = tm_client.database
+    def state(task_id):
+        return database.get_task(task_id)["state_"]
+    def run(task_id):
+        assert tm_client.process_task(database.get_task(task_id))
+
+    parent_id = database.create_task("echo parent")
+    group_ids, join_id = database.create_group(
+        ["echo child 1", "echo child 2"], depends_on=[parent_id],
+        join_command="echo join")
+    assert [state(task_id) for task_id in group_ids + [join_id]] ==  \
+        ["waiting"] * 3
+
+    run(parent_id)
+    assert [state(task_id) for task_id in group_ids] == ["pending"] * 2
+    run(group_ids[0])
+    assert state(join_id) == "waiting"
+    run(group_ids[1])
+    assert state(join_id) == "pending"
+
+    # A Task created after its parent has finished doesn't wait
+    late_id = database.create_task("echo late", depends_on=[parent_id])
+    assert state(late_id) == "pending"
+
+    # Failure cascades to every descendant
+    failed_id = database.create_task("false")
+    child_id = database.create_task("echo child", depends_on=[failed_id])
+    grandchild_id = database.create_task("echo grandchild",
+                                         depends_on=[child_id, parent_id])
+    run(failed_id)
+    assert state(child_id) == "error"
+    assert state(grandchild_id) == "error"
+    assert str(child_id) in database.get_task(grandchild_id)["diagnostic"]
+
+    for task in database.get_tasks():
+        database.delete_task(task["id"])
+
+def test_task_timeout_kills_command_and_records_usage(tm_client: TaskManager):
+    database = tm_client.database
+    task_id = database.create_task("/bin/sleep 10", timeout=1)
+    start_time = time.time()
+    assert tm_client.process_task(database.get_task(task_id))
+    assert time.time() - start_time < 5
+
+    task = database.get_task(task_id)
+    assert task["state_"] == "error"
+    assert "Timeout after 1 seconds" in task["diagnostic"]
+    assert task["usage"]["wall_ms"] >= 1000
+
+    task_id_2 = database.create_task("/bin/true")
+    assert tm_client.process_task(database.get_task(task_id_2))
+    assert database.get_task(task_id_2)["usage"]["cpu_ms"] >= 0
+
+    task_id_3 = database.create_task("sleep 10", timeout=1)  # builtin
+    assert tm_client.process_task(database.get_task(task_id_3))
+    task = database.get_task(task_id_3)
+    assert task["state_"] == "error"
+    assert "Timeout after 1 seconds" in task["diagnostic"]
+
+    for task_id in [task_id, task_id_2, task_id_3]:
+        database.delete_task(task_id)
+
+def test_task_output_captured_to_log(tm_client: TaskManager):
+    database = tm_client.database
+    task_id = database.create_task("/bin/echo hello world")
+    error_id = database.create_task("/bin/ls /no_such_directory")
+    for id in [task_id, error_id]:
+        assert tm_client.process_task(database.get_task(id))
+
+    log = database.get_task(task_id)["log"]
+    assert log["path"].startswith(tm_client.log_dir)
+    assert log["tail"] == ["hello world"] and int(log["bytes"]) == 12
+    output = io.StringIO()
+    read_task_log(log["path"], output)
+    assert output.getvalue() == "hello world\n"
+
+    error_task = database.get_task(error_id)  # stderr too
+    assert error_task["state_"] == "error"
+    assert "no_such_directory" in error_task["log"]["tail"][0]
+
+    for id in [task_id, error_id]:
+        database.delete_task(id)
+
+def test_pending_tasks_ordered_by_priority(tm_client: TaskManager):
+    database = tm_client.database
+    low_id = database.create_task("echo low", priority=-5)
+    normal_id = database.create_task("echo normal")
+    urgent_id = database.create_task("echo urgent", priority=10)
+
+    pending_ids = [int(task["id"]) for task in tm_client.get_pending_tasks()]
+    assert pending_ids == [urgent_id, normal_id, low_id]
+
+    for task_id in pending_ids:
+        database.delete_task(task_id)
+
+def test_coalesce_pending_eval_tasks(tm_client: TaskManager):
+    database = tm_client.database
+    task_ids = [database.create_task(
+        f"python eval_task.py --team_id 1 --commit_hash abc "
+        f"--unix_start {start} --batch_unix_end {start + 100}")
+        for start in [100, 200, 300]]
+
+    pending_tasks = tm_client.get_pending_tasks()
+    assert [int(task["id"]) for task in pending_tasks] == task_ids[:1]
+    assert pending_tasks[0]["command"].endswith(
+        "--unix_start 100 --batch_unix_end 400")
+    assert database.get_task(task_ids[0])["command"] ==  \
+        pending_tasks[0]["command"]
+    for task_id in task_ids[1:]:
+        task = database.get_task(task_id)
+        assert task["state_"] == "superseded"
+        assert task["diagnostic"] == f"Superseded by Task {task_ids[0]}"
+
+    for task_id in task_ids:
+        database.delete_task(task_id)
+
+def test_coalesce_race_between_task_managers(tm_client: TaskManager):
+    database = tm_client.database
+    def create_eval_task(start):
+        return database.create_task(
+            f"python eval_task.py --team_id 1 --commit_hash abc "
+            f"--unix_start {start} --batch_unix_end {start + 100}")
+    def pending_ranges():
+        ranges = [re.search(r"--unix_start (\d+) --batch_unix_end (\d+)",
+                            task["command"]).groups()
+                  for task in database.get_tasks(filter=("state_", "pending"))]
+        return sorted((int(start), int(end)) for start, end in ranges)
+
+    task_ids = [create_eval_task(start) for start in [100, 200, 300]]
+    tasks = database.get_tasks(filter=("state_", "pending"))
+    task_managers = [TaskManager(database) for _ in range(2)]
+    barrier = threading.Barrier(len(task_managers))
+    def coalesce(task_manager):
+        barrier.wait()
+        task_manager.coalesce_pending_tasks([dict(task) for task in tasks])
+    threads = [threading.Thread(target=coalesce, args=(task_manager,))
+               for task_manager in task_managers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert pending_ranges() == [(100, 400)]
+
+    # A stale copy runs the coalesced command
+    started = tm_client.process_start(dict(tasks[0]), "running")
+    assert started[1].endswith("--unix_start 100 --batch_unix_end 400")
+
+    # A TaskManager whose view is stale doesn't supersede a coalesced Task
+    new_task_ids = [create_eval_task(start) for start in [500, 600, 700]]
+    tasks = [database.get_task(task_id) for task_id in new_task_ids]
+    task_managers[0].coalesce_pending_tasks([dict(task) for task in tasks[1:]])
+    assert pending_ranges() == [(500, 600), (600, 800)]
+    task_managers[1].coalesce_pending_tasks([dict(task) for task in tasks[:2]])
+    assert pending_ranges() == [(500, 700), (600, 800)]
+    task_ids += new_task_ids
+
+    for task_id in task_ids:
+        database.delete_task(task_id)
+
+def test_task_depending_on_superseded_task_waits_for_merged_task(
+        tm_client: TaskManager):
+    database = tm_client.database
+    task_ids = [database.create_task(
+        f"python eval_task.py --team_id 1 --commit_hash abc "
+        f"--unix_start {start} --batch_unix_end {start + 100}")
+        for start in [100, 200]]
+    tm_client.get_pending_tasks()
+    assert database.get_task(task_ids[1])["superseded_by"] == str(task_ids[0])
+
+    child_id = database.create_task("echo child", depends_on=[task_ids[1]])
+    assert database.get_task(child_id)["state_"] == "waiting"
+    assert str(child_id) in database.get_task(task_ids[0])["dependents"]
+
+    database.transition_task(task_ids[0], "pending", "success")
+    database.release_dependents(database.get_task(task_ids[0]))
+    assert database.get_task(child_id)["state_"] == "pending"
+
+    for task_id in task_ids + [child_id]:
+        database.delete_task(task_id)
+
+def test_failed_task_retried_after_backoff(tm_client: TaskManager):
+    import task_retry
+    task_retry.RETRY_POLICIES["false"] = {"max_attempts": 2, "backoff": 60}
+    try:
+        database = tm_client.database
+        task_id = database.create_task("/bin/false")
+        assert tm_client.process_task(database.get_task(task_id))
+
+        task = database.get_task(task_id)
+        assert task["state_"] == "pending"
+        assert int(task["attempts"]) == 2
+        assert int(task["not_before"]) >= time.time() + 29
+        assert task["diagnostic"].startswith("Retry 2/2 in ")
+        assert tm_client.get_pending_tasks() == []
+        assert tm_client.retry_time == int(task["not_before"])
+
+        database.update_task(str(task_id), {"not_before": 0})
+        task = database.get_task(task_id)
+        assert tm_client.get_pending_tasks()[0]["id"] == task["id"]
+        assert tm_client.process_task(task)
+        assert database.get_task(task_id)["state_"] == "error"  # no attempts left
+    finally:
+        del task_retry.RETRY_POLICIES["false"]
+    database.delete_task(task_id)
+
+def test_create_task_with_idempotency_key(tm_client: TaskManager):
+    database = tm_client.database
+    task_id = database.create_task("echo once", idempotency_key="test:1")
+    assert database.create_task("echo twice", idempotency_key="test:1") == task_id
+    task_id_2 = database.create_task("echo once", idempotency_key="test:2")
+    assert task_id_2 != task_id
+
+    tasks = {int(task["id"]): task for task in database.get_tasks()}
+    assert sorted(tasks) == sorted([task_id, task_id_2])
+    assert tasks[task_id]["idempotency_key"] == "test:1"
+
+    for task_id in [task_id, task_id_2]:
+        database.delete_task(task_id)
+
+def test_create_task_with_reserved_id(tm_client: TaskManager):
+    database = tm_client.database
+    task_id = database.reserve_task_id()
+    assert database.create_task(f"echo --task_id {task_id}",
+                                task_id=task_id) == task_id
+    task = database.get_task(task_id)
+    assert task["command"] == f"echo --task_id {task_id}"
+    assert task["state_"] == "pending"
+    assert database.create_task("echo next") > task_id
+
+    for task in database.get_tasks():
+        database.delete_task(task["id"])
+
+def test_create_tasks_and_export_import(tm_client: TaskManager):
+    database = tm_client.database
+    commands = [f"echo team {index}" for index in range(60)]
+    task_ids = database.create_tasks(commands)
+    assert task_ids == list(range(task_ids[0], task_ids[0] + 60))
+    database.update_task(str(task_ids[0]), {"lease_expires": 1700000000})
+    tasks = database.get_tasks(sort_field="id")
+    assert [task["command"] for task in tasks] == commands
+    assert {task["state_"] for task in tasks} == {"pending"}
+
+    export_file = io.StringIO()
+    assert export_tasks(database, export_file, segments=3) == 60
+    for task_id in task_ids:
+        database.delete_task(task_id)
+    database.advance_counter(database.tasks_table, "task", 0)  # no-op
+
+    export_file.seek(0)
+    assert import_tasks(database, export_file) == 60
+    imported_tasks = database.get_tasks(sort_field="id")
+    assert imported_tasks == tasks
+    assert database.create_task("echo next") == task_ids[-1] + 1
+
+    for task in database.get_tasks():
+        database.delete_task(task["id"])
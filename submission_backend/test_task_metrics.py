@@ -0,0 +1,28 @@
+from task_metrics import *
+
+def test_histogram_renders_cumulative_buckets():
+    metrics = Metrics()
+    histogram = metrics.histogram("test_seconds", "Test latency", [0.1, 1])
+    histogram.observe(0.05, operation="get")
+    histogram.observe(0.5, operation="get")
+    histogram.observe(5, operation="get")
+    gauge = metrics.gauge("test_tasks", "Test tasks")
+    gauge.set(3, state='say "hi"')
+
+    assert metrics.render().splitlines() == [
+        "# HELP test_seconds Test latency",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{operation="get",le="0.1"} 1',
+        'test_seconds_bucket{operation="get",le="1.0"} 2',
+        'test_seconds_bucket{operation="get",le="+Inf"} 3',
+        'test_seconds_sum{operation="get"} 5.55',
+        'test_seconds_count{operation="get"} 3',
+        "# HELP test_tasks Test tasks",
+        "# TYPE test_tasks gauge",
+        'test_tasks{state="say \\"hi\\""} 3.0']
+
+def test_command_type():
+    assert command_type(
+        "python submission_backend/eval_task.py --team_id 1") == "eval_task.py"
+    assert command_type("./mock_task_get_data.py") == "mock_task_get_data.py"
+    assert command_type("echo 1") == "echo"
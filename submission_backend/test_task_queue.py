@@ -0,0 +1,69 @@
+from task_queue import *
+
+NOW = datetime_to_epoch(datetime(2024, 5, 1))
+
+def make_task(task_id, command, age=0, **fields):
+    created_at = datetime.utcfromtimestamp(NOW - age).isoformat()
+    return {"id": str(task_id), "command": command, "created_at": created_at,
+            **fields}
+
+def eval_command(team_id):
+    return f"python submission_backend/eval_task.py --team_id {team_id} --task_id 1"
+
+def ids(tasks):
+    return [int(task["id"]) for task in tasks]
+
+def test_priority_then_oldest_first():
+    tasks = [make_task(1, eval_command(1)), make_task(2, "echo 2"),
+             make_task(3, "./mock_task_get_data.py"),
+             make_task(4, "echo 4", priority=-1)]
+    assert ids(order_pending_tasks(tasks, now=NOW)) == [3, 1, 2, 4]
+
+def test_fair_share_across_teams():
+    tasks = [make_task(task_id, eval_command(1)) for task_id in range(1, 6)]
+    tasks += [make_task(6, eval_command(2)), make_task(7, eval_command(3))]
+    assert ids(order_pending_tasks(tasks, now=NOW)) == [1, 6, 7, 2, 3, 4, 5]
+
+    # Team 1 already has a Task running, so the other Teams go first
+    running = [make_task(99, eval_command(1))]
+    assert ids(order_pending_tasks(tasks, running, now=NOW))[:3] == [6, 7, 1]
+
+    TEAM_WEIGHTS["1"] = 2
+    assert ids(order_pending_tasks(tasks, now=NOW)) == [1, 2, 6, 7, 3, 4, 5]
+    del TEAM_WEIGHTS["1"]
+
+def test_aging_prevents_starvation():
+    old_task = make_task(1, "echo old", age=PRIORITY_AGING_TIME * 21)
+    tasks = [make_task(2, "./crawler.py"), old_task]
+    assert ids(order_pending_tasks(tasks, now=NOW)) == [1, 2]
+    assert task_team(make_task(3, "echo", team=7)) == "7"
+
+def test_coalesce_tasks_merges_time_ranges():
+    def eval_batch(task_id, team_id, start, end, commit_hash="abc", **fields):
+        return make_task(task_id, f"python eval_task.py --team_id {team_id} "
+            f"--commit_hash {commit_hash} --task_id {task_id} "
+            f"--unix_start {start} --batch_unix_end {end}", **fields)
+
+    tasks = [eval_batch(3, 1, 200, 300), eval_batch(1, 1, 100, 200),
+             eval_batch(2, 2, 100, 200), eval_batch(4, 1, 300, 400),
+             eval_batch(5, 1, 400, 500, commit_hash="def"),
+             eval_batch(6, 1, 500, 600, depends_on=["5"]), make_task(7, "echo")]
+    (task, command, superseded_tasks), = coalesce_tasks(tasks)
+    assert task["id"] == "1"
+    assert command == "python eval_task.py --team_id 1 --commit_hash abc "  \
+                      "--task_id 1 --unix_start 100 --batch_unix_end 400"
+    assert ids(superseded_tasks) == [3, 4]
+
+def test_coalesce_tasks_leaves_gaps_between_time_ranges():
+    def eval_batch(task_id, start, end):
+        return make_task(task_id, f"python eval_task.py --team_id 1 "
+            f"--commit_hash abc --unix_start {start} --batch_unix_end {end}")
+
+    tasks = [eval_batch(1, 100, 200), eval_batch(2, 500, 600),
+             eval_batch(3, 150, 250), eval_batch(4, 100, 200)]
+    (task, command, superseded_tasks), = coalesce_tasks(tasks)
+    assert task["id"] == "1" and command.endswith(
+        "--unix_start 100 --batch_unix_end 250")
+    assert ids(superseded_tasks) == [3, 4]  # not 2, after a gap
+
+    assert coalesce_tasks([eval_batch(1, 100, 200), eval_batch(2, 300, 400)]) == []
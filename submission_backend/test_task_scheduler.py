@@ -0,0 +1,59 @@
+from task_scheduler import *
+import pytest
+
+def fire_times(crontab, after, count=3):
+    schedule = parse_crontab(crontab)
+    times = []
+    for _ in range(count):
+        after = next_fire_time(schedule, after)
+        times.append(after)
+    return times
+
+def test_next_fire_time_for_each_crontab_field():
+    after = datetime(2026, 10, 19, 3, 59, 59, 500000)  # Monday
+
+    assert fire_times("0/15 * * * * *", after) == [
+        datetime(2026, 10, 19, 4, 0, 0), datetime(2026, 10, 19, 4, 0, 15),
+        datetime(2026, 10, 19, 4, 0, 30)]
+    assert fire_times("* 0/1 * * * *", after, 2) == [
+        datetime(2026, 10, 19, 4, 0, 0), datetime(2026, 10, 19, 4, 1, 0)]
+    assert fire_times("0 * 0/4 * * *", after, 2) == [
+        datetime(2026, 10, 19, 4, 0, 0), datetime(2026, 10, 19, 8, 0, 0)]
+    assert fire_times("0 0 0 * * *", after, 1) == [datetime(2026, 10, 20)]
+    assert fire_times("* * * 1 * *", after, 2) == [
+        datetime(2026, 11, 1), datetime(2026, 12, 1)]
+    assert fire_times("0 30 9 * * 1,5", after) == [
+        datetime(2026, 10, 19, 9, 30), datetime(2026, 10, 23, 9, 30),
+        datetime(2026, 10, 26, 9, 30)]
+    assert fire_times("0 0 0 29 2 *", after, 1) == [datetime(2028, 2, 29)]
+
+def test_invalid_crontabs():
+    for crontab in ["* * * * *", "60 * * * * *", "* * * 0 * *", "0/0 * * * * *",
+                    "a * * * * *", "* * * * 13 *"]:
+        with pytest.raises(CrontabError):
+            parse_crontab(crontab)
+    with pytest.raises(CrontabError):
+        next_fire_time(parse_crontab("0 0 0 31 2 *"), datetime(2026, 1, 1))
+
+def test_timer_scheduler_pops_due_timers_in_order():
+    now = datetime_to_epoch(datetime(2026, 10, 19, 4, 0, 1))
+    scheduler = TimerScheduler()
+    invalid_timers = scheduler.sync([
+        {"id": "1", "command": "echo 1", "crontab": "0/10 * * * * *"},
+        {"id": "2", "command": "echo 2", "crontab": "0/3 * * * * *"},
+        {"id": "3", "command": "echo 3", "crontab": "bad"}], now)
+    assert [timer["id"] for timer, _ in invalid_timers] == ["3"]
+    assert len(scheduler) == 2
+    assert scheduler.next_time() == now + 2
+
+    due_timers = scheduler.pop_due(now + 10)
+    assert [(timer["id"], due_time - now) for timer, due_time in due_timers] ==  \
+        [("2", 2), ("1", 9)]
+    assert scheduler.next_time() == now + 11
+
+    # Only changed Timers are rescheduled, removed Timers are forgotten
+    scheduler.sync([
+        {"id": "1", "command": "echo 1", "crontab": "0/10 * * * * *"}], now + 10)
+    assert len(scheduler) == 1
+    assert scheduler.next_time() == now + 19
+    assert scheduler.pop_due(now + 18) == []